@@ -0,0 +1,5 @@
+"""Benchmarks for the groklog process tree. These aren't run as part of the test suite,
+instead each module can be run directly, for example:
+
+    python -m benchmarks.history
+"""
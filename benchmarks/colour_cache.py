@@ -0,0 +1,152 @@
+"""Show every filter of a deep profile in a FilterViewer, page through each one from
+start to end, and report how many colour parses the colour cache saves. Every filter
+passes most of its input on, so the same coloured lines are shown at every depth.
+
+The same pages are also shown as though each filter's view had a cache of its own,
+which is how the cache used to be keyed, to show what sharing it saves.
+
+    python -m benchmarks.colour_cache --depth 4 --lines 50000 --users 10
+"""
+
+import random
+from argparse import ArgumentParser
+from collections import defaultdict
+from time import perf_counter
+from typing import List
+
+from asciimatics.event import KeyboardEvent
+from asciimatics.screen import Screen
+from asciimatics.widgets import Widget
+
+from groklog.process_node import GenericProcessIO, SubstringFilterNode
+from groklog.process_node.reactor import reactor
+from groklog.ui import filter_viewer
+from groklog.ui.colour_cache import ColourCache
+from groklog.ui.filter_viewer import FilterViewer
+
+LEVELS = [("DEBUG", 36), ("INFO", 32), ("WARNING", 33), ("ERROR", 31)]
+COMPONENTS = ["api", "db", "auth", "cache", "worker", "scheduler"]
+MESSAGES = [
+    "request handled",
+    "connection opened",
+    "connection closed",
+    "retrying after failure",
+    "cache miss for user profile",
+    "job queued",
+    "job finished",
+    "slow query detected",
+]
+
+
+class Canvas:
+    unicode_aware = False
+
+    def clear_buffer(self, *args):
+        pass
+
+    def paint(self, *args, **kwargs):
+        pass
+
+
+class Frame:
+    palette = defaultdict(lambda: (7, 0, 0))
+    canvas = Canvas()
+
+
+def make_lines(count: int, users: int, seed: int) -> bytes:
+    """Coloured log lines, made of a limited vocabulary so that lines repeat, as they
+    do in real logs without timestamps"""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        level, colour = rng.choice(LEVELS)
+        component = rng.choice(COMPONENTS)
+        lines.append(
+            f"\x1b[{colour}m{level:<7}\x1b[0m \x1b[1m{component}\x1b[0m "
+            f"{rng.choice(MESSAGES)} for user{rng.randrange(users)}\n"
+        )
+    return "".join(lines).encode()
+
+
+def build_profile(depth: int) -> List[SubstringFilterNode]:
+    """A chain of filters under a process, each dropping one component's lines"""
+    root = GenericProcessIO(name="root", command="cat")
+    parent = root
+    filters = []
+    for level in range(depth):
+        node = SubstringFilterNode(
+            name=f"depth{level}",
+            substring=COMPONENTS[level % len(COMPONENTS)] if level else "",
+            invert=bool(level),
+        )
+        parent.add_child(node)
+        filters.append(node)
+        parent = node
+    return filters
+
+
+def page_through(filters: List[SubstringFilterNode], shared: bool, height: int):
+    """Page through every filter's view from start to end
+    :param shared: If False, each view is given a colour cache of its own
+    :return: The number of lines that were looked up in the cache, and the number of
+        them that had to be parsed
+    """
+    viewers = []
+    for node in filters:
+        viewer = FilterViewer(filter=node, height=Widget.FILL_FRAME)
+        viewer.register_frame(Frame())
+        viewer.set_layout(x=0, y=0, offset=0, w=200, h=height)
+        viewers.append(viewer)
+    reactor.run(lambda: None)
+
+    shared_cache = filter_viewer.colour_cache
+    caches = [shared_cache if shared else ColourCache() for _ in viewers]
+    try:
+        for viewer, cache in zip(viewers, caches):
+            filter_viewer.colour_cache = cache
+            viewer.process_event(KeyboardEvent(Screen.KEY_HOME))
+            while True:
+                viewer._visible_rows()
+                if viewer._follow:
+                    break
+                viewer.process_event(KeyboardEvent(Screen.KEY_PAGE_DOWN))
+    finally:
+        filter_viewer.colour_cache = shared_cache
+
+    stats = [cache.stats() for cache in (caches[:1] if shared else caches)]
+    return sum(s.hits + s.misses for s in stats), sum(s.misses for s in stats)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=50_000)
+    parser.add_argument("--height", type=int, default=50)
+    parser.add_argument(
+        "--users",
+        type=int,
+        default=10,
+        help="How many users the lines mention. More users means fewer repeats.",
+    )
+    args = parser.parse_args()
+
+    filters = build_profile(args.depth)
+    filters[0]._record_and_publish(make_lines(args.lines, args.users, seed=0))
+    print(f"Lines at each depth: {[node.line_count() for node in filters]}")
+
+    print(f"{'cache':>12} {'lookups':>10} {'parsed':>10} {'saved':>10} {'seconds':>10}")
+    for shared in (False, True):
+        start = perf_counter()
+        lookups, parsed = page_through(filters, shared, args.height)
+        elapsed = perf_counter() - start
+        name = "shared" if shared else "per filter"
+        print(
+            f"{name:>12} {lookups:>10} {parsed:>10} {lookups - parsed:>10} "
+            f"{elapsed:>10.2f}"
+        )
+
+    filters[0].parent.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Push a large amount of data through a ProcessNode and report the cost of recording
+and publishing each chunk as the history grows. With an O(1) history the per-chunk
+cost should stay flat from the first gigabyte to the last.
+
+    python -m benchmarks.history --gigabytes 2
+"""
+
+from argparse import ArgumentParser
+from time import perf_counter
+
+from groklog.process_node import HistoryBackend, ProcessNode
+
+
+class InProcessNode(ProcessNode):
+    """A ProcessNode without a process, so that only the recording and publishing of
+    data is measured."""
+
+    def write(self, data: bytes):
+        self._record_and_publish(data)
+
+    def close(self, timeout=None):
+        self._bytes_history.close()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--gigabytes", type=float, default=1)
+    parser.add_argument("--chunk-size", type=int, default=ProcessNode._READ_MAX_BYTES)
+    parser.add_argument("--buckets", type=int, default=10)
+    parser.add_argument(
+        "--history-backend",
+        choices=[backend.value for backend in HistoryBackend],
+        default=HistoryBackend.MEMORY.value,
+    )
+    parser.add_argument(
+        "--string-subscriber",
+        action="store_true",
+        help="Subscribe to STRING_DATA_STREAM, so that the output is decoded",
+    )
+    args = parser.parse_args()
+
+    node = InProcessNode(
+        name="benchmark",
+        command="",
+        history_backend=HistoryBackend(args.history_backend),
+    )
+
+    def string_subscriber(data: str):
+        """Subscribers are only held by weak references, so this is a local that lives
+        as long as the run does, rather than a lambda"""
+
+    if args.string_subscriber:
+        node.subscribe(node.Topic.STRING_DATA_STREAM, string_subscriber)
+    chunk = (b"2021-07-01 12:00:00 INFO something happened\n" * args.chunk_size)[
+        : args.chunk_size
+    ]
+    total_chunks = int(args.gigabytes * 1024**3 / args.chunk_size)
+    chunks_per_bucket = max(total_chunks // args.buckets, 1)
+
+    print(f"Pushing {total_chunks} chunks of {args.chunk_size} bytes")
+    print(f"{'history (MB)':>14} {'us/chunk':>10} {'MB/s':>10}")
+    for _ in range(args.buckets):
+        start = perf_counter()
+        for _ in range(chunks_per_bucket):
+            node.write(chunk)
+        elapsed = perf_counter() - start
+
+        history_mb = len(node._bytes_history) / 1024**2
+        us_per_chunk = elapsed / chunks_per_bucket * 1e6
+        mb_per_second = chunks_per_bucket * args.chunk_size / elapsed / 1024**2
+        print(f"{history_mb:>14.0f} {us_per_chunk:>10.1f} {mb_per_second:>10.0f}")
+
+    node.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Pipe a firehose of output through a GenericProcessIO, and report how quickly the
+node reads, records and publishes it.
+
+    python -m benchmarks.read_path --megabytes 2000
+
+Run it with --no-coalesce to publish every read on its own, and with --subscribers to
+see the cost of fanning each chunk out to more subscribers.
+"""
+
+from argparse import ArgumentParser
+from threading import Event
+from time import perf_counter
+
+from groklog.process_node import CoalescePolicy, GenericProcessIO
+
+LINE = b"2021-07-01 12:00:00 INFO something happened\n"
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--megabytes", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--subscribers", type=int, default=1)
+    parser.add_argument(
+        "--no-coalesce",
+        action="store_true",
+        help="Publish every read as soon as it's read",
+    )
+    args = parser.parse_args()
+
+    total_bytes = args.megabytes * 1024**2
+    policy = CoalescePolicy(max_latency=0) if args.no_coalesce else CoalescePolicy()
+    command = f"yes '{LINE.decode().strip()}' | head -c {total_bytes}"
+
+    print(f"Reading {args.megabytes} MB of `yes` output")
+    print(f"{'run':>4} {'seconds':>10} {'MB/s':>10} {'publishes':>10}")
+    for run in range(args.runs):
+        done = Event()
+        received = 0
+        publishes = 0
+
+        def count(data: bytes):
+            nonlocal received, publishes
+            received += len(data)
+            publishes += 1
+            if received >= total_bytes:
+                done.set()
+
+        start = perf_counter()
+        node = GenericProcessIO(name="benchmark", command=command, coalesce=policy)
+        node.subscribe(node.Topic.BYTES_DATA_STREAM, count)
+        # Subscribers are held by weak references, so the extra ones are kept here
+        extra_subscribers = [lambda data: None for _ in range(args.subscribers - 1)]
+        for subscriber in extra_subscribers:
+            node.subscribe(node.Topic.BYTES_DATA_STREAM, subscriber)
+        done.wait()
+        elapsed = perf_counter() - start
+        node.close()
+
+        mb_per_second = total_bytes / elapsed / 1024**2
+        print(f"{run:>4} {elapsed:>10.2f} {mb_per_second:>10.0f} {publishes:>10}")
+
+
+if __name__ == "__main__":
+    main()
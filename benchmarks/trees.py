@@ -0,0 +1,514 @@
+"""Build process trees of different widths and depths with a FilterManager, feed them
+synthetic log lines at fixed rates, and report how the tree holds up: end-to-end
+latency percentiles, the highest rate it can sustain, CPU time per node, and how much
+the RSS grows. The results are written as JSON, so that releases can be compared.
+
+    python -m benchmarks.trees --shapes 1x1 4x1 1x4 4x4 --rates 10000 100000 0
+    python -m benchmarks.trees --output new.json --baseline old.json
+
+A shape of 4x3 is four branches off the root, each a chain of three filters. A rate of
+0 feeds the tree as fast as it will take the lines. Each line carries the time it was
+due to be written, so latency includes any time the generator spent blocked on a tree
+that couldn't keep up, instead of hiding it.
+
+With --viewers, every leaf is watched by a FilterViewer whose queue is drained by a
+thread standing in for the UI, so latency is measured up to the point the lines are
+brought into view. Nothing is drawn, so no terminal is needed.
+"""
+
+import json
+import os
+import platform
+import sys
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from threading import Event, Thread
+from time import monotonic, perf_counter, perf_counter_ns, sleep, thread_time
+from typing import Dict, List, Tuple
+
+import psutil
+
+from groklog.filter_manager import FilterManager
+from groklog.filter_manager.filter_manager import ROOT_FILTER_NAME
+from groklog.process_node import (
+    GenericProcessIO,
+    LineBatch,
+    ProcessNode,
+    StreamInputIO,
+    SubstringFilterNode,
+)
+from groklog.process_node.reactor import reactor
+from groklog.version import __version__
+
+PAD = "INFO benchmark line for the process tree benchmark "
+SAMPLE_INTERVAL = 0.05
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+@dataclass
+class Shape:
+    width: int
+    depth: int
+    kind: str
+
+    @classmethod
+    def parse(cls, text: str, kind: str) -> "Shape":
+        width, depth = text.lower().split("x")
+        return cls(int(width), int(depth), kind)
+
+    def __str__(self):
+        return f"{self.width}x{self.depth}-{self.kind}"
+
+
+@dataclass
+class RunResult:
+    shape: str
+    target_lines_per_second: int
+    """0 if the tree was fed as fast as it would take the lines"""
+    lines: int
+    leaves: int
+    generate_seconds: float
+    achieved_lines_per_second: float
+    drain_seconds: float
+    """How long after the last line was written every leaf finished"""
+    delivered_lines_per_second: float
+    complete: bool
+    """Whether every leaf received every line"""
+    latency_ms: Dict[str, float]
+    leaf_p99_ms: Dict[str, float]
+    measured_at: str
+    cpu_seconds: Dict[str, float]
+    """CPU time of the reactor thread, the generator thread, the whole groklog process,
+    and of each filter's own process"""
+    rss_mb: Dict[str, float]
+    onboard_seconds: float
+    """How long a new filter took to catch up on the root's whole history"""
+    viewer_frame_ms: Dict[str, float] = field(default_factory=dict)
+    sustained: bool = False
+
+
+class LatencyRecorder:
+    """Records when each batch of lines reached a leaf. The lines are only parsed
+    after the run, so that the reactor thread does as little extra work as possible.
+    Subscribers are weakly referenced, so this must be kept around for the run."""
+
+    def __init__(self):
+        self.batches: List[Tuple[int, List[str]]] = []
+
+    def record(self, batch: LineBatch):
+        self.batches.append((perf_counter_ns(), batch.lines))
+
+    def latencies_ns(self) -> List[int]:
+        return [
+            received - int(line[13:32])
+            for received, lines in self.batches
+            for line in lines
+        ]
+
+
+class ViewerDrain:
+    """Stands in for the UI: every frame, it brings the lines each FilterViewer has
+    queued into view, the way FilterViewer.update does, records when they got there,
+    and renders the lines that would be on screen"""
+
+    def __init__(self, viewers: list, fps: int):
+        self.viewers = viewers
+        self.recorders = [LatencyRecorder() for _ in viewers]
+        self.frame_ns: List[int] = []
+        self._interval = 1 / fps
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="ViewerDrain", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._drain()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self._drain()
+
+    def _drain(self):
+        start = perf_counter_ns()
+        for viewer, recorder in zip(self.viewers, self.recorders):
+            shown_line = viewer._line_count()
+            viewer._take_new_lines(perf_counter())
+            # Viewers only read the lines they show, but every line's latency is
+            # recorded, so the new lines are read from the leaf here
+            new_lines = viewer.filter.get_lines(shown_line, viewer._line_count()).lines
+            now = perf_counter_ns()
+            recorder.batches.append((now, new_lines))
+            viewer._visible_rows()
+        self.frame_ns.append(perf_counter_ns() - start)
+
+
+class Sampler:
+    """Samples the RSS of groklog, and the CPU time of each filter's process, in the
+    background. Filter processes exit as soon as their input ends, so the last sample
+    before they exit is the one that's kept."""
+
+    def __init__(self, nodes: List[ProcessNode]):
+        self.processes = {
+            node.name: psutil.Process(node._process.pid)
+            for node in nodes
+            if isinstance(node, GenericProcessIO)
+        }
+        self.cpu_seconds: Dict[str, float] = {name: 0.0 for name in self.processes}
+        self.peak_rss = rss_bytes()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name="Sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self._sample()
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, rss_bytes())
+        for name, process in self.processes.items():
+            try:
+                cpu_times = process.cpu_times()
+            except psutil.NoSuchProcess:
+                continue
+            self.cpu_seconds[name] = cpu_times.user + cpu_times.system
+
+
+def rss_bytes() -> int:
+    return psutil.Process().memory_info().rss
+
+
+def reactor_cpu_seconds() -> float:
+    """Return the CPU time the reactor thread has used"""
+    result = []
+    reactor.run(lambda: result.append(thread_time()))
+    return result[0]
+
+
+def percentiles(values_ns: List[int]) -> Dict[str, float]:
+    if not values_ns:
+        return {}
+    values = sorted(values_ns)
+    result = {}
+    for percentile in PERCENTILES:
+        index = min(int(len(values) * percentile / 100), len(values) - 1)
+        result[f"p{percentile:g}"] = values[index] / 1e6
+    result["max"] = values[-1] / 1e6
+    return result
+
+
+def make_lines(first: int, count: int, stamps_ns: List[int], line_bytes: int) -> bytes:
+    """Make log lines that carry their sequence number and the time they were due"""
+    pad = (PAD * (line_bytes // len(PAD) + 1))[: max(line_bytes - 34, 0)]
+    return "".join(
+        f"{first + i:012d} {stamp:019d} {pad}\n" for i, stamp in enumerate(stamps_ns)
+    ).encode()
+
+
+def generate(fd: int, rate: int, seconds: float, line_bytes: int) -> Tuple[int, float]:
+    """Write lines into the pipe at the rate, or as fast as possible if the rate is 0
+    :return: The number of lines written, and the CPU time this spent doing it
+    """
+    cpu_start = thread_time()
+    batch = 1000
+    sent = 0
+    start_ns = perf_counter_ns()
+    end_ns = start_ns + int(seconds * 1e9)
+    while True:
+        now_ns = perf_counter_ns()
+        if now_ns >= end_ns:
+            break
+        if rate:
+            due = int((now_ns - start_ns) * rate / 1e9)
+            if due <= sent:
+                sleep(0.001)
+                continue
+            count = min(due - sent, batch * 10)
+            stamps = [start_ns + int((sent + i) * 1e9 / rate) for i in range(count)]
+        else:
+            count = batch
+            stamps = [now_ns] * count
+        data = memoryview(make_lines(sent, count, stamps, line_bytes))
+        while data:
+            data = data[os.write(fd, data) :]
+        sent += count
+    return sent, thread_time() - cpu_start
+
+
+def build_tree(filter_manager: FilterManager, shape: Shape) -> List[ProcessNode]:
+    """Build the branches of the shape off the root
+    :return: The last filter of each branch
+    """
+    leaves = []
+    for branch in range(shape.width):
+        parent = filter_manager.root_filter
+        for level in range(shape.depth):
+            name = f"b{branch}d{level}"
+            native = shape.kind == "native" or (
+                shape.kind == "mixed" and level % 2 == 0
+            )
+            if native:
+                parent = filter_manager.create_native_filter(
+                    name=name,
+                    filter_type=SubstringFilterNode.TYPE,
+                    options={"substring": "INFO", "invert": False},
+                    parent=parent,
+                )
+            else:
+                parent = filter_manager.create_filter(
+                    name=name, command="cat", parent=parent
+                )
+        leaves.append(parent)
+    return leaves
+
+
+def run(shape: Shape, rate: int, args) -> RunResult:
+    rss_start = rss_bytes()
+    read_fd, write_fd = os.pipe()
+    root = StreamInputIO(name=ROOT_FILTER_NAME, fd=read_fd, command="benchmark")
+    filter_manager = FilterManager(shell=root)
+    leaves = build_tree(filter_manager, shape)
+
+    drain = None
+    recorders = []
+    if args.viewers:
+        # The UI is only imported when it's benchmarked
+        from asciimatics.widgets import Widget
+
+        from groklog.ui.filter_viewer import FilterViewer
+
+        class Canvas:
+            unicode_aware = False
+
+        class Frame:
+            canvas = Canvas()
+
+        viewers = []
+        for leaf in leaves:
+            viewer = FilterViewer(filter=leaf, height=Widget.FILL_FRAME)
+            viewer.register_frame(Frame())
+            viewer.set_layout(x=0, y=0, offset=0, w=200, h=50)
+            viewers.append(viewer)
+        drain = ViewerDrain(viewers, fps=args.fps)
+        recorders = drain.recorders
+    else:
+        for leaf in leaves:
+            recorder = LatencyRecorder()
+            leaf.subscribe(ProcessNode.Topic.LINE_STREAM, recorder.record)
+            recorders.append(recorder)
+
+    sampler = Sampler(list(filter_manager))
+    process_cpu_start = sum(os.times()[:2])
+    root.start()
+    reactor_cpu_start = reactor_cpu_seconds()
+
+    generate_start = monotonic()
+    lines, generator_cpu = generate(write_fd, rate, args.seconds, args.line_bytes)
+    generate_seconds = monotonic() - generate_start
+    os.close(write_fd)
+
+    complete = all(leaf.wait_for_output_end(timeout=args.timeout) for leaf in leaves)
+    drain_seconds = monotonic() - generate_start - generate_seconds
+    reactor_cpu = reactor_cpu_seconds() - reactor_cpu_start
+    process_cpu = sum(os.times()[:2]) - process_cpu_start
+    if drain is not None:
+        drain.stop()
+    sampler.stop()
+
+    # Time a new filter catching up on everything the root has output
+    onboard_start = monotonic()
+    late = SubstringFilterNode(name="onboard", substring="INFO")
+    root.add_child(late)
+    late.wait_for_output_end(timeout=args.timeout)
+    onboard_seconds = monotonic() - onboard_start
+
+    leaf_latencies = [recorder.latencies_ns() for recorder in recorders]
+    complete = complete and all(len(ns) == lines for ns in leaf_latencies)
+    filter_manager.close()
+    os.close(read_fd)
+
+    all_latencies = [ns for latencies in leaf_latencies for ns in latencies]
+    rss_end = rss_bytes()
+    result = RunResult(
+        shape=str(shape),
+        target_lines_per_second=rate,
+        lines=lines,
+        leaves=len(leaves),
+        generate_seconds=generate_seconds,
+        achieved_lines_per_second=lines / generate_seconds,
+        drain_seconds=drain_seconds,
+        delivered_lines_per_second=lines / (generate_seconds + drain_seconds),
+        complete=complete,
+        latency_ms=percentiles(all_latencies),
+        leaf_p99_ms={
+            leaf.name: percentiles(latencies).get("p99", 0.0)
+            for leaf, latencies in zip(leaves, leaf_latencies)
+        },
+        measured_at="viewer" if args.viewers else "subscriber",
+        cpu_seconds={
+            "reactor": reactor_cpu,
+            "generator": generator_cpu,
+            "groklog": process_cpu - generator_cpu,
+            **sampler.cpu_seconds,
+        },
+        rss_mb={
+            "start": rss_start / 1024**2,
+            "peak": sampler.peak_rss / 1024**2,
+            "end": rss_end / 1024**2,
+            "growth": (rss_end - rss_start) / 1024**2,
+        },
+        onboard_seconds=onboard_seconds,
+    )
+    if drain is not None:
+        result.viewer_frame_ms = percentiles(drain.frame_ns)
+    result.sustained = (
+        rate > 0
+        and complete
+        and result.achieved_lines_per_second >= rate * 0.95
+        and result.latency_ms.get("p99", 0.0) <= args.latency_budget_ms
+    )
+    return result
+
+
+def summarize(results: List[RunResult]) -> Dict[str, dict]:
+    """The highest rate each shape sustained, and its throughput when unthrottled"""
+    summary = {}
+    for result in results:
+        shape = summary.setdefault(
+            result.shape,
+            {"max_sustained_lines_per_second": 0, "unthrottled_lines_per_second": None},
+        )
+        if result.sustained:
+            shape["max_sustained_lines_per_second"] = max(
+                shape["max_sustained_lines_per_second"],
+                result.target_lines_per_second,
+            )
+        if result.target_lines_per_second == 0:
+            shape["unthrottled_lines_per_second"] = result.delivered_lines_per_second
+    return summary
+
+
+def compare(results: List[RunResult], baseline_path: Path, tolerance: float) -> int:
+    """Print every run that got slower than the same run in the baseline
+    :return: The number of regressions
+    """
+    baseline = {
+        (run["shape"], run["target_lines_per_second"]): run
+        for run in json.loads(baseline_path.read_text())["runs"]
+    }
+    regressions = 0
+    for result in results:
+        old = baseline.get((result.shape, result.target_lines_per_second))
+        if old is None:
+            continue
+        checks = [
+            ("p99 ms", old["latency_ms"].get("p99"), result.latency_ms.get("p99"), 1),
+            (
+                "lines/s",
+                old["delivered_lines_per_second"],
+                result.delivered_lines_per_second,
+                -1,
+            ),
+            ("onboard s", old["onboard_seconds"], result.onboard_seconds, 1),
+        ]
+        for metric, before, after, direction in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before * direction
+            if change > tolerance:
+                regressions += 1
+                print(
+                    f"Regression in {result.shape} at {result.target_lines_per_second}"
+                    f" lines/s: {metric} went from {before:.3g} to {after:.3g}"
+                )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--shapes", nargs="+", default=["1x1", "4x1", "1x4", "4x4"])
+    parser.add_argument(
+        "--kind",
+        choices=["native", "process", "mixed"],
+        default="mixed",
+        help="Whether the filters are native filters, `cat` processes, or alternate",
+    )
+    parser.add_argument(
+        "--rates",
+        nargs="+",
+        type=int,
+        default=[10000, 100000, 0],
+        help="Lines per second to feed each tree. 0 is as fast as possible.",
+    )
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--line-bytes", type=int, default=100)
+    parser.add_argument(
+        "--latency-budget-ms",
+        type=float,
+        default=100,
+        help="The p99 latency a rate must stay under to count as sustained",
+    )
+    parser.add_argument("--viewers", action="store_true")
+    parser.add_argument("--fps", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", type=Path, help="Write the JSON results here")
+    parser.add_argument("--baseline", type=Path, help="Results to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="How much worse than the baseline a metric can get, as a fraction",
+    )
+    args = parser.parse_args()
+
+    header = (
+        f"{'shape':>14} {'target/s':>10} {'achieved/s':>11} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'max ms':>8} {'reactor s':>10} {'RSS +MB':>8} {'ok':>3}"
+    )
+    print(header, file=sys.stderr)
+    results = []
+    for shape_text in args.shapes:
+        shape = Shape.parse(shape_text, args.kind)
+        for rate in args.rates:
+            result = run(shape, rate, args)
+            results.append(result)
+            latency = result.latency_ms
+            print(
+                f"{result.shape:>14} {rate:>10} "
+                f"{result.achieved_lines_per_second:>11.0f} "
+                f"{latency.get('p50', 0):>8.1f} {latency.get('p99', 0):>8.1f} "
+                f"{latency.get('max', 0):>8.1f} "
+                f"{result.cpu_seconds['reactor']:>10.2f} "
+                f"{result.rss_mb['growth']:>8.1f} "
+                f"{'yes' if result.sustained else 'no':>3}",
+                file=sys.stderr,
+            )
+
+    report = {
+        "groklog_version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+        },
+        "summary": summarize(results),
+        "runs": [asdict(result) for result in results],
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.baseline is not None and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,19 @@
 import os
 import sys
 
-from asciimatics.exceptions import ResizeScreenError
-from asciimatics.scene import Scene
-from asciimatics.screen import Screen
-
 from groklog.args import parse_args
 from groklog.filter_manager import FilterManager
-from groklog.process_node import ShellProcessIO
-from groklog.ui.scenes import FilterCreator, GrokLog, scene_names
+from groklog.process_node import (
+    BackpressurePolicy,
+    CoalescePolicy,
+    FileReplayIO,
+    HistoryBackend,
+    OverflowPolicy,
+    RetentionPolicy,
+    ShellProcessIO,
+)
+from groklog.process_node.history import set_session_parent
+from groklog.process_node.tracing import tracer
 
 from .version import __version__
 
@@ -19,41 +24,100 @@ def main():
     os.environ.setdefault("ESCDELAY", "0")
     args = parse_args()
 
-    filter_manager = FilterManager(shell=ShellProcessIO())
-
-    # Load configuration
+    retention = RetentionPolicy(
+        max_bytes=args.history_max_bytes,
+        max_lines=args.history_max_lines,
+        max_age=args.history_max_age,
+    )
+    history_backend = HistoryBackend(args.history_backend)
+    backpressure = BackpressurePolicy(
+        high_water_mark=args.backpressure_high_water_mark,
+        overflow=OverflowPolicy(args.backpressure_overflow),
+    )
+    coalesce = CoalescePolicy(
+        max_latency=args.coalesce_latency, max_bytes=args.coalesce_max_bytes
+    )
+    set_session_parent(args.history_directory)
     save_path = args.profile_directory / (args.profile + ".json")
-    if save_path.is_file():
-        filter_manager.load_profile(save_path)
-
-    def groklog(screen: Screen, scene):
-        scenes = [
-            Scene(
-                [GrokLog(screen, filter_manager=filter_manager)],
-                duration=-1,
-                name=scene_names.SHELL_VIEW,
-            ),
-            Scene(
-                [
-                    FilterCreator(
-                        screen, filter_manager=filter_manager, profile_path=save_path
-                    )
-                ],
-                duration=-1,
-                name=scene_names.FILTER_CREATOR_SCENE,
-            ),
-        ]
-
-        screen.play(scenes, stop_on_resize=True, start_scene=scene, allow_int=True)
-
-    last_scene = None
-    while True:
-        try:
-            Screen.wrapper(func=groklog, catch_interrupt=True, arguments=[last_scene])
-            print("Thank you for using GrokLog!")
-            sys.exit(0)
-        except ResizeScreenError as e:
-            last_scene = e.scene
+
+    if args.headless:
+        # The UI is only imported when it's run, so headless runs never import
+        # asciimatics
+        from groklog.headless import DEFAULT_RETENTION, open_input, run_headless
+
+        if not retention.is_bounded:
+            retention = DEFAULT_RETENTION
+
+    if args.replay is not None:
+        root = FileReplayIO(
+            args.replay,
+            speed=args.replay_speed,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+    elif args.headless:
+        root = open_input(
+            args.input_command,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+    else:
+        root = ShellProcessIO(
+            retention=retention, history_backend=history_backend, coalesce=coalesce
+        )
+
+    filter_manager = FilterManager(
+        shell=root,
+        default_retention=retention,
+        default_history_backend=history_backend,
+        default_backpressure=backpressure,
+        default_coalesce=coalesce,
+    )
+
+    profiler = None
+    if args.cpu_profile_directory is not None:
+        from groklog.profiling import Profiler
+
+        profiler = Profiler(args.cpu_profile_directory)
+        profiler.start()
+    if args.trace_file is not None:
+        tracer.start()
+
+    try:
+        if args.headless:
+            sys.exit(run_headless(filter_manager, save_path, args.output_directory))
+
+        from groklog.ui.colour_cache import ColourCachePolicy
+        from groklog.ui.run import run_ui
+
+        # Load configuration. Chains of filters that nobody has opened a tab for yet
+        # run as a single stage until they're opened.
+        if save_path.is_file():
+            filter_manager.load_profile(save_path)
+            filter_manager.optimize()
+        if isinstance(root, FileReplayIO):
+            root.start()
+        colour_cache_policy = ColourCachePolicy(
+            max_lines=args.colour_cache_max_lines,
+            max_bytes=args.colour_cache_max_bytes,
+        )
+        run_ui(
+            filter_manager,
+            save_path,
+            profiler=profiler,
+            colour_cache_policy=colour_cache_policy,
+        )
+    finally:
+        if profiler is not None:
+            paths = profiler.stop()
+            print(f"Wrote {len(paths)} profiling files to {args.cpu_profile_directory}")
+        if args.trace_file is not None:
+            tracer.stop()
+            event_count = tracer.export(args.trace_file)
+            print(tracer.format_summary())
+            print(f"Wrote a trace of {event_count} events to {args.trace_file}")
 
 
 if __name__ == "__main__":
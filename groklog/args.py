@@ -1,8 +1,13 @@
+import os
 from argparse import ArgumentParser
 from pathlib import Path
 
 import appdirs
 
+from groklog.process_node import HistoryBackend, OverflowPolicy, PlaybackSpeed
+from groklog.process_node.tracing import TRACE_ENV_VAR
+from groklog.profiling import PROFILE_ENV_VAR
+
 long_description = """
 Welcome to GrokLog!
 
@@ -30,10 +35,169 @@ def parse_args():
 
     parser.add_argument(
         "--profile-directory",
+        type=Path,
         default=default_save_path,
         help="Override the default directory to load profiles from.",
     )
 
+    parser.add_argument(
+        "--history-max-bytes",
+        type=int,
+        default=None,
+        help="The default maximum number of bytes of output each filter keeps in "
+        "memory. Older output is discarded, and won't be shown in new views. Filters "
+        "can override this in the profile.",
+    )
+
+    parser.add_argument(
+        "--history-max-lines",
+        type=int,
+        default=None,
+        help="The default maximum number of lines of output each filter keeps in "
+        "memory.",
+    )
+
+    parser.add_argument(
+        "--history-max-age",
+        type=float,
+        default=None,
+        help="The default maximum number of seconds each filter keeps output in "
+        "memory for.",
+    )
+
+    parser.add_argument(
+        "--history-backend",
+        choices=[backend.value for backend in HistoryBackend],
+        default=HistoryBackend.MEMORY.value,
+        help="Where filters keep their history by default. 'disk' writes history to "
+        "memory-mapped files, which keeps groklog small when filters have a lot of "
+        "output. Filters can override this in the profile.",
+    )
+
+    parser.add_argument(
+        "--history-directory",
+        type=Path,
+        default=None,
+        help="The directory to write disk backed history to. Defaults to the "
+        "system's temporary directory.",
+    )
+
+    parser.add_argument(
+        "--backpressure-high-water-mark",
+        type=int,
+        default=None,
+        help="The default number of bytes of input that can wait for a filter to read "
+        "it before the --backpressure-overflow policy applies. By default, filters "
+        "buffer any amount of input. Filters can override this in the profile.",
+    )
+
+    parser.add_argument(
+        "--backpressure-overflow",
+        choices=[overflow.value for overflow in OverflowPolicy],
+        default=OverflowPolicy.BLOCK.value,
+        help="What to do when a filter falls more than the high water mark behind. "
+        "'block' pauses its parent until it catches up, 'drop_oldest' discards the "
+        "oldest input it hasn't read, and 'disconnect' stops sending it input.",
+    )
+
+    parser.add_argument(
+        "--coalesce-latency",
+        type=float,
+        default=0.005,
+        help="The most seconds that output can be held back, so that many small "
+        "reads are published together. When output is sparse, it's shown "
+        "immediately. Set this to 0 to publish every read as soon as it's read.",
+    )
+
+    parser.add_argument(
+        "--coalesce-max-bytes",
+        type=int,
+        default=64 * 1024,
+        help="Output that's being held back is published as soon as there's this "
+        "much of it.",
+    )
+
+    parser.add_argument(
+        "--colour-cache-max-lines",
+        type=int,
+        default=10_000,
+        help="The most colour parsed lines that the UI keeps to reuse when the same "
+        "line is shown again. Lines that look unique, such as those with timestamps "
+        "or IDs, aren't kept. Set this to 0 to turn the cache off.",
+    )
+
+    parser.add_argument(
+        "--colour-cache-max-bytes",
+        type=int,
+        default=16 * 1024 * 1024,
+        help="The most memory, roughly, that the colour parsed lines can take up.",
+    )
+
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Run the profile without the UI. The tree is fed from stdin, or from "
+        "--input-command, and each filter's output is written to its own file in "
+        "--output-directory until every filter has finished. Unless a --history-max "
+        "option is given, only the last 16MB of each filter's history is kept.",
+    )
+
+    input_source = parser.add_mutually_exclusive_group()
+    input_source.add_argument(
+        "--input-command",
+        type=str,
+        default=None,
+        help="In headless runs, feed the tree with the output of this command instead "
+        "of stdin.",
+    )
+
+    input_source.add_argument(
+        "--replay",
+        type=Path,
+        default=None,
+        help="Play back a log file, or a directory of rotated and gzipped logs, in "
+        "place of the shell. This works with and without --headless.",
+    )
+
+    parser.add_argument(
+        "--replay-speed",
+        type=PlaybackSpeed.parse,
+        default=PlaybackSpeed.fastest(),
+        help="How quickly to play back --replay logs: 'fastest', 'realtime' to follow "
+        "the timestamps at the start of each line, or a multiple of real time such "
+        "as '10x'.",
+    )
+
+    parser.add_argument(
+        "--output-directory",
+        type=Path,
+        default=Path("."),
+        help="In headless runs, the directory to write each filter's output to. The "
+        "files are named after the filters.",
+    )
+
+    parser.add_argument(
+        "--cpu-profile-directory",
+        type=Path,
+        default=os.environ.get(PROFILE_ENV_VAR),
+        help="Profile the reactor thread, which reads and publishes the output of every "
+        "filter, and the UI loop. A pstats file is written here for each filter and "
+        "for the UI when groklog exits, and the stats scene (F2) shows where the time "
+        f"goes as it happens. Can also be set with the {PROFILE_ENV_VAR} environment "
+        "variable.",
+    )
+
+    parser.add_argument(
+        "--trace-file",
+        type=Path,
+        default=os.environ.get(TRACE_ENV_VAR),
+        help="Trace how long each chunk of output takes to get from the process that "
+        "wrote it, through each filter it's fed to, to being drawn on screen. When "
+        "groklog exits, the trace is written here as Chrome trace event JSON, which "
+        "can be opened in chrome://tracing or https://ui.perfetto.dev, and a summary "
+        f"is printed. Can also be set with the {TRACE_ENV_VAR} environment variable.",
+    )
+
     parser.add_argument(
         "profile",
         type=str,
@@ -1,2 +1,7 @@
-from .exceptions import DuplicateFilterError, FilterError, FilterNotFoundError
+from .exceptions import (
+    DuplicateFilterError,
+    FilterError,
+    FilterNotFoundError,
+    UnknownFilterTypeError,
+)
 from .filter_manager import ROOT_FILTER_NAME, FilterManager
@@ -8,3 +8,7 @@ class DuplicateFilterError(FilterError):
 
 class FilterNotFoundError(FilterError):
     pass
+
+
+class UnknownFilterTypeError(FilterError):
+    pass
@@ -1,9 +1,22 @@
 import json
 from pathlib import Path
-from typing import Dict, Iterator
+from typing import Any, Dict, Iterator, List, Optional, Type
 
 from groklog.filter_manager import exceptions
-from groklog.process_node import GenericProcessIO, ProcessNode, ShellProcessIO
+from groklog.process_node import (
+    NATIVE_FILTER_TYPES,
+    BackpressurePolicy,
+    CoalescePolicy,
+    FusedChain,
+    GenericProcessIO,
+    HistoryBackend,
+    NativeFilterNode,
+    NodeStats,
+    ParallelProcessIO,
+    ProcessNode,
+    RetentionPolicy,
+)
+from groklog.process_node.reactor import reactor
 
 ROOT_FILTER_NAME = "Shell"
 """The default name for the root shell process"""
@@ -19,12 +32,46 @@ class FilterManager:
     FILTER_NAME = "name"
     FILTER_COMMAND = "command"
     FILTER_CHILDREN = "children"
+    FILTER_RETENTION = "retention"
+    FILTER_HISTORY_BACKEND = "history"
+    FILTER_BACKPRESSURE = "backpressure"
+    FILTER_TYPE = "type"
+    FILTER_OPTIONS = "options"
+    FILTER_WORKERS = "workers"
 
-    def __init__(self, shell: ShellProcessIO):
+    def __init__(
+        self,
+        shell: ProcessNode,
+        default_retention: Optional[RetentionPolicy] = None,
+        default_history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        filter_class: Type[ProcessNode] = GenericProcessIO,
+        default_backpressure: Optional[BackpressurePolicy] = None,
+        default_coalesce: Optional[CoalescePolicy] = None,
+    ):
         """
-        :param shell: The shell, which will be the 'root' process for input
+        :param shell: The shell, which will be the 'root' process for input. Headless
+            runs use a StreamInputIO instead.
+        :param default_retention: The retention policy for filters that don't specify
+            their own. If None, filters keep their full history.
+        :param default_history_backend: Where to store history for filters that don't
+            specify their own backend.
+        :param filter_class: The ProcessNode class that filters are created with.
+            Use AsyncGenericProcessIO with an AsyncShellProcessIO shell to build the
+            tree on an asyncio event loop.
+        :param default_backpressure: The limits on how far filters that don't specify
+            their own can fall behind their parent. If None, filters buffer any amount
+            of input.
+        :param default_coalesce: The limits on how long every filter can hold back
+            output to merge small reads. If None, the CoalescePolicy defaults are
+            used. Nodes start reading as soon as they're created, so the shell must be
+            given its own policy when it's created.
         """
         self.selected_filter = shell
+        self.filter_class = filter_class
+        self.default_retention = default_retention or RetentionPolicy()
+        self.default_history_backend = default_history_backend
+        self.default_backpressure = default_backpressure or BackpressurePolicy()
+        self.default_coalesce = default_coalesce or CoalescePolicy()
 
         self._filters: Dict[str, Filter] = {}
         """A dictionary of Filter.name: Filter"""
@@ -37,9 +84,13 @@ class FilterManager:
             yield filter
 
     @property
-    def root_filter(self) -> ShellProcessIO:
+    def root_filter(self) -> ProcessNode:
         return self.get_filter(ROOT_FILTER_NAME)
 
+    def stats(self) -> List[NodeStats]:
+        """Take a snapshot of the runtime metrics of every filter, root first"""
+        return [filter.stats() for filter in self]
+
     def get_filter(self, filter_name: str) -> ProcessNode:
         try:
             return self._filters[filter_name]
@@ -53,37 +104,196 @@ class FilterManager:
         name: str,
         command: str,
         parent: ProcessNode,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: Optional[HistoryBackend] = None,
+        backpressure: Optional[BackpressurePolicy] = None,
+        workers: Optional[int] = None,
     ) -> ProcessNode:
         """Create and register a new filter.
         :param name: The name of the filter
         :param command: The shell command to run
         :param parent: The children process to feed results into the new filter
+        :param retention: The history retention policy for this filter. If None, the
+            default_retention is used.
+        :param history_backend: Where to store this filter's history. If None, the
+            default_history_backend is used.
+        :param backpressure: The limits on how far this filter can fall behind its
+            parent. If None, the default_backpressure is used.
+        :param workers: If set, the command is run across this many worker processes
+            at once, using a ParallelProcessIO. Workers pause the parent instead of
+            following a backpressure policy.
         :return: The new filter
+        :raises ValueError: If workers is combined with a backpressure policy, or the
+            manager creates filters with a filter_class other than GenericProcessIO
         """
+        self._check_name_is_free(name)
+        if workers is not None:
+            if backpressure is not None:
+                raise ValueError(
+                    "Parallel filters pause their parent, and can't have a "
+                    "backpressure policy"
+                )
+            if self.filter_class is not GenericProcessIO:
+                raise ValueError(
+                    f"Parallel filters run on the reactor, so can't be created by a "
+                    f"manager of {self.filter_class.__name__} filters"
+                )
 
-        if name in self._filters:
-            raise exceptions.DuplicateFilterError(
-                f"A filter with name '{name}' already exists!"
+        # Create and register the filter
+        if workers is not None:
+            filter = ParallelProcessIO(
+                name=name,
+                command=command,
+                workers=workers,
+                retention=retention or self.default_retention,
+                history_backend=history_backend or self.default_history_backend,
+                coalesce=self.default_coalesce,
+            )
+        else:
+            filter = self.filter_class(
+                name=name,
+                command=command,
+                retention=retention or self.default_retention,
+                history_backend=history_backend or self.default_history_backend,
+                backpressure=backpressure or self.default_backpressure,
+                coalesce=self.default_coalesce,
             )
+        parent.add_child(filter)
+        self._filters[name] = filter
+        return filter
 
-        # Create and register the filter
-        filter = GenericProcessIO(
+    def create_native_filter(
+        self,
+        name: str,
+        filter_type: str,
+        options: Dict[str, Any],
+        parent: ProcessNode,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: Optional[HistoryBackend] = None,
+    ) -> NativeFilterNode:
+        """Create and register a new filter that runs inside groklog, instead of in a
+        child process. Native filters never fall behind their parent, so they have no
+        backpressure policy.
+        :param name: The name of the filter
+        :param filter_type: The TYPE of the native filter, such as "regex"
+        :param options: The keyword arguments for that type of filter
+        :param parent: The process to feed results into the new filter
+        :param retention: The history retention policy for this filter. If None, the
+            default_retention is used.
+        :param history_backend: Where to store this filter's history. If None, the
+            default_history_backend is used.
+        :return: The new filter
+        """
+        self._check_name_is_free(name)
+        try:
+            filter_class = NATIVE_FILTER_TYPES[filter_type]
+        except KeyError:
+            raise exceptions.UnknownFilterTypeError(
+                f"There is no native filter of type '{filter_type}'"
+            )
+
+        filter = filter_class.from_options(
             name=name,
-            command=command,
+            options=options,
+            retention=retention or self.default_retention,
+            history_backend=history_backend or self.default_history_backend,
         )
         parent.add_child(filter)
         self._filters[name] = filter
         return filter
 
+    def _check_name_is_free(self, name: str):
+        if name in self._filters:
+            raise exceptions.DuplicateFilterError(
+                f"A filter with name '{name}' already exists!"
+            )
+
+    def optimize(self) -> List[FusedChain]:
+        """Fuse every chain of native filters whose filters, apart from the last, have
+        nothing watching them except the next filter in the chain. Each chain is run as
+        a single stage until something subscribes to one of its filters, which
+        dissolves it again. The tree and the saved profile are unchanged.
+
+        Call this once the tree has been built, for example after loading a profile.
+        :return: The chains that were fused
+        """
+        # Match filters join their parent's MatchStage in the reactor thread, so wait
+        # for any that were just created to be subscribed before looking for chains
+        reactor.run(lambda: None)
+
+        chains = []
+        for filter in self:
+            if not isinstance(filter, NativeFilterNode) or filter._fusion is not None:
+                continue
+            if self._is_fusable_link(filter.parent):
+                # This filter is in the middle of a chain that starts further up
+                continue
+
+            nodes = [filter]
+            while self._is_fusable_link(nodes[-1]):
+                nodes.append(nodes[-1].children[0])
+            if len(nodes) > 1:
+                chains.append(FusedChain(nodes))
+        return chains
+
+    @staticmethod
+    def _is_fusable_link(node: Optional[ProcessNode]) -> bool:
+        """Return True if the node is a native filter that only feeds a single native
+        filter, and nothing else is subscribed to it"""
+        if not isinstance(node, NativeFilterNode) or node._fusion is not None:
+            return False
+        if len(node.children) != 1:
+            return False
+        child = node.children[0]
+        if not isinstance(child, NativeFilterNode) or child._fusion is not None:
+            return False
+
+        with node._subscribers_lock:
+            live_subscribers = {
+                topic: [ref for ref in refs if ref() is not None]
+                for topic, refs in node._subscribers.items()
+            }
+        if (
+            len(live_subscribers.get(ProcessNode.Topic.LINE_STREAM, [])) != 1
+            or live_subscribers.get(ProcessNode.Topic.BYTES_DATA_STREAM)
+            or live_subscribers.get(ProcessNode.Topic.STRING_DATA_STREAM)
+        ):
+            return False
+
+        # The only subscriber must be what feeds the child
+        feed = child.write
+        if node._match_stage is not None:
+            feed = node._match_stage.write
+        return node.is_subscribed(ProcessNode.Topic.LINE_STREAM, feed)
+
     def save_profile(self, profile_path: Path):
         def serialize_process_node(process_node: ProcessNode):
-            return {
+            node_info = {
                 self.FILTER_NAME: process_node.name,
                 self.FILTER_COMMAND: process_node.command,
                 self.FILTER_CHILDREN: [
                     serialize_process_node(c) for c in process_node.children
                 ],
             }
+            if isinstance(process_node, NativeFilterNode):
+                node_info[self.FILTER_TYPE] = process_node.TYPE
+                node_info[self.FILTER_OPTIONS] = process_node.options
+            if isinstance(process_node, ParallelProcessIO):
+                node_info[self.FILTER_WORKERS] = process_node.workers
+
+            # Only save retention policies that were set specifically for this node,
+            # so that changing the default later still applies to everything else.
+            if process_node.retention != self.default_retention:
+                node_info[self.FILTER_RETENTION] = process_node.retention.to_json()
+            if process_node.history_backend is not self.default_history_backend:
+                node_info[self.FILTER_HISTORY_BACKEND] = (
+                    process_node.history_backend.value
+                )
+            if process_node.backpressure not in (None, self.default_backpressure):
+                node_info[self.FILTER_BACKPRESSURE] = (
+                    process_node.backpressure.to_json()
+                )
+            return node_info
 
         profile_path.parent.mkdir(parents=True, exist_ok=True)
         with profile_path.open("w") as file:
@@ -91,13 +301,42 @@ class FilterManager:
 
     def load_profile(self, profile_path: Path):
         def deserialize_process_node(node_info, parent=None):
+            retention = None
+            if self.FILTER_RETENTION in node_info:
+                retention = RetentionPolicy.from_json(node_info[self.FILTER_RETENTION])
+            history_backend = None
+            if self.FILTER_HISTORY_BACKEND in node_info:
+                history_backend = HistoryBackend(node_info[self.FILTER_HISTORY_BACKEND])
+            backpressure = None
+            if self.FILTER_BACKPRESSURE in node_info:
+                backpressure = BackpressurePolicy.from_json(
+                    node_info[self.FILTER_BACKPRESSURE]
+                )
+
             if parent is None:
                 node = self.root_filter
+                if retention is not None:
+                    node.retention = retention
+                if history_backend is not None:
+                    node.history_backend = history_backend
+            elif self.FILTER_TYPE in node_info:
+                node = self.create_native_filter(
+                    name=node_info[self.FILTER_NAME],
+                    filter_type=node_info[self.FILTER_TYPE],
+                    options=node_info[self.FILTER_OPTIONS],
+                    parent=parent,
+                    retention=retention,
+                    history_backend=history_backend,
+                )
             else:
                 node = self.create_filter(
                     name=node_info[self.FILTER_NAME],
                     command=node_info[self.FILTER_COMMAND],
                     parent=parent,
+                    retention=retention,
+                    history_backend=history_backend,
+                    backpressure=backpressure,
+                    workers=node_info.get(self.FILTER_WORKERS),
                 )
 
             for child_info in node_info[self.FILTER_CHILDREN]:
@@ -110,3 +349,7 @@ class FilterManager:
 
     def close(self):
         self.root_filter.close()
+
+    async def aclose(self, timeout=None):
+        """Close a tree built on asyncio, and wait for every process to exit"""
+        await self.root_filter.aclose(timeout=timeout)
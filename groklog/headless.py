@@ -0,0 +1,125 @@
+"""Run a profile's process tree without the UI, for batch jobs such as CI and cron.
+
+The tree is fed from stdin or a command instead of the interactive shell, and every
+filter's output is streamed to its own file until the input has ended and every filter
+has finished. Nothing here imports asciimatics, and nothing polls: the main thread
+sleeps until the tree is done, while the reactor thread does all of the work.
+"""
+
+import re
+import sys
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Optional
+
+from groklog.filter_manager import FilterManager
+from groklog.filter_manager.filter_manager import ROOT_FILTER_NAME
+from groklog.process_node import (
+    CoalescePolicy,
+    HistoryBackend,
+    ProcessNode,
+    RetentionPolicy,
+    StreamInputIO,
+)
+
+DEFAULT_RETENTION = RetentionPolicy(max_bytes=16 * 1024 * 1024)
+"""The retention policy used when none was given on the command line. Output is
+written to files as soon as it's published, so there's no need for the history of a
+multi-GB log to be kept in memory."""
+
+
+class _OutputFile:
+    """Writes everything a filter outputs to a file. Subscribers are weakly referenced,
+    so these must be kept around for as long as the filters are running."""
+
+    def __init__(self, file: BinaryIO):
+        self._file = file
+
+    def write(self, data: bytes):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+def open_input(
+    command: Optional[str],
+    retention: Optional[RetentionPolicy] = None,
+    history_backend: HistoryBackend = HistoryBackend.MEMORY,
+    coalesce: Optional[CoalescePolicy] = None,
+) -> StreamInputIO:
+    """Create the root of the tree, which reads the output of the command, or
+    groklog's own stdin if no command is given"""
+    if command is None:
+        return StreamInputIO(
+            name=ROOT_FILTER_NAME,
+            fd=sys.stdin.fileno(),
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+    return StreamInputIO.from_command(
+        name=ROOT_FILTER_NAME,
+        command=command,
+        retention=retention,
+        history_backend=history_backend,
+        coalesce=coalesce,
+    )
+
+
+def run_headless(
+    filter_manager: FilterManager, profile_path: Path, output_directory: Path
+) -> int:
+    """Load the profile, and write each filter's output to a file in the output
+    directory until every filter has finished.
+
+    :param filter_manager: A manager whose root filter is a StreamInputIO or a
+        FileReplayIO that hasn't been started yet
+    :param profile_path: The profile to build the tree from
+    :param output_directory: Where to write the output files. Each is named after its
+        filter.
+    :return: The exit status
+    """
+    if not profile_path.is_file():
+        print(f"There is no profile at {profile_path}", file=sys.stderr)
+        filter_manager.close()
+        return 1
+    filter_manager.load_profile(profile_path)
+    filters = list(filter_manager)
+
+    output_directory.mkdir(parents=True, exist_ok=True)
+    output_files: List[_OutputFile] = []
+    for filter, path in zip(filters, _output_paths(filters, output_directory)):
+        output_file = _OutputFile(path.open("wb"))
+        output_files.append(output_file)
+        filter.subscribe_with_history(
+            ProcessNode.Topic.BYTES_DATA_STREAM, output_file.write, blocking=False
+        )
+
+    status = 0
+    filter_manager.root_filter.start()
+    try:
+        for filter in filters:
+            filter.wait_for_output_end()
+    except KeyboardInterrupt:
+        status = 130
+    finally:
+        filter_manager.close()
+        for output_file in output_files:
+            output_file.close()
+    return status
+
+
+def _output_paths(filters: Iterable[ProcessNode], directory: Path) -> List[Path]:
+    """Name a file after each filter, replacing anything that isn't safe in a file
+    name, and numbering any names that end up the same"""
+    paths = []
+    used = set()
+    for filter in filters:
+        stem = re.sub(r"[^\w.-]+", "_", filter.name).strip("._") or "filter"
+        name, number = stem, 1
+        while name.lower() in used:
+            number += 1
+            name = f"{stem}_{number}"
+        used.add(name.lower())
+        paths.append(directory / f"{name}.log")
+    return paths
@@ -1,5 +1,55 @@
+from .asyncio_process import (
+    AsyncGenericProcessIO,
+    AsyncProcessNode,
+    AsyncShellProcessIO,
+)
+from .backpressure import BackpressurePolicy, OverflowPolicy
 from .base import ProcessNode
+from .coalesce import CoalescePolicy
+from .file_replay import FileReplayIO, PlaybackSpeed
 from .generic_process import GenericProcessIO
+from .history import HistoryBackend, RetentionPolicy
+from .lines import LineBatch
+from .metrics import NodeStats
+from .native import (
+    NATIVE_FILTER_TYPES,
+    CutFilterNode,
+    FusedChain,
+    MatchFilterNode,
+    NativeFilterNode,
+    RegexFilterNode,
+    SubstringFilterNode,
+)
+from .parallel import ParallelProcessIO
+from .replay import Replay, ReplayMode
 from .shell_process import ShellProcessIO
+from .stream_input import StreamInputIO
 
-__all__ = ["ProcessNode", "GenericProcessIO", "ShellProcessIO"]
+__all__ = [
+    "AsyncGenericProcessIO",
+    "AsyncProcessNode",
+    "AsyncShellProcessIO",
+    "BackpressurePolicy",
+    "CoalescePolicy",
+    "CutFilterNode",
+    "FileReplayIO",
+    "FusedChain",
+    "ProcessNode",
+    "GenericProcessIO",
+    "HistoryBackend",
+    "LineBatch",
+    "MatchFilterNode",
+    "NATIVE_FILTER_TYPES",
+    "NativeFilterNode",
+    "NodeStats",
+    "OverflowPolicy",
+    "ParallelProcessIO",
+    "PlaybackSpeed",
+    "RegexFilterNode",
+    "Replay",
+    "ReplayMode",
+    "RetentionPolicy",
+    "ShellProcessIO",
+    "StreamInputIO",
+    "SubstringFilterNode",
+]
@@ -0,0 +1,340 @@
+import asyncio
+import os
+import pty
+import threading
+from abc import abstractmethod
+from threading import RLock
+from typing import Callable, List, Optional
+
+from .backpressure import BackpressurePolicy
+from .base import ProcessNode
+from .coalesce import CoalescePolicy
+from .history import HistoryBackend, RetentionPolicy
+from .replay import Replay
+from .tracing import tracer
+
+
+class AsyncProcessNode(ProcessNode):
+    """A ProcessNode that runs its process and publishes its output on an asyncio
+    event loop, instead of on the reactor thread.
+
+    Nodes must be created from within a running event loop. Every subscriber is called
+    from that loop, and close() must be called from it too. The process is started in
+    the background, so any input written before it's ready is held until it starts.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._reading = True
+        self._started = self._loop.create_task(self._start())
+
+    def subscribe_queue(
+        self,
+        topic: "ProcessNode.Topic",
+        *,
+        with_history=True,
+        replay: Replay = Replay.full(),
+    ) -> asyncio.Queue:
+        """Subscribe a new asyncio.Queue to a topic, so output can be awaited with
+        `await queue.get()`. The queue holds a reference to the subscription, so keep
+        it around for as long as you want to receive output.
+
+        :param topic: The topic to subscribe to
+        :param with_history: If True, the history is put on the queue first
+        :param replay: How much of the history to put on the queue
+        """
+        queue = asyncio.Queue()
+        if with_history:
+            self.subscribe_with_history(
+                topic, queue.put_nowait, blocking=False, replay=replay
+            )
+        else:
+            self.subscribe(topic, queue.put_nowait)
+        return queue
+
+    async def wait_closed(self):
+        """Wait for the processes of this node and its children to exit"""
+        await self._started
+        if self._process is not None:
+            await self._process.wait()
+
+        for child in self.children:
+            if isinstance(child, AsyncProcessNode):
+                await child.wait_closed()
+
+    async def aclose(self, timeout=None):
+        """Close this node and its children, and wait for their processes to exit"""
+        self.close(timeout=timeout)
+        await asyncio.wait_for(self.wait_closed(), timeout)
+
+    def _in_loop_thread(self) -> bool:
+        return threading.get_ident() == self._loop_thread
+
+    def _call_soon(self, callback: Callable[[], None]):
+        self._loop.call_soon_threadsafe(callback)
+
+    def _call_later(self, delay: float, callback: Callable[[], None]):
+        return self._loop.call_later(delay, callback)
+
+    async def _start(self):
+        if not self._running:
+            return
+
+        self._process = await self._spawn()
+        if not self._running:
+            # The node was closed while the process was starting up
+            self._stop_process(timeout=None)
+            return
+        self._on_started()
+
+    @abstractmethod
+    async def _spawn(self) -> asyncio.subprocess.Process:
+        """Start the process"""
+
+    def _on_started(self):
+        """Called once the process has started"""
+
+    def _stop_io(self):
+        self._reading = False
+
+    def _stop_process(self, timeout):
+        """Kill the process. Use wait_closed() to wait for it to exit."""
+        if self._process is None or self._process.returncode is not None:
+            return
+        try:
+            self._process.kill()
+        except ProcessLookupError:
+            pass
+
+
+class AsyncGenericProcessIO(AsyncProcessNode):
+    """The asyncio equivalent of GenericProcessIO"""
+
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        backpressure: Optional[BackpressurePolicy] = None,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
+        """
+        :param backpressure: Limits on how far the process's input can fall behind.
+            If None, any amount of input is buffered.
+        """
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+        # The process's stdin is a plain pipe, rather than a StreamWriter, so that input
+        # can be written without blocking and buffered the same way as GenericProcessIO
+        self._stdin_read, self._stdin = os.pipe()
+        os.set_blocking(self._stdin, False)
+        self._stdin_closed = False
+        self._input_lock = RLock()
+        self._input_ended = False
+        self._create_input_buffer(backpressure or BackpressurePolicy())
+
+        self._reader: Optional[asyncio.Task] = None
+        self._output_watched = asyncio.Event()
+        self._output_watched.set()
+
+    def write(self, data: bytes):
+        """Input data from an upstream process. This never blocks, and may be called
+        from any thread."""
+        if not self._running or self._disconnected:
+            return
+        if tracer.enabled:
+            # The chunk being written is only known in the thread that publishes it
+            tracer.hand_over(self)
+        if not self._in_loop_thread():
+            self._loop.call_soon_threadsafe(self.write, data)
+            return
+
+        with self._input_lock:
+            if self._input_ended:
+                return
+            self._metrics.bytes_in += len(data)
+            was_waiting = len(self._input_buffer) > 0
+            if self._input_buffer.send(self._stdin, data) and not was_waiting:
+                self._loop.add_writer(self._stdin, self._flush_input)
+
+    async def wait_closed(self):
+        await super().wait_closed()
+        if self._reader is not None:
+            await self._reader
+
+    async def _spawn(self) -> asyncio.subprocess.Process:
+        # The read end is taken before the first await, so that close() can tell
+        # whether it still has to close it
+        stdin_read, self._stdin_read = self._stdin_read, None
+        try:
+            return await asyncio.create_subprocess_shell(
+                self.command,
+                preexec_fn=os.setsid,
+                stdin=stdin_read,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        finally:
+            os.close(stdin_read)
+
+    def _on_started(self):
+        self._reader = self._loop.create_task(self._read_output())
+
+    async def _read_output(self):
+        while True:
+            await self._output_watched.wait()
+            data_bytes = await self._process.stdout.read(self._READ_MAX_BYTES)
+            if len(data_bytes) == 0:
+                # The process has closed its output
+                self._coalescer.flush()
+                self._end_output()
+                return
+            self._publish_output(data_bytes)
+
+    def _flush_input(self):
+        """Called by the event loop when stdin has space for more input"""
+        with self._input_lock:
+            if self._stdin_closed:
+                return
+            if not self._running or not self._input_buffer.flush(self._stdin):
+                self._loop.remove_writer(self._stdin)
+                if self._running and self._input_ended:
+                    self._close_stdin()
+
+    def _end_input(self):
+        """Close stdin once the buffered input has been written, so that the process
+        sees the end of its input and can finish"""
+        if not self._in_loop_thread():
+            # This is queued behind any input that was written from the same thread
+            self._loop.call_soon_threadsafe(self._end_input)
+            return
+
+        with self._input_lock:
+            if not self._running or self._input_ended:
+                return
+            self._input_ended = True
+            if len(self._input_buffer) == 0:
+                self._close_stdin()
+            # Otherwise, stdin is closed by _flush_input once the buffer is written
+
+    def _close_stdin(self):
+        if not self._stdin_closed:
+            self._stdin_closed = True
+            os.close(self._stdin)
+
+    def _watch_output(self, enabled: bool):
+        if enabled:
+            self._output_watched.set()
+        else:
+            self._output_watched.clear()
+
+    def _stop_io(self):
+        if self._stdin_read is not None:
+            # The node was closed before the process was spawned
+            os.close(self._stdin_read)
+            self._stdin_read = None
+        with self._input_lock:
+            if not self._stdin_closed:
+                self._loop.remove_writer(self._stdin)
+            self._input_buffer.clear()
+            self._close_stdin()
+        # Let the reader drain whatever output is left, so that it can finish
+        self._output_watched.set()
+        super()._stop_io()
+
+
+class AsyncShellProcessIO(AsyncProcessNode):
+    """The asyncio equivalent of ShellProcessIO. The shell's pseudo TTY is read by the
+    event loop directly."""
+
+    def __init__(
+        self,
+        name="Shell",
+        command="bash -i",
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+
+        # Open a pseudo TTY to control the interactive session.
+        self._master, self._slave = pty.openpty()
+        os.set_blocking(self._master, False)
+        self._loop.add_reader(self._master, self._on_readable)
+
+    def write(self, val: bytes):
+        """Write a character to the tty"""
+        os.write(self._master, val)
+
+    def send_sigint(self):
+        """Simulate the user sending Ctrl+C to the underlying shell"""
+        self.write(b"\x03")
+
+    def close(self, timeout=None):
+        """While not necessary, sending a sigint significantly speeds up the closing
+        process, which is great for tests."""
+        if self._running:
+            self.send_sigint()
+        super().close(timeout=timeout)
+
+    async def _spawn(self) -> asyncio.subprocess.Process:
+        return await asyncio.create_subprocess_exec(
+            *self.command.split(" "),
+            preexec_fn=os.setsid,
+            stdin=self._slave,
+            stdout=self._slave,
+            stderr=self._slave,
+        )
+
+    def _on_readable(self):
+        try:
+            read = self._coalescer.read_from(self._master, self._READ_MAX_BYTES)
+        except BlockingIOError:
+            return
+        except OSError:
+            # A pty raises EIO instead of returning b"" once the process has exited
+            read = 0
+
+        if read == 0:
+            self._reading = False
+            self._loop.remove_reader(self._master)
+            self._coalescer.flush()
+            self._end_output()
+
+    def _watch_output(self, enabled: bool):
+        if enabled:
+            self._loop.add_reader(self._master, self._on_readable)
+        else:
+            self._loop.remove_reader(self._master)
+
+    def _stop_io(self):
+        self._loop.remove_reader(self._master)
+        super()._stop_io()
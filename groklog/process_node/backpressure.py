@@ -0,0 +1,204 @@
+import os
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from time import monotonic
+from typing import Callable, Deque, Optional, Union
+
+Buffer = Union[bytes, memoryview]
+
+_WRITEV_MAX_CHUNKS = 64
+"""The most chunks to hand to a single writev call"""
+
+
+class OverflowPolicy(Enum):
+    """What to do when a child falls more than its high water mark behind its parent"""
+
+    BLOCK = "block"
+    """Stop reading from the parent until the child catches up. Nothing is lost, but
+    the parent and every sibling wait for the slowest child."""
+
+    DROP_OLDEST = "drop_oldest"
+    """Discard the oldest input that the child hasn't read yet"""
+
+    DISCONNECT = "disconnect"
+    """Stop sending the child input, and publish a notice in the child's output"""
+
+
+@dataclass(frozen=True)
+class BackpressurePolicy:
+    """Limits on how much input a child process can fall behind its parent by"""
+
+    high_water_mark: Optional[int] = None
+    """The number of bytes that can wait for the child to read them before the
+    overflow policy applies. If None, any amount of input is buffered."""
+
+    overflow: OverflowPolicy = OverflowPolicy.BLOCK
+
+    @property
+    def is_bounded(self) -> bool:
+        return self.high_water_mark is not None
+
+    def to_json(self) -> dict:
+        info = {"overflow": self.overflow.value}
+        if self.high_water_mark is not None:
+            info["high_water_mark"] = self.high_water_mark
+        return info
+
+    @classmethod
+    def from_json(cls, info: dict) -> "BackpressurePolicy":
+        return cls(
+            high_water_mark=info.get("high_water_mark"),
+            overflow=OverflowPolicy(info.get("overflow", OverflowPolicy.BLOCK.value)),
+        )
+
+
+class OutboundBuffer:
+    """Input on its way to a child process's stdin, which is written without blocking.
+
+    Whatever the child isn't ready to read is kept as a queue of the chunks that were
+    published, rather than being joined together, and is written with writev once the
+    child has made space. The BackpressurePolicy decides what happens when the child
+    falls too far behind. This class isn't thread safe, so callers must lock around it.
+    """
+
+    def __init__(
+        self,
+        policy: BackpressurePolicy,
+        pause_parent: Callable[[], None],
+        resume_parent: Callable[[], None],
+        disconnect: Callable[[], None],
+    ):
+        """
+        :param policy: The limits for how far behind the child can fall
+        :param pause_parent: Called to stop the parent from producing more output
+        :param resume_parent: Called to undo pause_parent
+        :param disconnect: Called to stop the child from receiving input
+        """
+        self._policy = policy
+        self._pause_parent = pause_parent
+        self._resume_parent = resume_parent
+        self._disconnect = disconnect
+
+        self._chunks: Deque[Buffer] = deque()
+        self._size = 0
+        self._parent_paused = False
+
+        self.dropped_bytes = 0
+        """The total number of bytes discarded by the DROP_OLDEST policy"""
+
+        self._stalled_since: Optional[float] = None
+        self._stall_time = 0.0
+
+    def __len__(self):
+        """The number of bytes waiting to be written"""
+        return self._size
+
+    @property
+    def policy(self) -> BackpressurePolicy:
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy: BackpressurePolicy):
+        self._policy = policy
+        self._apply_policy()
+
+    @property
+    def stall_time(self) -> float:
+        """The total number of seconds that input has waited for the child to read it"""
+        if self._stalled_since is None:
+            return self._stall_time
+        return self._stall_time + monotonic() - self._stalled_since
+
+    def send(self, fd: int, data: Buffer) -> bool:
+        """Write as much of the data to the fd as it can take, and buffer the rest.
+        :return: True if data is waiting in the buffer, and flush() should be called
+            once the fd is writable.
+        """
+        if self._size == 0:
+            data = memoryview(data)[_write(fd, [data]) :]
+            if len(data) == 0:
+                return False
+
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._stalled_since is None:
+            self._stalled_since = monotonic()
+        self._apply_policy()
+        return self._size > 0
+
+    def flush(self, fd: int) -> bool:
+        """Write as much of the buffer to the fd as it can take
+        :return: True if data is still waiting in the buffer
+        """
+        while self._size:
+            count = min(len(self._chunks), _WRITEV_MAX_CHUNKS)
+            chunks = [self._chunks[i] for i in range(count)]
+            written = _write(fd, chunks)
+            if written == 0:
+                break
+            self._consume(written)
+
+        self._apply_policy()
+        return self._size > 0
+
+    def clear(self):
+        self._consume(self._size)
+        self._apply_policy()
+
+    def _consume(self, length: int):
+        """Remove `length` bytes from the front of the buffer"""
+        self._size -= length
+        while length:
+            chunk = self._chunks[0]
+            if len(chunk) <= length:
+                self._chunks.popleft()
+                length -= len(chunk)
+            else:
+                self._chunks[0] = memoryview(chunk)[length:]
+                length = 0
+
+        if self._size == 0 and self._stalled_since is not None:
+            self._stall_time += monotonic() - self._stalled_since
+            self._stalled_since = None
+
+    def _apply_policy(self):
+        high_water_mark = self._policy.high_water_mark
+        overflowing = high_water_mark is not None and self._size > high_water_mark
+        overflow = self._policy.overflow
+
+        if overflowing and overflow is OverflowPolicy.DROP_OLDEST:
+            dropped = self._size - high_water_mark
+            self._consume(dropped)
+            self.dropped_bytes += dropped
+        elif overflowing and overflow is OverflowPolicy.DISCONNECT:
+            self._consume(self._size)
+            self._disconnect()
+
+        # Blocking pauses the parent at the high water mark, and waits until the child
+        # has caught up halfway before resuming, so the parent isn't toggled on every
+        # write.
+        if overflowing and overflow is OverflowPolicy.BLOCK:
+            if not self._parent_paused:
+                self._parent_paused = True
+                self._pause_parent()
+        elif self._parent_paused and (
+            overflow is not OverflowPolicy.BLOCK
+            or high_water_mark is None
+            or self._size <= high_water_mark // 2
+        ):
+            self._parent_paused = False
+            self._resume_parent()
+
+
+def _write(fd: int, chunks) -> int:
+    """Write the chunks to a non-blocking fd
+    :return: The number of bytes written
+    """
+    try:
+        return os.writev(fd, chunks)
+    except BlockingIOError:
+        return 0
+    except BrokenPipeError:
+        # The process has stopped reading its input, so drop it
+        return sum(len(chunk) for chunk in chunks)
@@ -1,110 +1,614 @@
+import codecs
 from abc import ABC, abstractmethod
 from enum import Enum, auto
+from functools import partial
 from queue import Queue
-from threading import RLock
-from typing import Callable, List
+from threading import Event, RLock
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Tuple, Union
 
 from pubsus import DuplicateSubscriberError, PubSubMixin
 
+from .backpressure import BackpressurePolicy, OutboundBuffer
+from .coalesce import CoalescePolicy, Coalescer
+from .history import History, HistoryBackend, RetentionPolicy, create_history
+from .lines import LineBatch, LineFramer
+from .metrics import NodeMetrics, NodeStats
+from .reactor import reactor
+from .replay import Replay
+from .tracing import tracer
+
+if TYPE_CHECKING:
+    from .native import MatchStage
+
 
 class ProcessNode(ABC, PubSubMixin):
     _READ_MAX_BYTES = 102400
+    _REPLAY_BATCH_BYTES = 1024 * 1024
+    """The most history to hand to a new subscriber in a single callback"""
 
     class Topic(Enum):
         STRING_DATA_STREAM = auto()
         """The process's stdout data, but converted to a utf-8 encoded string"""
 
         BYTES_DATA_STREAM = auto()
-        """The process's stdout data as raw bytes"""
+        """The process's stdout data as raw bytes. History replayed from a disk backed
+        history is delivered as memoryviews."""
+
+        LINE_STREAM = auto()
+        """The process's stdout data as LineBatches of complete, decoded lines. An
+        incomplete line at the end of the output is held back until it's finished."""
+
+    _input_topic = Topic.BYTES_DATA_STREAM
+    """The topic of its parent's output that this node's write() is subscribed to"""
 
-    def __init__(self, name: str, command: str):
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
         """
         :param name: An arbitrary unique title for this process
         :param command: The command being run in the process
+        :param retention: Limits on how much history to keep. If None, the full
+            history is kept.
+        :param history_backend: Where to store this node's history
+        :param coalesce: Limits on how long output can be held back to merge small
+            reads. If None, the default CoalescePolicy is used.
         """
         super().__init__()
         self.name = name
         self.command = command
         self.children: List[ProcessNode] = []
+        self.parent: Optional[ProcessNode] = None
+        self._match_stage: Optional["MatchStage"] = None
+        """Matches this node's lines for all of its regex and substring children at
+        once. It's created when the first of those children is added."""
 
-        self._new_subscribers: Queue[Tuple[ProcessNode.Topic, Callable]] = Queue()
+        self._new_subscribers: Queue[Tuple[ProcessNode.Topic, Callable, Replay]] = (
+            Queue()
+        )
         """This queue contains incoming subscribers that have requested to have 
-        the full history applied. This is a special case, because the callback must be
-        called once with the full history. This is done in the background thread, so that
-        subscribing isn't a blocking operation. """
+        the history applied. This is a special case, because the callback must be
+        called with the history before any new output. This is done in the reactor
+        thread, so that subscribing isn't a blocking operation. """
+
+        self._running = True
+        self._read_fd: Optional[int] = None
+        """The file descriptor that the reactor reads this process's output from"""
+        self._reading = False
+        self._read_pauses = 0
+        """The number of children that have asked for reading to be paused"""
+        self._output_ended = Event()
+        """Set once the process has closed its output, and all of it was published"""
+
+        self._input_buffer: Optional[OutboundBuffer] = None
+        """Input waiting for the process to read it, for nodes that are fed by a pipe"""
+        self._disconnected = False
 
         self._history_lock = RLock()
-        self._bytes_history: bytes = b""
-        self._string_history: str = ""
+        self._history_backend = history_backend
+        self._bytes_history: History[bytes] = create_history(
+            history_backend, b"", retention or RetentionPolicy(), self.name
+        )
+        self._decoder: Optional[codecs.IncrementalDecoder] = None
+        """Decodes the output for STRING_DATA_STREAM subscribers. It's only kept while
+        there are string subscribers, so nodes that only feed other processes never
+        decode anything. The string history is decoded from the bytes history."""
+        self._line_framer: Optional[LineFramer] = None
+        """Splits the output into lines for LINE_STREAM subscribers. Like the decoder,
+        it's only kept while there are subscribers."""
+
+        self._coalescer = Coalescer(
+            coalesce or CoalescePolicy(), self._publish_coalesced, self._call_later
+        )
+        """Merges small reads of the process's output before they're published"""
+
+        self._metrics = NodeMetrics()
 
     def __repr__(self):
         return f"{self.__class__.__qualname__}(name='{self.name}', command='{self.command}')"
 
+    @property
+    def retention(self) -> RetentionPolicy:
+        return self._bytes_history.retention
+
+    @retention.setter
+    def retention(self, retention: RetentionPolicy):
+        """Change the retention policy, evicting any history that no longer fits"""
+        with self._history_lock:
+            self._bytes_history.retention = retention
+
+    @property
+    def history_backend(self) -> HistoryBackend:
+        return self._history_backend
+
+    @history_backend.setter
+    def history_backend(self, history_backend: HistoryBackend):
+        """Move the history to a different backend"""
+        with self._history_lock:
+            if history_backend is self._history_backend:
+                return
+
+            old = self._bytes_history
+            new = create_history(history_backend, b"", self.retention, self.name)
+            for chunk in old.chunks():
+                new.append(chunk)
+            old.close()
+
+            self._bytes_history = new
+            self._history_backend = history_backend
+
+    @property
+    def backpressure(self) -> Optional[BackpressurePolicy]:
+        """The limits on how far this node's input can fall behind its parent. This is
+        None for nodes that don't buffer their input, such as shells."""
+        if self._input_buffer is None:
+            return None
+        return self._input_buffer.policy
+
+    @backpressure.setter
+    def backpressure(self, backpressure: BackpressurePolicy):
+        if self._input_buffer is None:
+            raise TypeError(f"{self} does not buffer its input")
+        with self._input_lock:
+            self._input_buffer.policy = backpressure
+
+    @property
+    def coalesce(self) -> CoalescePolicy:
+        """The limits on how long output can be held back to merge small reads"""
+        return self._coalescer.policy
+
+    @coalesce.setter
+    def coalesce(self, coalesce: CoalescePolicy):
+        self._coalescer.policy = coalesce
+
+    @property
+    def stall_time(self) -> float:
+        """The total number of seconds that input has waited for this process to read
+        it. A stall time that keeps growing means this node can't keep up."""
+        if self._input_buffer is None:
+            return 0.0
+        return self._input_buffer.stall_time
+
+    @property
+    def dropped_bytes(self) -> int:
+        """The number of bytes of input discarded because this node fell behind"""
+        if self._input_buffer is None:
+            return 0
+        return self._input_buffer.dropped_bytes
+
+    def stats(self) -> NodeStats:
+        """Take a snapshot of this node's runtime metrics. It can be called from any
+        thread, and never waits for the node."""
+        metrics = self._metrics
+        history = self._bytes_history
+        bytes_out, lines_out = history.end, history.line_count
+        bytes_rate, lines_rate = metrics.output_rate.rates(bytes_out, lines_out)
+        return NodeStats(
+            name=self.name,
+            bytes_in=metrics.bytes_in,
+            lines_in=metrics.lines_in,
+            bytes_out=bytes_out,
+            lines_out=lines_out,
+            bytes_out_per_second=bytes_rate,
+            lines_out_per_second=lines_rate,
+            history_bytes=len(history),
+            callback_seconds=metrics.callback_seconds,
+            pending_subscribers=self._new_subscribers.qsize(),
+            input_backlog_bytes=self._input_backlog(),
+            stall_time=self.stall_time,
+            dropped_bytes=self.dropped_bytes,
+            paused=self._read_pauses > 0,
+            output_ended=self.output_ended,
+        )
+
+    def _input_backlog(self) -> int:
+        """The number of bytes of input waiting for the process to read them"""
+        if self._input_buffer is None:
+            return 0
+        return len(self._input_buffer)
+
+    @property
+    def output_ended(self) -> bool:
+        """True once the process has closed its output, and all of it was published"""
+        return self._output_ended.is_set()
+
+    def wait_for_output_end(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the process has closed its output, and all of it was published
+        :return: False if the timeout passed first
+        """
+        return self._output_ended.wait(timeout)
+
+    @property
+    def disconnected(self) -> bool:
+        """True if this node fell too far behind, and was disconnected from its parent"""
+        return self._disconnected
+
+    def _create_input_buffer(self, backpressure: BackpressurePolicy):
+        self._input_buffer = OutboundBuffer(
+            backpressure,
+            pause_parent=self._pause_parent,
+            resume_parent=self._resume_parent,
+            disconnect=self._disconnect_from_parent,
+        )
+
+    def _pause_parent(self):
+        if self.parent is not None:
+            self.parent._pause_reading()
+
+    def _resume_parent(self):
+        if self.parent is not None:
+            self.parent._resume_reading()
+
+    def _disconnect_from_parent(self):
+        """Stop receiving input from the parent, and say so in this node's output"""
+        if self.parent is None or self._disconnected:
+            return
+
+        self._disconnected = True
+        if self.parent.is_subscribed(self._input_topic, self.write):
+            self.parent.unsubscribe(self._input_topic, self.write)
+        notice = (
+            f"\n[groklog] '{self.name}' fell more than "
+            f"{self.backpressure.high_water_mark} bytes behind '{self.parent.name}', "
+            f"and was disconnected from it.\n"
+        )
+        self._record_and_publish(notice.encode())
+
     def add_child(self, process_node: "ProcessNode"):
         """Adds and subscribes the child"""
-        self.subscribe_with_history(
-            ProcessNode.Topic.BYTES_DATA_STREAM, process_node.write, blocking=False
-        )
+        process_node.parent = self
+        process_node._subscribe_to_parent()
         self.children.append(process_node)
+        if self.output_ended:
+            # The child is onboarded with all of the output there will ever be, so its
+            # input ends once that's done
+            self._call_soon(process_node._end_input)
+
+    def _subscribe_to_parent(self):
+        """Start feeding the parent's output, including its history, into write()"""
+        self.parent.subscribe_with_history(
+            self._input_topic, self.write, blocking=False
+        )
 
-    def _record_and_publish(self, data_bytes: bytes):
+    def _record_and_publish(self, data_bytes: Union[bytes, memoryview]):
         """Record the data to the history and publish the bytes and string
-        variants of the data."""
-        # Scrub all control characters out of the string so they don't get passed on to
-        # child process and kill them too
+        variants of the data. A memoryview is only read during this call, and the
+        history keeps its own copy, which is the copy that subscribers are handed."""
+        if isinstance(data_bytes, memoryview):
+            data_bytes = bytes(data_bytes)
+
+        with self._history_lock:
+            line_batch = None
+            if self._has_subscribers(self.Topic.LINE_STREAM):
+                if self._line_framer is None:
+                    self._line_framer = self._create_line_framer()
+                line_batch = self._line_framer.feed(data_bytes)
+            else:
+                self._line_framer = None
+
+            self._bytes_history.append(data_bytes)
+
+            data_string = ""
+            if self._has_subscribers(self.Topic.STRING_DATA_STREAM):
+                if self._decoder is None:
+                    self._decoder = _create_decoder()
+
+                # The decoder holds on to any character that's split across chunks,
+                # until the rest of it arrives
+                data_string = self._decoder.decode(data_bytes)
+            else:
+                self._decoder = None
+
+            tracing = tracer.enabled
+            if tracing:
+                # Children and widgets fed from these callbacks pick up the chunk's
+                # tag from the tracer
+                tracer.begin_chunk(self)
+            started = perf_counter()
+            try:
+                if data_string:
+                    self.publish(self.Topic.STRING_DATA_STREAM, data_string)
+                if line_batch:
+                    self.publish(self.Topic.LINE_STREAM, line_batch)
+                self.publish(self.Topic.BYTES_DATA_STREAM, data_bytes)
+            finally:
+                if tracing:
+                    tracer.end_chunk(self)
 
-        data_string: str = data_bytes.decode("utf8", "replace")
+            metrics = self._metrics
+            metrics.callback_seconds += perf_counter() - started
+            history = self._bytes_history
+            metrics.output_rate.sample(history.end, history.line_count)
 
+    def _publish_output(self, data_bytes: bytes):
+        """Publish output read from the process, merging it with other small reads if
+        they're arriving quickly. Must be called from the thread this node publishes
+        from."""
+        self._coalescer.feed(data_bytes)
+
+    def _publish_coalesced(self, data_bytes: Union[bytes, memoryview]):
+        with self._history_lock:
+            # A flush can be scheduled just before the node is closed
+            if self._running:
+                self._record_and_publish(data_bytes)
+
+    def _has_subscribers(self, topic: "ProcessNode.Topic") -> bool:
+        with self._subscribers_lock:
+            return len(self._subscribers[topic]) > 0
+
+    def line_count(self) -> int:
+        """The number of complete lines this node has ever output"""
+        return self._bytes_history.line_count
+
+    def get_lines(self, start: int, stop: Optional[int] = None) -> LineBatch:
+        """Look up complete lines of output in the history's line index, without
+        scanning the history. Lines that are no longer retained are skipped.
+
+        :param start: The absolute line number to start from
+        :param stop: The line number to stop at. If None, stop at the last complete
+            line.
+        """
         with self._history_lock:
-            self._bytes_history += data_bytes
-            self._string_history += data_string
+            first_line, offsets = self._bytes_history.line_offsets(start, stop)
+            if len(offsets) == 0:
+                return LineBatch(lines=[], first_line_number=first_line)
+            data = self._bytes_history.read(offsets[0], offsets[-1])
+
+        raw_lines = data.split(b"\n")
+        raw_lines.pop()  # The empty string after the last newline
+        return LineBatch(
+            lines=[raw_line.decode("utf8", "replace") for raw_line in raw_lines],
+            first_line_number=first_line,
+            offsets=offsets[:-1],
+        )
+
+    def tail(self, line_count: int) -> LineBatch:
+        """Return the last `line_count` complete lines of output"""
+        return self.get_lines(max(self.line_count() - line_count, 0))
+
+    def _create_line_framer(self) -> LineFramer:
+        """Create a LineFramer that carries on from the end of the history"""
+        history = self._bytes_history
+        return LineFramer(
+            line_number=history.line_count,
+            offset=history.last_line_start,
+            partial=history.read(history.last_line_start),
+        )
 
-            self.publish(self.Topic.STRING_DATA_STREAM, data_string)
-            self.publish(self.Topic.BYTES_DATA_STREAM, data_bytes)
+    def _history_batches(self, start: int) -> Iterator[bytes]:
+        """Yield the history from the offset onwards, in pieces of at most
+        _REPLAY_BATCH_BYTES. History replayed from a disk backed history is yielded as
+        memoryviews."""
+        history = self._bytes_history
+        for batch_start in range(start, history.end, self._REPLAY_BATCH_BYTES):
+            yield from history.replay(
+                batch_start, batch_start + self._REPLAY_BATCH_BYTES
+            )
+
+    def _frame_history(
+        self, start: Optional[int] = None
+    ) -> Tuple[Iterator[LineBatch], LineFramer]:
+        """Split the history into lines, from the offset onwards. If the offset is in
+        the middle of a line, only the rest of that line is included.
+        :return: The batches of lines, and the framer that is used. Once the batches
+            have been consumed, the framer holds on to the incomplete line at the end
+            of the history.
+        """
+        history = self._bytes_history
+        if start is None:
+            start = history.start
+        framer = LineFramer(line_number=history.line_at(start), offset=start)
+        # Disk backed history is replayed as memoryviews, which the framer can't split
+        batches = (framer.feed(bytes(batch)) for batch in self._history_batches(start))
+        return (batch for batch in batches if batch), framer
+
+    def _decode_history(
+        self, start: Optional[int] = None
+    ) -> Tuple[Iterator[str], codecs.IncrementalDecoder]:
+        """Decode the history into strings, from the offset onwards.
+        :return: The strings, and the decoder that is used. Once the strings have been
+            consumed, the decoder holds on to any incomplete character at the end of
+            the history, so that decoding can carry on from there.
+        """
+        if start is None:
+            start = self._bytes_history.start
+        decoder = _create_decoder()
+
+        def decode() -> Iterator[str]:
+            batches = self._history_batches(start)
+            for batch in batches:
+                if start > 0:
+                    # The offset can be in the middle of a character, so skip any of
+                    # its continuation bytes
+                    batch = batch[_count_continuation_bytes(batch) :]
+                yield decoder.decode(batch)
+                break
+            for batch in batches:
+                yield decoder.decode(batch)
+
+        return (string for string in decode() if string), decoder
 
     def subscribe_with_history(
-        self, topic: "ProcessNode.Topic", subscriber: Callable, *, blocking
+        self,
+        topic: "ProcessNode.Topic",
+        subscriber: Callable,
+        *,
+        blocking,
+        replay: Replay = Replay.full(),
     ):
-        """This function will subscribe a subscriber to the full history that has ever
-        been received by this node. The callback will occur in the background thread.
+        """This function will subscribe a subscriber to the history that has been
+        received by this node, followed by any new output. The callback will occur in
+        the thread that the node publishes from: the reactor thread, or the event loop
+        for asyncio nodes.
+
+        :param replay: How much of the history to replay. It is handed over in batches
+            of at most _REPLAY_BATCH_BYTES, so that a long history never has to be
+            copied into a single object.
         """
         if blocking:
-            self._onboard_subscriber(topic, subscriber)
+            self._onboard_subscriber(topic, subscriber, replay)
         else:
-            self._new_subscribers.put((topic, subscriber))
+            self._new_subscribers.put((topic, subscriber, replay))
+            self._call_soon(self._onboard_new_subscribers)
+
+    def _call_soon(self, callback: Callable[[], None]):
+        """Run the callback in the thread that this node publishes from"""
+        reactor.call_soon(callback)
+
+    def _call_later(self, delay: float, callback: Callable[[], None]):
+        """Run the callback in the thread that this node publishes from, after a delay
+        :return: A handle with a cancel() method
+        """
+        return reactor.call_later(delay, callback)
 
     def _onboard_new_subscribers(self):
-        """Onboard any subscribers who wish to have the full history before adding more
+        """Onboard any subscribers who wish to have the history before adding more
         history.
         """
         while self._running and self._new_subscribers.qsize():
             self._onboard_subscriber(*self._new_subscribers.get_nowait())
             self._new_subscribers.task_done()
 
-    def _onboard_subscriber(self, topic, subscriber):
+    def _onboard_subscriber(self, topic, subscriber, replay: Replay):
         if self.is_subscribed(topic, subscriber):
             raise DuplicateSubscriberError("This topic/subscriber already exists!")
         with self._history_lock:
+            # Evict anything that has aged out since the last time data was appended
+            self._bytes_history.enforce_retention()
+            start = replay.start_offset(self._bytes_history)
+
             # If any history has been written, pass it along
-            if len(self._string_history):
-                if topic is self.Topic.STRING_DATA_STREAM:
-                    subscriber(self._string_history)
-                elif topic is self.Topic.BYTES_DATA_STREAM:
-                    subscriber(self._bytes_history)
-                else:
-                    raise ValueError("Invalid topic")
+            if topic is self.Topic.STRING_DATA_STREAM:
+                data_strings, decoder = self._decode_history(start)
+                for data_string in data_strings:
+                    subscriber(data_string)
+                if self._decoder is None:
+                    # Carry on decoding new output from the end of the history
+                    self._decoder = decoder
+            elif topic is self.Topic.LINE_STREAM:
+                line_batches, framer = self._frame_history(start)
+                for line_batch in line_batches:
+                    subscriber(line_batch)
+                if self._line_framer is None:
+                    # The framer can only carry on if it saw the whole incomplete line
+                    if start <= self._bytes_history.last_line_start:
+                        self._line_framer = framer
+                    else:
+                        self._line_framer = self._create_line_framer()
+            elif topic is self.Topic.BYTES_DATA_STREAM:
+                for data in self._history_batches(start):
+                    subscriber(data)
+            else:
+                raise ValueError("Invalid topic")
+
             self.subscribe(topic, subscriber)
 
+    def _start_reading(self, fd: int):
+        """Have the reactor read this process's output from the file descriptor as
+        soon as data is available. The fd must be non-blocking."""
+        self._read_fd = fd
+        self._reading = True
+        reactor.acquire()
+        reactor.add_reader(fd, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            # The output is read straight into the coalescer's buffer, so that reading
+            # doesn't allocate
+            read = self._coalescer.read_from(self._read_fd, self._READ_MAX_BYTES)
+        except BlockingIOError:
+            return
+        except OSError:
+            # A pty raises EIO instead of returning b"" once the process has exited
+            read = 0
+
+        if read == 0:
+            # The process has closed its output
+            self._reading = False
+            reactor.remove_reader(self._read_fd)
+            self._coalescer.flush()
+            self._end_output()
+
+    def _end_output(self):
+        """Called in the thread that this node publishes from, once the process has
+        closed its output and all of it was published. This ends the input of every
+        child, so that a tree fed from a file or a pipe finishes from the root down."""
+        self._output_ended.set()
+        for child in self.children:
+            child._end_input()
+
+    def _end_input(self):
+        """Called in the thread that the parent publishes from, once the parent's
+        output has ended and every byte of it has been written to this node. Nodes that
+        can finish once their input ends should do so, and then call _end_output. It
+        may be called more than once."""
+
+    def _pause_reading(self):
+        """Stop reading the process's output until _resume_reading is called, which
+        stops the process once its output pipe is full. Every call to this must be
+        matched by a call to _resume_reading."""
+        self._call_soon(partial(self._change_read_pauses, 1))
+
+    def _resume_reading(self):
+        self._call_soon(partial(self._change_read_pauses, -1))
+
+    def _change_read_pauses(self, change: int):
+        was_paused = self._read_pauses > 0
+        self._read_pauses += change
+        paused = self._read_pauses > 0
+        if self._reading and paused != was_paused:
+            self._watch_output(not paused)
+
+    def _watch_output(self, enabled: bool):
+        """Start or stop the reactor from reading the process's output"""
+        if enabled:
+            reactor.add_reader(self._read_fd, self._on_readable)
+        else:
+            reactor.remove_reader(self._read_fd)
+
+    def _stop_io(self):
+        """Stop the reactor from calling any of this node's IO handlers"""
+        self._reading = False
+        if self._read_fd is not None:
+            reactor.remove_reader(self._read_fd)
+            reactor.release()
+
+    def _stop_process(self, timeout):
+        self._process.kill()
+        self._process.wait(timeout)
+
     @abstractmethod
     def write(self, val: bytes):
         pass
 
     def close(self, timeout=None):
-        """Close all child processes and threads"""
+        """Close all child processes and stop reading from them"""
+        if not self._running:
+            return
+
         self._running = False
-        self._process.kill()
-        self._extraction_thread.join(timeout)
-        self._process.wait(timeout)
+        self._stop_io()
+        self._stop_process(timeout)
+
+        with self._history_lock:
+            self._bytes_history.close()
 
         for child in self.children:
             child.close(timeout=timeout)
+
+
+def _create_decoder() -> codecs.IncrementalDecoder:
+    return codecs.getincrementaldecoder("utf8")(errors="replace")
+
+
+def _count_continuation_bytes(data: bytes) -> int:
+    """Count the utf-8 continuation bytes at the start of the data"""
+    count = 0
+    while count < min(len(data), 3) and data[count] & 0xC0 == 0x80:
+        count += 1
+    return count
@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from time import monotonic
+from typing import Any, Callable, Optional, Union
+
+from .read_buffer import ReadBuffer
+
+
+@dataclass(frozen=True)
+class CoalescePolicy:
+    """Limits on how long a node's output can be held back, so that many small reads
+    can be published together"""
+
+    max_latency: float = 0.005
+    """The most seconds that output is held back for. If 0, every read is published
+    as soon as it's read."""
+
+    max_bytes: int = 64 * 1024
+    """Held back output is published as soon as there's this much of it"""
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_latency > 0
+
+
+class Coalescer:
+    """Merges small chunks of output into fewer, larger ones before they're published.
+
+    When output is sparse, such as a shell echoing keystrokes, each chunk is published
+    as soon as it arrives. Once chunks arrive faster than the latency budget, they're
+    held back and merged, and published together when the budget runs out or the size
+    limit is reached. Under a flood of output this bounds the number of publishes, and
+    so the subscriber callbacks, to roughly one per max_latency.
+
+    Output that's held back is kept in a ReadBuffer, and read_from() reads the
+    process's output straight into it, so merging reads doesn't allocate or join
+    anything.
+
+    This class isn't thread safe, so it must only be used from the thread that the
+    node publishes from.
+    """
+
+    def __init__(
+        self,
+        policy: CoalescePolicy,
+        publish: Callable[[Union[bytes, memoryview]], None],
+        call_later: Callable[[float, Callable[[], None]], Any],
+    ):
+        """
+        :param policy: The limits for how long to hold output back
+        :param publish: Called with each merged chunk of output. Output read by
+            read_from() can be a memoryview, which is only valid during the call.
+        :param call_later: Schedules a callback after a delay, and returns a handle
+            with a cancel() method
+        """
+        self.policy = policy
+        self._publish = publish
+        self._call_later = call_later
+
+        self._buffer = ReadBuffer(0)
+        self._timer: Optional[Any] = None
+        self._last_publish = float("-inf")
+
+    def __len__(self):
+        """The number of bytes being held back"""
+        return len(self._buffer)
+
+    def feed(self, data: bytes):
+        """Publish the data, or hold it back to be merged with what comes next"""
+        now = monotonic()
+        if self._is_sparse(now) or (
+            len(self._buffer) == 0 and len(data) >= self.policy.max_bytes
+        ):
+            # A chunk that's big enough already isn't copied into the buffer
+            self._last_publish = now
+            self._publish(data)
+            return
+
+        self._buffer.append(data)
+        self._hold_back()
+
+    def read_from(self, fd: int, max_bytes: int) -> int:
+        """Read at most max_bytes of output from the fd, straight into the end of the
+        output being held back, then publish it or hold it back like feed(). Like
+        os.read, this raises BlockingIOError if a non-blocking fd has nothing to read.
+        :return: The number of bytes read, which is 0 at the end of the output
+        """
+        buffer = self._buffer
+        now = monotonic()
+        sparse = self._is_sparse(now)
+
+        read = buffer.read_from(fd, max_bytes)
+        if read == 0:
+            return 0
+
+        if sparse:
+            self._last_publish = now
+            with buffer.view() as data:
+                self._publish(data)
+            buffer.clear()
+        else:
+            self._hold_back()
+        return read
+
+    def _is_sparse(self, now: float) -> bool:
+        """True if output should be published as soon as it's read, because there's
+        nothing to gain by waiting"""
+        policy = self.policy
+        return not policy.enabled or (
+            len(self._buffer) == 0 and now - self._last_publish >= policy.max_latency
+        )
+
+    def _hold_back(self):
+        """Called after output was added to the buffer, to publish it once it's big
+        enough or schedule a flush for when the latency budget runs out"""
+        policy = self.policy
+        if len(self._buffer) >= policy.max_bytes:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._call_later(policy.max_latency, self.flush)
+
+    def flush(self):
+        """Publish everything that's being held back"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if len(self._buffer) == 0:
+            return
+
+        data = self._buffer.take()
+        self._last_publish = monotonic()
+        self._publish(data)
+
+    def cancel(self):
+        """Discard anything being held back, and stop the pending flush"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._buffer.clear()
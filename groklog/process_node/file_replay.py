@@ -0,0 +1,308 @@
+import calendar
+import mmap
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from time import monotonic
+from typing import Iterator, List, Optional, Tuple
+
+from .base import ProcessNode
+from .coalesce import CoalescePolicy
+from .history import HistoryBackend, RetentionPolicy
+from .reactor import reactor
+
+
+@dataclass(frozen=True)
+class PlaybackSpeed:
+    """How quickly a FileReplayIO plays back its logs. Use the constructors, for
+    example PlaybackSpeed.realtime(), rather than building one directly."""
+
+    multiplier: Optional[float] = None
+    """How many times faster than the timestamps in the log say it was written to play
+    it back. If None, the log is played back as fast as it can be read."""
+
+    @classmethod
+    def fastest(cls) -> "PlaybackSpeed":
+        return cls()
+
+    @classmethod
+    def realtime(cls) -> "PlaybackSpeed":
+        return cls(1.0)
+
+    @classmethod
+    def times(cls, multiplier: float) -> "PlaybackSpeed":
+        if multiplier <= 0:
+            raise ValueError("The multiplier must be greater than 0")
+        return cls(multiplier)
+
+    @classmethod
+    def parse(cls, text: str) -> "PlaybackSpeed":
+        """Parse a speed from the command line: 'fastest', 'realtime', or a multiple of
+        real time such as '10x'"""
+        if text == "fastest":
+            return cls.fastest()
+        if text == "realtime":
+            return cls.realtime()
+        try:
+            return cls.times(float(text[:-1] if text.endswith("x") else text))
+        except ValueError:
+            raise ValueError(
+                f"'{text}' is not 'fastest', 'realtime', or a multiple like '10x'"
+            )
+
+    @property
+    def paced(self) -> bool:
+        return self.multiplier is not None
+
+
+class FileReplayIO(ProcessNode):
+    """A root ProcessNode that plays back a log file, or a directory of rotated logs,
+    in place of the interactive shell.
+
+    Files are read through mmap, and gzipped files are decompressed straight out of
+    the mapping, so nothing passes through a pty or a pipe. Playback runs in reactor
+    callbacks, one chunk of at most _READ_MAX_BYTES at a time, so it pauses for slow
+    children like any other node. It can run as fast as possible, or be paced by the
+    timestamps at the start of each line, at real time or a multiple of it.
+
+    Nothing is played back until start() is called, so that the tree and its
+    subscribers can be set up first. Nothing can be written to it.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        name: str = "Shell",
+        speed: PlaybackSpeed = PlaybackSpeed.fastest(),
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
+        """
+        :param path: A log file, or a directory of them. The files in a directory are
+            played back oldest first, going by their rotation numbers.
+        :param speed: How quickly to play back the logs
+        """
+        super().__init__(
+            name=name,
+            command=str(path),
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+        self.path = path
+        self.speed = speed
+        self.files = _playback_order(path)
+        if not self.files:
+            raise FileNotFoundError(f"There are no logs to replay at {path}")
+
+        # These are only accessed from the reactor thread
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._pending = b""
+        """A chunk that's been read but not published in full yet"""
+        self._pending_start = 0
+        self._pacer = _Pacer(speed.multiplier) if speed.paced else None
+        self._step_scheduled = False
+        self._timer = None
+
+    def start(self):
+        """Start playing back the logs"""
+        self._chunks = _read_logs(self.files, self._READ_MAX_BYTES)
+        self._reading = True
+        reactor.acquire()
+        self._watch_output(True)
+
+    def write(self, val: bytes):
+        raise TypeError(f"{self} plays back logs, and has no input")
+
+    def _watch_output(self, enabled: bool):
+        if enabled and not self._step_scheduled:
+            self._step_scheduled = True
+            reactor.call_soon(self._step)
+
+    def _step(self):
+        """Publish the next piece of the logs, and schedule the one after it"""
+        self._step_scheduled = False
+        self._timer = None
+        if not self._reading or self._read_pauses > 0:
+            return
+
+        if self._pending_start == len(self._pending):
+            self._pending = next(self._chunks, b"")
+            self._pending_start = 0
+            if not self._pending:
+                self._reading = False
+                self._coalescer.flush()
+                self._end_output()
+                return
+
+        start, stop, delay = self._pending_start, len(self._pending), 0.0
+        if self._pacer is not None:
+            stop, delay = self._pacer.due(self._pending, start)
+        if stop > start:
+            self._publish_output(self._pending[start:stop])
+        self._pending_start = stop
+
+        if delay > 0:
+            self._step_scheduled = True
+            self._timer = reactor.call_later(delay, self._step)
+        else:
+            self._watch_output(True)
+
+    def _stop_io(self):
+        if self._chunks is None:
+            # Playback was never started
+            return
+        reactor.run(self._stop_playback)
+        reactor.release()
+
+    def _stop_playback(self):
+        self._reading = False
+        if self._timer is not None:
+            self._timer.cancel()
+        # Closing the generator closes the file that it has mapped
+        self._chunks.close()
+
+    def _stop_process(self, timeout):
+        pass
+
+
+class _Pacer:
+    """Works out when each line of a log is due to be played back, from the timestamp
+    near the start of the line. Lines without a timestamp are due with the line before
+    them, and so are lines whose timestamp goes backwards."""
+
+    def __init__(self, multiplier: float):
+        self._multiplier = multiplier
+        self._first_timestamp: Optional[float] = None
+        self._started = 0.0
+
+    def due(self, data: bytes, start: int) -> Tuple[int, float]:
+        """Find how much of the data, from the offset onwards, is due now
+        :return: The offset to publish up to, and the number of seconds until the rest
+            of the data is due
+        """
+        now = monotonic()
+        for match in _TIMESTAMP.finditer(data, start):
+            timestamp = _parse_timestamp(match)
+            if self._first_timestamp is None:
+                self._first_timestamp = timestamp
+                self._started = now
+                continue
+
+            due = self._started + (timestamp - self._first_timestamp) / self._multiplier
+            if due > now:
+                return match.start(), due - now
+        return len(data), 0.0
+
+
+_TIMESTAMP = re.compile(
+    rb"^[^\n]{0,40}?"
+    rb"(?:(?P<year>\d{4})-(?P<month>\d\d)-(?P<day>\d\d)[T ]"
+    rb"|(?P<month_name>[A-Z][a-z]{2}) {1,2}(?P<syslog_day>\d{1,2}) )"
+    rb"(?P<hour>\d\d):(?P<minute>\d\d):(?P<second>\d\d)(?:[.,](?P<fraction>\d+))?",
+    re.MULTILINE,
+)
+"""An ISO 8601 style timestamp such as 2021-07-01 12:00:00.123, or a syslog one such as
+Jul  1 12:00:00, within the first 40 characters of a line"""
+
+_MONTHS = {name.encode(): number for number, name in enumerate(calendar.month_abbr)}
+
+
+def _parse_timestamp(match: "re.Match[bytes]") -> float:
+    """Return the timestamp as a number of seconds. Syslog timestamps have no year, so
+    they're only comparable within a year."""
+    if match["year"] is not None:
+        date = int(match["year"]), int(match["month"]), int(match["day"])
+    else:
+        date = 1970, _MONTHS.get(match["month_name"], 1), int(match["syslog_day"])
+    time = int(match["hour"]), int(match["minute"]), int(match["second"])
+    seconds = calendar.timegm(date + time)
+    if match["fraction"] is not None:
+        seconds += float(b"0." + match["fraction"])
+    return seconds
+
+
+_ROTATION_NUMBER = re.compile(r"\.(\d+)(\.gz)?$")
+
+
+def _playback_order(path: Path) -> List[Path]:
+    """Return the log files at the path, oldest first. Rotated logs are numbered like
+    app.log.2.gz, app.log.1, app.log, where the highest number is the oldest."""
+    if not path.is_dir():
+        return [path]
+
+    def key(file: Path) -> Tuple[str, int]:
+        match = _ROTATION_NUMBER.search(file.name)
+        if match is not None:
+            return file.name[: match.start()], -int(match.group(1))
+        name = file.name[: -len(".gz")] if file.name.endswith(".gz") else file.name
+        return name, 0
+
+    return sorted((file for file in path.iterdir() if file.is_file()), key=key)
+
+
+def _read_logs(files: List[Path], chunk_size: int) -> Iterator[bytes]:
+    """Yield the contents of each file in turn, in chunks of about chunk_size that end
+    on a line break where possible"""
+    for file in files:
+        with file.open("rb") as stream:
+            if os.fstat(stream.fileno()).st_size == 0:
+                # Empty files can't be mapped
+                continue
+            with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if file.name.endswith(".gz"):
+                    yield from _line_chunks(_decompress(mapped, chunk_size), chunk_size)
+                else:
+                    yield from _mapped_chunks(mapped, chunk_size)
+
+
+def _mapped_chunks(mapped: mmap.mmap, chunk_size: int) -> Iterator[bytes]:
+    """Slice a mapped file into chunks, cutting each at its last line break. Slicing
+    the mapping copies straight out of the page cache, with no read calls."""
+    start, size = 0, len(mapped)
+    while start < size:
+        stop = min(start + chunk_size, size)
+        if stop < size:
+            stop = mapped.rfind(b"\n", start, stop) + 1 or stop
+        yield mapped[start:stop]
+        start = stop
+
+
+def _decompress(mapped: mmap.mmap, chunk_size: int) -> Iterator[bytes]:
+    """Decompress a mapped gzip file, including files of several gzip members, such
+    as those made by concatenating gzipped files. No more than chunk_size bytes are
+    decompressed at a time, so a chunk that compresses well can't balloon in memory."""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    position = 0
+    while position < len(mapped):
+        data = mapped[position : position + chunk_size]
+        position += len(data)
+        while data:
+            output = decompressor.decompress(data, chunk_size)
+            if output:
+                yield output
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            else:
+                data = decompressor.unconsumed_tail
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def _line_chunks(blocks: Iterator[bytes], chunk_size: int) -> Iterator[bytes]:
+    """Regroup blocks of data into chunks of about chunk_size that end on a line
+    break where possible"""
+    pending = bytearray()
+    for block in blocks:
+        pending += block
+        while len(pending) >= chunk_size:
+            stop = pending.rfind(b"\n", 0, chunk_size) + 1 or chunk_size
+            yield bytes(pending[:stop])
+            del pending[:stop]
+    if pending:
+        yield bytes(pending)
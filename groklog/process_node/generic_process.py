@@ -1,16 +1,41 @@
 import fcntl
 import os
-import shlex
 import subprocess
-from threading import RLock, Thread
-from time import sleep
+from threading import RLock
+from typing import Optional
 
+from .backpressure import BackpressurePolicy
 from .base import ProcessNode
+from .coalesce import CoalescePolicy
+from .history import HistoryBackend, RetentionPolicy
+from .reactor import reactor
+from .tracing import tracer
 
 
 class GenericProcessIO(ProcessNode):
-    def __init__(self, name: str, command: str):
-        super().__init__(name=name, command=command)
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        backpressure: Optional[BackpressurePolicy] = None,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
+        """
+        :param backpressure: Limits on how far the process's input can fall behind.
+            If None, any amount of input is buffered.
+        :param coalesce: Limits on how long output can be held back to merge small
+            reads. Reading starts straight away, so this must be passed here rather
+            than set afterwards for it to apply to the first reads.
+        """
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
 
         self._process = subprocess.Popen(
             self.command,
@@ -21,39 +46,68 @@ class GenericProcessIO(ProcessNode):
             stderr=subprocess.STDOUT,
         )
 
-        # Set stdout to be nonblocking
-        fd = self._process.stdout.fileno()
-        fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-        fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        # Set stdin and stdout to be nonblocking
+        for fd in (self._process.stdin.fileno(), self._process.stdout.fileno()):
+            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
 
         # Lock while processes are piping data in
         self._input_lock = RLock()
+        self._input_ended = False
+        """Set once the parent's output has ended. Stdin is closed as soon as all of
+        the buffered input has been written to it."""
+        self._create_input_buffer(backpressure or BackpressurePolicy())
 
-        self._running = True
-        self._extraction_thread = Thread(
-            name=f"Thread({self})", daemon=True, target=self._background
-        )
-        self._extraction_thread.start()
+        self._start_reading(self._process.stdout.fileno())
 
     def write(self, data: bytes):
-        """Input data from an upstream process"""
-        if not self._running:
+        """Input data from an upstream process. This never blocks, so that a slow
+        process can't hold up the process feeding it. Input the process isn't ready for
+        is buffered, and written by the reactor once the process has made space."""
+        if not self._running or self._disconnected:
             return
 
         with self._input_lock:
-            self._process.stdin.write(data)
-            self._process.stdin.flush()
+            if self._input_ended:
+                return
+            self._metrics.bytes_in += len(data)
+            if tracer.enabled:
+                tracer.hand_over(self)
+            stdin = self._process.stdin.fileno()
+            was_waiting = len(self._input_buffer) > 0
+            if self._input_buffer.send(stdin, data) and not was_waiting:
+                reactor.add_writer(stdin, self._flush_input)
 
-    def _background(self):
-        while self._running:
-            self._onboard_new_subscribers()
+    def _flush_input(self):
+        """Called by the reactor when stdin has space for more input"""
+        with self._input_lock:
+            if self._process.stdin.closed:
+                return
+            stdin = self._process.stdin.fileno()
+            if not self._running or not self._input_buffer.flush(stdin):
+                reactor.remove_writer(stdin)
+                if self._running and self._input_ended:
+                    self._process.stdin.close()
 
-            # Read in a non-blocking fashion up to a certain number of characters.
-            data_bytes = self._process.stdout.read1(self._READ_MAX_BYTES)
+    def _end_input(self):
+        """Close stdin once the buffered input has been written, so that the process
+        sees the end of its input and can finish"""
+        with self._input_lock:
+            if not self._running or self._input_ended:
+                return
+            self._input_ended = True
+            # Stdin is closed by _flush_input, once there's nothing left to write.
+            # It's called directly rather than by registering stdin, because it could
+            # close stdin before a queued registration is made.
+            reactor.call_soon(self._flush_input)
 
-            if len(data_bytes) == 0:
-                # Prevent a busyloop where there's no data in stdout.
-                sleep(0.1)
-                continue
+    def _stop_io(self):
+        reactor.run(self._stop_writing)
+        with self._input_lock:
+            self._input_buffer.clear()
+        super()._stop_io()
 
-            self._record_and_publish(data_bytes)
+    def _stop_writing(self):
+        # Stdin is only closed in the reactor thread, so this can't race with that
+        if not self._process.stdin.closed:
+            reactor.remove_writer(self._process.stdin.fileno())
@@ -0,0 +1,5 @@
+from .backend import HistoryBackend, create_history, set_session_parent
+from .base import History
+from .disk import DiskHistory
+from .memory import ChunkedHistory
+from .retention import RetentionPolicy
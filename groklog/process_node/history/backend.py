@@ -0,0 +1,63 @@
+import atexit
+import re
+import shutil
+import tempfile
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+
+from .base import Chunk, History
+from .disk import DiskHistory
+from .memory import ChunkedHistory
+from .retention import RetentionPolicy
+
+
+class HistoryBackend(Enum):
+    MEMORY = "memory"
+    """Keep history in RAM"""
+
+    DISK = "disk"
+    """Keep history in segment files under the session directory"""
+
+
+_session_parent: Optional[Path] = None
+_session_directory: Optional[Path] = None
+
+
+def set_session_parent(parent: Optional[Path]):
+    """Set the directory that the session directory for disk backed histories is
+    created in. If None, the system's temporary directory is used."""
+    global _session_parent
+    _session_parent = parent
+
+
+def session_directory() -> Path:
+    """The directory that every DiskHistory in this process writes under. It's created
+    the first time it's needed, and removed when the process exits."""
+    global _session_directory
+    if _session_directory is None:
+        if _session_parent is not None:
+            _session_parent.mkdir(parents=True, exist_ok=True)
+        _session_directory = Path(
+            tempfile.mkdtemp(prefix="groklog-", dir=_session_parent)
+        )
+        atexit.register(shutil.rmtree, _session_directory, True)
+    return _session_directory
+
+
+def create_history(
+    backend: HistoryBackend, empty: Chunk, retention: RetentionPolicy, name: str
+) -> History[Chunk]:
+    """Create a new history on the given backend.
+    :param backend: Where to store the history
+    :param empty: An empty chunk of the type being stored, for example b"" or ""
+    :param retention: The limits for how much history to keep
+    :param name: A human readable name, used for naming any files
+    """
+    if backend is HistoryBackend.MEMORY:
+        return ChunkedHistory(empty, retention)
+    elif backend is HistoryBackend.DISK:
+        prefix = re.sub(r"[^\w.-]", "_", name) + "-"
+        directory = Path(tempfile.mkdtemp(prefix=prefix, dir=session_directory()))
+        return DiskHistory(empty, directory, retention)
+    raise ValueError(f"Unknown history backend {backend}")
@@ -0,0 +1,360 @@
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, islice
+from time import monotonic
+from typing import Generic, Iterator, Optional, Tuple, TypeVar
+
+from .retention import RetentionPolicy
+
+Chunk = TypeVar("Chunk", bytes, str)
+
+
+class History(ABC, Generic[Chunk]):
+    """An append-only record of everything a ProcessNode has output.
+
+    Data is stored as the chunks that were read from the process, alongside an index
+    of the offset that each chunk starts at. This keeps appending an O(1) operation,
+    as opposed to concatenating onto an ever-growing bytes or str object, which
+    copies the whole history on every read. Subclasses decide where the chunks
+    themselves are stored.
+
+    Offsets are absolute positions in the stream, in bytes for a bytes history and in
+    characters for a str history. They are never reused, so once the RetentionPolicy
+    evicts the start of the history, self.start moves forward but offsets of the
+    remaining data stay the same.
+    """
+
+    _COMPACT_THRESHOLD = 1024
+    """The number of evicted chunks to allow before the chunk index is compacted"""
+
+    def __init__(self, empty: Chunk, retention: RetentionPolicy = RetentionPolicy()):
+        """
+        :param empty: An empty chunk of the type being stored, for example b"" or "".
+            It is used for joining chunks together.
+        :param retention: The limits for how much history to keep
+        """
+        self._empty: Chunk = empty
+        self._newline: Chunk = b"\n" if isinstance(empty, bytes) else "\n"
+        self._retention = retention
+
+        self._offsets = array("Q")
+        """The absolute offset that each chunk begins at"""
+        self._line_counts = array("Q")
+        """The number of newlines in each chunk"""
+        self._last_line_starts = array("Q")
+        """The offset that the newest line started at, as of the end of each chunk"""
+        self._timestamps = array("d")
+        """The monotonic time at which each chunk was appended"""
+
+        self._first = 0
+        """The index of the oldest chunk that hasn't been evicted"""
+        self._start = 0
+        self._end = 0
+        self._retained_lines = 0
+        self._total_lines = 0
+
+        self._last_line_start = 0
+        """The absolute offset that the newest, incomplete line starts at"""
+        self._start_line_start = 0
+        """The absolute offset that the line self.start is in starts at. It's before
+        self.start if the start of that line has been evicted."""
+
+        self._line_starts = array("Q", [0])
+        """The absolute offset that each line starts at, up to self._indexed_end. It's
+        only built once lines are looked up, because splitting every chunk into lines
+        would cost far more than storing it, and most nodes never look up a line. After
+        that it's extended on each lookup, by scanning the chunks appended since."""
+        self._indexed_end = 0
+        """The absolute offset that self._line_starts has been built up to"""
+        self._line_starts_base = 0
+        """The line number of the first entry in self._line_starts"""
+        self._first_line = 0
+        """The index in self._line_starts of the line that self.start is in"""
+
+    def __len__(self):
+        """The length of the history that is currently retained"""
+        return self._end - self._start
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__qualname__}"
+            f"(chunks={len(self._offsets) - self._first}, "
+            f"start={self._start}, end={self._end})"
+        )
+
+    @property
+    def start(self) -> int:
+        """The absolute offset of the oldest retained data"""
+        return self._start
+
+    @property
+    def end(self) -> int:
+        """The absolute offset just past the newest data"""
+        return self._end
+
+    @property
+    def line_count(self) -> int:
+        """The number of complete lines ever appended, including evicted ones"""
+        return self._total_lines
+
+    @property
+    def start_line(self) -> int:
+        """The absolute line number of the line that self.start is in. Line numbers
+        start at 0, and count every line ever appended."""
+        return self._total_lines - self._retained_lines
+
+    @property
+    def last_line_start(self) -> int:
+        """The absolute offset that the newest line starts at. That line is incomplete,
+        and may still be empty."""
+        return self._last_line_start
+
+    def line_start(self, line_number: int) -> int:
+        """Return the absolute offset that a line starts at. The line number is
+        clamped to the retained lines, and if the start of the line was evicted, the
+        start of the history is returned."""
+        self._index_lines()
+        index = line_number - self._line_starts_base
+        index = min(max(index, self._first_line), len(self._line_starts) - 1)
+        return max(self._line_starts[index], self._start)
+
+    def line_at(self, offset: int) -> int:
+        """Return the absolute line number of the line that an offset is in. The
+        offset is clamped to the retained history."""
+        self._index_lines()
+        offset = min(max(offset, self._start), self._end)
+        return self._line_index(offset) + self._line_starts_base
+
+    def line_offsets(
+        self, start_line: int = 0, stop_line: Optional[int] = None
+    ) -> Tuple[int, array]:
+        """Look up where the complete lines [start_line, stop_line) are in the history.
+        Lines that have been partly or fully evicted are skipped.
+
+        :param start_line: The absolute line number to start from
+        :param stop_line: The line number to stop at. If None, stop at the last
+            complete line.
+        :return: The line number of the first line found, and the absolute offset that
+            each line starts at, followed by the offset just past the last line. If no
+            lines were found, the array is empty.
+        """
+        self._index_lines()
+        first_line = self.start_line
+        if self._line_starts[self._first_line] < self._start:
+            # The start of this line has been evicted
+            first_line += 1
+        start_line = max(start_line, first_line)
+        if stop_line is None or stop_line > self._total_lines:
+            stop_line = self._total_lines
+        if start_line >= stop_line:
+            return start_line, array("Q")
+
+        base = self._line_starts_base
+        return start_line, self._line_starts[start_line - base : stop_line - base + 1]
+
+    @property
+    def retention(self) -> RetentionPolicy:
+        return self._retention
+
+    @retention.setter
+    def retention(self, retention: RetentionPolicy):
+        self._retention = retention
+        self.enforce_retention()
+
+    def append(self, chunk: Chunk):
+        """Record a new chunk at the end of the history"""
+        if len(chunk) == 0:
+            return
+
+        if isinstance(chunk, memoryview):
+            # Chunks replayed from a DiskHistory are memoryviews
+            chunk = bytes(chunk)
+
+        # Only the newlines are counted here. The lines themselves are indexed when
+        # they're first looked up.
+        line_count = chunk.count(self._newline)
+        if line_count:
+            self._last_line_start = self._end + chunk.rfind(self._newline) + 1
+        self._store(chunk)
+        self._offsets.append(self._end)
+        self._line_counts.append(line_count)
+        self._last_line_starts.append(self._last_line_start)
+        self._timestamps.append(monotonic())
+        self._end += len(chunk)
+        self._retained_lines += line_count
+        self._total_lines += line_count
+
+        if self._retention.is_bounded:
+            self.enforce_retention()
+
+    def chunks(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Chunk]:
+        """Yield the stored chunks that cover the range [start, stop) of the history,
+        without joining them together. Only the first and last chunk are sliced, if
+        the range doesn't line up with the chunk boundaries. Any part of the range that
+        has already been evicted is skipped.
+
+        :param start: The absolute offset to start from
+        :param stop: The absolute offset to stop at. If None, read until the end.
+        """
+        start, stop = self._clamp(start, stop)
+        if start >= stop:
+            return
+
+        index = bisect_right(self._offsets, start, lo=self._first) - 1
+        while index < len(self._offsets) and self._offsets[index] < stop:
+            chunk_start = self._offsets[index]
+            chunk_length = self._chunk_length(index)
+
+            low = max(start - chunk_start, 0)
+            high = min(stop - chunk_start, chunk_length)
+            if low == 0 and high == chunk_length:
+                yield self._load(index)
+            else:
+                yield self._load(index)[low:high]
+            index += 1
+
+    def replay(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Chunk]:
+        """Yield the range [start, stop) of the history in as few pieces as this
+        history can provide. This is used for handing history to new subscribers."""
+        data = self.read(start, stop)
+        if len(data):
+            yield data
+
+    def read(self, start: int = 0, stop: Optional[int] = None) -> Chunk:
+        """Return the range [start, stop) of the history as a single object. This
+        copies the data, so prefer self.chunks() where possible."""
+        return self._empty.join(self.chunks(start, stop))
+
+    def enforce_retention(self):
+        """Evict the oldest history until every limit in the policy is satisfied"""
+        retention = self._retention
+
+        if retention.max_age is not None:
+            cutoff = monotonic() - retention.max_age
+            while (
+                self._first < len(self._offsets)
+                and self._timestamps[self._first] < cutoff
+            ):
+                self._evict(self._chunk_length(self._first))
+
+        if retention.max_bytes is not None:
+            self._evict(len(self) - retention.max_bytes)
+
+        if retention.max_lines is not None:
+            excess_lines = self._retained_lines - retention.max_lines
+            if excess_lines > 0:
+                self._index_lines()
+                self._evict(self._length_of_lines(excess_lines))
+
+        if (
+            self._first > self._COMPACT_THRESHOLD
+            and self._first > len(self._offsets) / 2
+        ):
+            self._compact(self._first)
+            del self._offsets[: self._first]
+            del self._line_counts[: self._first]
+            del self._last_line_starts[: self._first]
+            del self._timestamps[: self._first]
+            self._first = 0
+
+        if (
+            self._first_line > self._COMPACT_THRESHOLD
+            and self._first_line > len(self._line_starts) / 2
+        ):
+            del self._line_starts[: self._first_line]
+            self._line_starts_base += self._first_line
+            self._first_line = 0
+
+    def close(self):
+        """Release any resources held by the history"""
+
+    def _clamp(self, start: int, stop: Optional[int]):
+        if stop is None or stop > self._end:
+            stop = self._end
+        return max(start, self._start), stop
+
+    def _chunk_length(self, index: int) -> int:
+        if index + 1 < len(self._offsets):
+            return self._offsets[index + 1] - self._offsets[index]
+        return self._end - self._offsets[index]
+
+    def _length_of_lines(self, line_count: int) -> int:
+        """Return the length of the first `line_count` retained lines, including
+        their newlines."""
+        return self._line_starts[self._first_line + line_count] - self._start
+
+    def _evict(self, length: int):
+        """Evict `length` units from the start of the history, slicing the oldest
+        remaining chunk if the length doesn't line up with a chunk boundary."""
+        while length > 0 and self._first < len(self._offsets):
+            chunk_length = self._chunk_length(self._first)
+
+            if chunk_length <= length:
+                self._retained_lines -= self._line_counts[self._first]
+                if self._line_counts[self._first]:
+                    self._start_line_start = self._last_line_starts[self._first]
+                self._release(self._first)
+                self._start += chunk_length
+                self._first += 1
+                length -= chunk_length
+            else:
+                evicted = self._load(self._first)[:length]
+                if isinstance(evicted, memoryview):
+                    evicted = bytes(evicted)
+                evicted_lines = evicted.count(self._newline)
+                if evicted_lines:
+                    self._start_line_start = (
+                        self._start + evicted.rfind(self._newline) + 1
+                    )
+                self._retained_lines -= evicted_lines
+                self._line_counts[self._first] -= evicted_lines
+                self._trim(self._first, length)
+                self._offsets[self._first] += length
+                self._start += length
+                length = 0
+
+        if self._indexed_end < self._start:
+            # Every line that was indexed has been evicted, so the index starts again
+            # from the oldest line, next time a line is looked up
+            self._line_starts = array("Q", [self._start_line_start])
+            self._line_starts_base = self.start_line
+            self._indexed_end = self._start
+        self._first_line = self._line_index(self._start)
+
+    def _index_lines(self):
+        """Index the start of every line in the chunks appended since the last lookup"""
+        offset = self._indexed_end
+        for chunk in self.chunks(offset):
+            if isinstance(chunk, memoryview):
+                chunk = bytes(chunk)
+            line_lengths = [len(line) + 1 for line in chunk.split(self._newline)]
+            line_lengths.pop()
+            line_starts = accumulate(line_lengths, initial=offset)
+            self._line_starts.extend(islice(line_starts, 1, None))
+            offset += len(chunk)
+        self._indexed_end = self._end
+
+    def _line_index(self, offset: int) -> int:
+        """Return the index in self._line_starts of the line that the offset is in"""
+        return bisect_right(self._line_starts, offset, lo=self._first_line) - 1
+
+    @abstractmethod
+    def _store(self, chunk: Chunk):
+        """Store a new chunk at the end of the history"""
+
+    @abstractmethod
+    def _load(self, index: int) -> Chunk:
+        """Return the full contents of the chunk at this index"""
+
+    @abstractmethod
+    def _release(self, index: int):
+        """The chunk at this index has been evicted, and can be freed"""
+
+    @abstractmethod
+    def _trim(self, index: int, length: int):
+        """Remove `length` units from the start of the chunk at this index"""
+
+    @abstractmethod
+    def _compact(self, count: int):
+        """Forget about the first `count` chunks, which have all been released"""
@@ -0,0 +1,174 @@
+import mmap
+import os
+import shutil
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from .base import Chunk, History
+from .retention import RetentionPolicy
+
+
+class DiskHistory(History[Chunk]):
+    """A History that appends chunks to segment files on disk and reads them back
+    through mmap, so that hours of output can be kept without growing the process.
+
+    Replaying a bytes history hands out memoryviews of the mapped segment files, so
+    the data is never copied into Python objects. String histories are stored as
+    utf-8 and decoded when they are read.
+    """
+
+    _SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+    """Once a segment file reaches this size, new chunks go into a new segment"""
+
+    def __init__(
+        self,
+        empty: Chunk,
+        directory: Path,
+        retention: RetentionPolicy = RetentionPolicy(),
+    ):
+        """
+        :param empty: An empty chunk of the type being stored, for example b"" or "".
+        :param directory: The directory to write segment files to. It is deleted
+            when the history is closed.
+        :param retention: The limits for how much history to keep
+        """
+        super().__init__(empty, retention)
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self._segments = array("L")
+        """The segment that each chunk is stored in"""
+        self._positions = array("Q")
+        """The byte position of each chunk within its segment file"""
+        self._sizes = array("Q")
+        """The size in bytes of each chunk within its segment file"""
+
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._oldest_segment = 0
+        self._segment = 0
+        self._segment_size = 0
+        self._fd: Optional[int] = self._open_segment(self._segment)
+
+    def replay(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Chunk]:
+        """Yield one memoryview per segment file that the range covers. Chunks are
+        written back to back, so the range is contiguous within each segment."""
+        if isinstance(self._empty, str):
+            yield from super().replay(start, stop)
+            return
+
+        start, stop = self._clamp(start, stop)
+        if start >= stop:
+            return
+
+        run_segment = None
+        run_start = run_end = 0
+        index = bisect_right(self._offsets, start, lo=self._first) - 1
+        while index < len(self._offsets) and self._offsets[index] < stop:
+            chunk_start = self._offsets[index]
+            low = self._positions[index] + max(start - chunk_start, 0)
+            high = self._positions[index] + min(stop - chunk_start, self._sizes[index])
+
+            if self._segments[index] == run_segment and low == run_end:
+                run_end = high
+            else:
+                if run_segment is not None:
+                    yield self._view(run_segment, run_start, run_end)
+                run_segment, run_start, run_end = self._segments[index], low, high
+            index += 1
+
+        yield self._view(run_segment, run_start, run_end)
+
+    def close(self):
+        if self._fd is None:
+            return
+
+        os.close(self._fd)
+        self._fd = None
+        for mapped in self._maps.values():
+            self._close_map(mapped)
+        self._maps.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _store(self, chunk: Chunk):
+        data = chunk.encode("utf8") if isinstance(chunk, str) else chunk
+
+        if self._segment_size + len(data) > self._SEGMENT_MAX_BYTES:
+            if self._segment_size:
+                os.close(self._fd)
+                self._segment += 1
+                self._segment_size = 0
+                self._fd = self._open_segment(self._segment)
+
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.write(self._fd, view[written:])
+
+        self._segments.append(self._segment)
+        self._positions.append(self._segment_size)
+        self._sizes.append(len(data))
+        self._segment_size += len(data)
+
+    def _load(self, index: int) -> Chunk:
+        position = self._positions[index]
+        view = self._view(
+            self._segments[index], position, position + self._sizes[index]
+        )
+        if isinstance(self._empty, str):
+            return str(view, "utf8")
+        return view
+
+    def _release(self, index: int):
+        # Delete any segment files that no longer hold retained chunks
+        if index + 1 < len(self._segments):
+            oldest_retained = self._segments[index + 1]
+        else:
+            oldest_retained = self._segment
+
+        while self._oldest_segment < oldest_retained:
+            mapped = self._maps.pop(self._oldest_segment, None)
+            if mapped is not None:
+                self._close_map(mapped)
+            self._segment_path(self._oldest_segment).unlink()
+            self._oldest_segment += 1
+
+    def _trim(self, index: int, length: int):
+        if isinstance(self._empty, str):
+            length = len(self._load(index)[:length].encode("utf8"))
+        self._positions[index] += length
+        self._sizes[index] -= length
+
+    def _compact(self, count: int):
+        del self._segments[:count]
+        del self._positions[:count]
+        del self._sizes[:count]
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"{segment:08d}.segment"
+
+    def _open_segment(self, segment: int) -> int:
+        return os.open(
+            self._segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600
+        )
+
+    def _view(self, segment: int, start: int, stop: int) -> memoryview:
+        """Return a memoryview of the range [start, stop) of a segment file"""
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < stop:
+            # The segment being written to grows, so it is remapped when the
+            # existing map doesn't reach far enough.
+            with self._segment_path(segment).open("rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return memoryview(mapped)[start:stop]
+
+    @staticmethod
+    def _close_map(mapped: mmap.mmap):
+        try:
+            mapped.close()
+        except BufferError:
+            # A subscriber is still holding a memoryview of the map. It will be
+            # unmapped once the last view is garbage collected.
+            pass
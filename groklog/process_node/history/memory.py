@@ -0,0 +1,27 @@
+from typing import List
+
+from .base import Chunk, History
+from .retention import RetentionPolicy
+
+
+class ChunkedHistory(History[Chunk]):
+    """A History that keeps the immutable chunks in a list in memory"""
+
+    def __init__(self, empty: Chunk, retention: RetentionPolicy = RetentionPolicy()):
+        super().__init__(empty, retention)
+        self._chunks: List[Chunk] = []
+
+    def _store(self, chunk: Chunk):
+        self._chunks.append(chunk)
+
+    def _load(self, index: int) -> Chunk:
+        return self._chunks[index]
+
+    def _release(self, index: int):
+        self._chunks[index] = self._empty
+
+    def _trim(self, index: int, length: int):
+        self._chunks[index] = self._chunks[index][length:]
+
+    def _compact(self, count: int):
+        del self._chunks[:count]
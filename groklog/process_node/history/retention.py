@@ -0,0 +1,32 @@
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """Limits on how much history a ProcessNode keeps around. Once a limit is passed,
+    the oldest history is evicted. A limit of None means that aspect is unbounded."""
+
+    max_bytes: Optional[int] = None
+    """The maximum length of the history. For string histories this is characters."""
+
+    max_lines: Optional[int] = None
+    """The maximum number of complete lines to keep"""
+
+    max_age: Optional[float] = None
+    """The maximum number of seconds to keep a chunk of history for"""
+
+    @property
+    def is_bounded(self) -> bool:
+        return (
+            self.max_bytes is not None
+            or self.max_lines is not None
+            or self.max_age is not None
+        )
+
+    def to_json(self) -> dict:
+        return {key: limit for key, limit in asdict(self).items() if limit is not None}
+
+    @classmethod
+    def from_json(cls, info: dict) -> "RetentionPolicy":
+        return cls(**info)
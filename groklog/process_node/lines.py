@@ -0,0 +1,76 @@
+from array import array
+from dataclasses import dataclass, field
+from typing import List
+
+
+@dataclass(frozen=True)
+class LineBatch:
+    """Complete lines of a ProcessNode's output, as published on LINE_STREAM"""
+
+    lines: List[str]
+    """The decoded lines, without their trailing newlines"""
+
+    first_line_number: int
+    """The absolute line number of the first line. Line numbers start at 0, and count
+    every line the node has ever output."""
+
+    offsets: array = field(default_factory=lambda: array("Q"))
+    """The absolute byte offset in the node's output that each line starts at"""
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def line_numbers(self) -> range:
+        return range(self.first_line_number, self.first_line_number + len(self.lines))
+
+
+class LineFramer:
+    """Splits a stream of bytes into batches of complete lines. An incomplete line at
+    the end of a chunk is held until the rest of it arrives.
+
+    Lines are split on the raw bytes and then decoded one by one, which is safe because
+    a newline byte never appears inside a multi-byte utf-8 character.
+    """
+
+    def __init__(self, line_number: int = 0, offset: int = 0, partial: bytes = b""):
+        """
+        :param line_number: The absolute line number of the next line
+        :param offset: The absolute byte offset that the next line starts at
+        :param partial: The start of the next line, if some of it has already arrived
+        """
+        self._line_number = line_number
+        self._offset = offset
+        self._partial = bytearray(partial)
+
+    def feed(self, data: bytes) -> LineBatch:
+        """Add data to the stream
+        :return: Every line that the data completed. It's empty if it didn't complete
+            any lines.
+        """
+        last_newline = data.rfind(b"\n")
+        if last_newline == -1:
+            self._partial += data
+            return LineBatch(lines=[], first_line_number=self._line_number)
+
+        complete = data[: last_newline + 1]
+        if self._partial:
+            complete = bytes(self._partial) + complete
+        raw_lines = complete.split(b"\n")
+        raw_lines.pop()  # The empty string after the last newline
+
+        offsets = array("Q")
+        offset = self._offset
+        for raw_line in raw_lines:
+            offsets.append(offset)
+            offset += len(raw_line) + 1
+
+        batch = LineBatch(
+            lines=[raw_line.decode("utf8", "replace") for raw_line in raw_lines],
+            first_line_number=self._line_number,
+            offsets=offsets,
+        )
+        self._line_number += len(raw_lines)
+        self._offset = offset
+        self._partial = bytearray(data[last_newline + 1 :])
+        return batch
@@ -0,0 +1,106 @@
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic
+from typing import Deque, Tuple
+
+
+@dataclass(frozen=True)
+class NodeStats:
+    """A snapshot of a ProcessNode's runtime metrics, as returned by its stats()"""
+
+    name: str
+
+    bytes_in: int
+    """The bytes of input written to the node. Native filters are fed lines instead,
+    so for them this is 0, and lines_in is counted."""
+
+    lines_in: int
+    """The lines of input handed to a native filter"""
+
+    bytes_out: int
+    """The bytes of output the node has ever published, including evicted history"""
+
+    lines_out: int
+    """The complete lines of output the node has ever published"""
+
+    bytes_out_per_second: float
+    lines_out_per_second: float
+    """How quickly the output has grown over the last few seconds"""
+
+    history_bytes: int
+    """The size of the history that's currently retained"""
+
+    callback_seconds: float
+    """The total time spent in subscriber callbacks while publishing output. Children
+    are fed from these callbacks, so a node whose callbacks are slow holds up the
+    thread that every node publishes from."""
+
+    pending_subscribers: int
+    """Subscribers waiting to be handed the history"""
+
+    input_backlog_bytes: int
+    """Input waiting for the node's process to read it"""
+
+    stall_time: float
+    """The total seconds that input has waited for the node's process to read it"""
+
+    dropped_bytes: int
+    """Input discarded because the node fell behind"""
+
+    paused: bool
+    """True if a child has paused reading the node's output, because it fell behind"""
+
+    output_ended: bool
+
+
+class NodeMetrics:
+    """The counters behind a ProcessNode's stats. The output counters are kept by the
+    node's history, so this only counts the input, and the time spent in callbacks.
+
+    Counters are only changed from the thread that the node publishes from, and can be
+    read from any thread without locking.
+    """
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.lines_in = 0
+        self.callback_seconds = 0.0
+        self.output_rate = RateMeter()
+
+
+class RateMeter:
+    """Measures how quickly a pair of counters, such as bytes and lines, are growing.
+    It's sampled whenever the counters change, instead of on a timer, and keeps just
+    enough samples to cover the last few seconds."""
+
+    def __init__(self, window: float = 2.0, resolution: float = 0.25):
+        """
+        :param window: Roughly how many seconds the rates are averaged over
+        :param resolution: The least number of seconds between two samples
+        """
+        self._window = window
+        self._resolution = resolution
+        self._samples: Deque[Tuple[float, int, int]] = deque()
+
+    def sample(self, first: int, second: int):
+        """Record the current values of the counters"""
+        now = monotonic()
+        samples = self._samples
+        if samples and now - samples[-1][0] < self._resolution:
+            return
+        samples.append((now, first, second))
+        # Keep one sample from before the window, so the whole window is covered
+        while len(samples) > 2 and now - samples[1][0] >= self._window:
+            samples.popleft()
+
+    def rates(self, first: int, second: int) -> Tuple[float, float]:
+        """Return how many the counters grew by per second, given their current values.
+        The rates fall towards 0 once the counters stop changing."""
+        try:
+            then, first_then, second_then = self._samples[0]
+        except IndexError:
+            return 0.0, 0.0
+        elapsed = monotonic() - then
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return (first - first_then) / elapsed, (second - second_then) / elapsed
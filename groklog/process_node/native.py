@@ -0,0 +1,496 @@
+import re
+import shlex
+from abc import abstractmethod
+from bisect import bisect_right
+from itertools import accumulate
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+)
+
+from .base import ProcessNode
+from .history import HistoryBackend, RetentionPolicy
+from .lines import LineBatch
+
+
+class NativeFilterNode(ProcessNode):
+    """A filter that runs inside groklog, rather than in a child process.
+
+    Native filters are fed their parent's LINE_STREAM, and filter each batch of lines in
+    the thread that the parent publishes from. There's no process to fork, and no pipe
+    for the lines to be copied through, so they cost no system calls at all.
+
+    Subclasses are registered by their TYPE, which is how they're saved in profiles,
+    and are created from their options with from_options().
+    """
+
+    TYPE: str
+    """The name of this kind of filter, as saved in profiles"""
+
+    _input_topic = ProcessNode.Topic.LINE_STREAM
+
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+    ):
+        """
+        :param command: The shell command that this filter is equivalent to. It's only
+            used to describe the filter.
+        """
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+        )
+        self._fusion: Optional[FusedChain] = None
+        """The chain this filter has been fused into, if any"""
+
+    @classmethod
+    def from_options(
+        cls,
+        name: str,
+        options: Dict[str, Any],
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+    ) -> "NativeFilterNode":
+        return cls(
+            name=name, retention=retention, history_backend=history_backend, **options
+        )
+
+    @property
+    @abstractmethod
+    def options(self) -> Dict[str, Any]:
+        """The keyword arguments that this filter was created with, for profiles"""
+
+    def write(self, line_batch: LineBatch):
+        """Filter a batch of lines from the parent, and publish what's left"""
+        if not self._running:
+            return
+
+        self._metrics.lines_in += len(line_batch.lines)
+        self._publish_lines(self._filter_lines(line_batch.lines))
+
+    @abstractmethod
+    def _filter_lines(self, lines: List[str]) -> List[str]:
+        """Return the output lines for a batch of input lines"""
+
+    def _publish_lines(self, lines: List[str]):
+        fusion = self._fusion
+        if fusion is not None and self is not fusion.tail:
+            # The rest of the chain is run directly, without publishing to it
+            fusion.forward(self, lines)
+        elif lines:
+            lines.append("")
+            self._record_and_publish("\n".join(lines).encode())
+
+    def subscribe(self, topic: ProcessNode.Topic, subscriber: Callable):
+        self._materialize()
+        super().subscribe(topic, subscriber)
+
+    def subscribe_with_history(
+        self, topic: ProcessNode.Topic, subscriber: Callable, **kwargs
+    ):
+        self._materialize()
+        super().subscribe_with_history(topic, subscriber, **kwargs)
+
+    def _materialize(self):
+        """Make sure this filter's output is being recorded and published, before
+        anything new subscribes to it"""
+        fusion = self._fusion
+        if fusion is not None and self is not fusion.tail:
+            fusion.dissolve()
+
+    def _end_input(self):
+        # Lines are filtered as soon as they're written, so the output ends with the
+        # input
+        if self._running and not self.output_ended:
+            self._end_output()
+
+    def _pause_reading(self):
+        # There's no process output to stop reading, so ask the parent to stop instead
+        if self.parent is not None:
+            self.parent._pause_reading()
+
+    def _resume_reading(self):
+        if self.parent is not None:
+            self.parent._resume_reading()
+
+    def _stop_process(self, timeout):
+        pass
+
+
+class FusedChain:
+    """A linear chain of native filters that is run as a single stage.
+
+    Normally, each filter in a chain records its output, encodes and publishes it, and
+    the next filter splits it back into lines. Once fused, the head's output is passed
+    straight through the other filters' _filter_lines as lists of strings, and only the
+    tail records and publishes anything.
+
+    The filters stay in the tree as they were, and the output of the filters before
+    the tail can be materialized on demand: as soon as anything subscribes to one of
+    them, the chain is dissolved, and the output they missed is rebuilt by running the
+    source's retained lines through them.
+    """
+
+    def __init__(self, nodes: List[NativeFilterNode]):
+        """
+        :param nodes: The filters, from the head down to the tail. Each must be the
+            only child of the one before it.
+        """
+        self.nodes = nodes
+        self.head = nodes[0]
+        self.tail = nodes[-1]
+        self.source = self.head.parent
+        """The node that feeds the head"""
+
+        with self.source._history_lock:
+            # Lines are only published while holding the source's history lock, so
+            # every line before this one has been fed through the unfused chain
+            self._first_fused_line = self.source.line_count()
+            for node in nodes:
+                node._fusion = self
+
+    def forward(self, node: NativeFilterNode, lines: List[str]):
+        """Run the lines that a filter output through the rest of the chain"""
+        for next_node in self.nodes[self.nodes.index(node) + 1 :]:
+            if not lines:
+                return
+            next_node._metrics.lines_in += len(lines)
+            lines = next_node._filter_lines(lines)
+        if self.tail._running:
+            self.tail._publish_lines(lines)
+
+    def dissolve(self):
+        """Unfuse the chain, after filling in the output that the filters before the
+        tail missed while it was fused"""
+        with self.source._history_lock:
+            if self.head._fusion is not self:
+                return
+
+            lines = self.source.get_lines(self._first_fused_line).lines
+            for node in self.nodes[:-1]:
+                lines = node._filter_lines(lines)
+                node._fusion = None
+                if lines and node._running:
+                    with node._history_lock:
+                        node._bytes_history.append(("\n".join(lines) + "\n").encode())
+                        # They're recreated from the end of the history when needed
+                        node._line_framer = None
+                        node._decoder = None
+            self.tail._fusion = None
+
+
+class MatchFilterNode(NativeFilterNode):
+    """A filter that keeps the lines matching some condition, or the lines that don't
+    if it's inverted.
+
+    Sibling match filters don't subscribe to their parent individually. Instead, the
+    parent's MatchStage scans each batch of lines once for all of them, and hands each
+    filter its lines.
+    """
+
+    invert: bool
+
+    @property
+    def shared_pattern(self) -> Optional[str]:
+        """A regular expression that matches wherever this filter matches, for the
+        MatchStage to combine with its siblings. If None, the filter checks every line
+        itself."""
+        return None
+
+    @abstractmethod
+    def matches(self, line: str) -> bool:
+        """Return True if the line matches, regardless of whether this is inverted"""
+
+    def _filter_lines(self, lines: List[str]) -> List[str]:
+        invert = self.invert
+        return [line for line in lines if self.matches(line) is not invert]
+
+    def _subscribe_to_parent(self):
+        if self.parent._match_stage is None:
+            self.parent._match_stage = MatchStage(self.parent)
+        self.parent._match_stage.add_filter(self)
+
+
+class RegexFilterNode(MatchFilterNode):
+    """Keeps the lines that match a regular expression, like `grep -E`"""
+
+    TYPE = "regex"
+
+    def __init__(
+        self,
+        name: str,
+        pattern: str,
+        invert: bool = False,
+        ignore_case: bool = False,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+    ):
+        """
+        :param pattern: A python regular expression to search each line for
+        :param invert: If True, keep the lines that don't match instead
+        :param ignore_case: If True, match regardless of case
+        """
+        flags = "-E" + ("v" if invert else "") + ("i" if ignore_case else "")
+        super().__init__(
+            name=name,
+            command=f"grep {flags} {shlex.quote(pattern)}",
+            retention=retention,
+            history_backend=history_backend,
+        )
+        self.pattern = pattern
+        self.invert = invert
+        self.ignore_case = ignore_case
+        self._search = re.compile(pattern, re.IGNORECASE if ignore_case else 0).search
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        return {
+            "pattern": self.pattern,
+            "invert": self.invert,
+            "ignore_case": self.ignore_case,
+        }
+
+    @property
+    def shared_pattern(self) -> Optional[str]:
+        if _UNSHARABLE_SYNTAX.search(self.pattern):
+            return None
+        shared = f"(?i:{self.pattern})" if self.ignore_case else f"(?:{self.pattern})"
+        try:
+            # Patterns with global flags such as (?x) can't be nested in a group
+            re.compile(shared)
+        except re.error:
+            return None
+        return shared
+
+    def matches(self, line: str) -> bool:
+        return self._search(line) is not None
+
+    def _filter_lines(self, lines: List[str]) -> List[str]:
+        search, invert = self._search, self.invert
+        return [line for line in lines if (search(line) is None) is invert]
+
+
+class SubstringFilterNode(MatchFilterNode):
+    """Keeps the lines that contain a fixed string, like `grep -F`"""
+
+    TYPE = "substring"
+
+    def __init__(
+        self,
+        name: str,
+        substring: str,
+        invert: bool = False,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+    ):
+        """
+        :param substring: The string to look for in each line
+        :param invert: If True, keep the lines that don't contain it instead
+        """
+        flags = "-F" + ("v" if invert else "")
+        super().__init__(
+            name=name,
+            command=f"grep {flags} {shlex.quote(substring)}",
+            retention=retention,
+            history_backend=history_backend,
+        )
+        self.substring = substring
+        self.invert = invert
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        return {"substring": self.substring, "invert": self.invert}
+
+    @property
+    def shared_pattern(self) -> Optional[str]:
+        # An empty string is in every line, so there's nothing to scan for
+        return re.escape(self.substring) if self.substring else None
+
+    def matches(self, line: str) -> bool:
+        return self.substring in line
+
+    def _filter_lines(self, lines: List[str]) -> List[str]:
+        substring, invert = self.substring, self.invert
+        return [line for line in lines if (substring in line) is not invert]
+
+
+class CutFilterNode(NativeFilterNode):
+    """Keeps some of the fields of each line, like `cut -f` or `awk '{print $1}'`"""
+
+    TYPE = "cut"
+
+    def __init__(
+        self,
+        name: str,
+        fields: Sequence[int],
+        delimiter: Optional[str] = None,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+    ):
+        """
+        :param fields: The fields to keep, numbered from 1, in the order to output them
+        :param delimiter: The string that separates fields. If None, fields are
+            separated by runs of whitespace, and are joined back together with a space.
+            Otherwise, like `cut -d`, lines without the delimiter are kept whole.
+        """
+        if any(field < 1 for field in fields):
+            raise ValueError("Fields are numbered from 1")
+
+        if delimiter is None:
+            printed = ", ".join(f"${field}" for field in fields)
+            command = f"awk {shlex.quote(f'{{print {printed}}}')}"
+        else:
+            numbers = ",".join(str(field) for field in fields)
+            command = f"cut -d {shlex.quote(delimiter)} -f {numbers}"
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+        )
+        self.fields = list(fields)
+        self.delimiter = delimiter
+        self._indices = [field - 1 for field in self.fields]
+
+    @property
+    def options(self) -> Dict[str, Any]:
+        return {"fields": self.fields, "delimiter": self.delimiter}
+
+    def _filter_lines(self, lines: List[str]) -> List[str]:
+        delimiter, indices = self.delimiter, self._indices
+        joiner = " " if delimiter is None else delimiter
+        output = []
+        for line in lines:
+            columns = line.split(delimiter)
+            if len(columns) == 1 and delimiter is not None:
+                output.append(line)
+                continue
+            output.append(joiner.join(columns[i] for i in indices if i < len(columns)))
+        return output
+
+
+_UNSHARABLE_SYNTAX = re.compile(r"\\[1-9AZ]|\(\?P=|\(\?<?[=!]")
+"""Backreferences, which would be renumbered by combining patterns, \\A and \\Z,
+which mean the start and end of each line when it's matched alone, and lookarounds,
+which would see the newlines between lines when they're joined. For example,
+(?<!\\s)ERROR matches "ERROR at start" alone, but not once it follows a newline."""
+
+
+class MatchStage:
+    """Matches a node's output for all of its MatchFilterNode children in one pass.
+
+    Each batch of lines is joined back together, and searched as a whole, once, with
+    an alternation of every filter's pattern, substrings included. Lines without a hit
+    are settled without being looked at again, which for typical log filters is nearly
+    every line. Only the candidate lines with a hit are checked against each filter
+    individually.
+
+    The stage is the parent's only LINE_STREAM subscriber for its match filters, and
+    runs in the thread that the parent publishes from.
+    """
+
+    def __init__(self, parent: ProcessNode):
+        self._parent = parent
+        self._filters: List[MatchFilterNode] = []
+        self._combined: Optional[re.Pattern] = None
+        """An alternation of every filter's shared_pattern"""
+        self._unshared: Set[MatchFilterNode] = set()
+        """The filters without a shared_pattern, which check every line themselves"""
+        self._subscribed = False
+
+    def add_filter(self, filter: MatchFilterNode):
+        """Start matching lines for the filter, after handing it the parent's history"""
+        self._parent._call_soon(lambda: self._onboard_filter(filter))
+
+    def write(self, line_batch: LineBatch):
+        """Match a batch of lines from the parent, and publish them to each filter"""
+        self._filters = [f for f in self._filters if f._running]
+        lines = line_batch.lines
+        if not self._filters or not lines:
+            return
+
+        candidates = []
+        if self._combined is not None:
+            text = "\n".join(lines)
+            line_starts = list(accumulate((len(line) + 1 for line in lines), initial=0))
+            spans = (match.span() for match in self._combined.finditer(text))
+            candidates = _lines_touched(spans, line_starts)
+
+        for filter in self._filters:
+            filter._metrics.lines_in += len(lines)
+            if filter in self._unshared:
+                filter._publish_lines(filter._filter_lines(lines))
+                continue
+
+            matched = [i for i in candidates if filter.matches(lines[i])]
+            if filter.invert:
+                # Lines that aren't candidates can't match, so they're all kept
+                skipped = set(matched)
+                kept = [line for i, line in enumerate(lines) if i not in skipped]
+            else:
+                kept = [lines[i] for i in matched]
+            filter._publish_lines(kept)
+
+    def _onboard_filter(self, filter: MatchFilterNode):
+        parent = self._parent
+        with parent._history_lock:
+            if not self._subscribed:
+                parent.subscribe(ProcessNode.Topic.LINE_STREAM, self.write)
+                self._subscribed = True
+
+            # This runs in the thread that the parent publishes from, while holding its
+            # history lock, so no lines can be published between the history and the
+            # first batch that the stage matches for the filter.
+            line_batches, _ = parent._frame_history()
+            for line_batch in line_batches:
+                filter.write(line_batch)
+
+            self._filters.append(filter)
+            pattern = filter.shared_pattern
+            if pattern is None:
+                self._unshared.add(filter)
+            else:
+                patterns = [self._combined.pattern] if self._combined else []
+                try:
+                    self._combined = re.compile(
+                        "|".join(patterns + [pattern]), re.MULTILINE
+                    )
+                except re.error:
+                    # Patterns that are valid alone can clash once they're combined,
+                    # such as two that define a group with the same name
+                    self._unshared.add(filter)
+
+
+def _lines_touched(
+    spans: Iterable[Tuple[int, int]], line_starts: List[int]
+) -> List[int]:
+    """Return the indexes of every line that any of the spans touch"""
+    lines = set()
+    for start, end in spans:
+        # A match can span several lines, and hide matches that start within it, so
+        # every line it touches is a candidate
+        first = bisect_right(line_starts, start) - 1
+        last = bisect_right(line_starts, max(end - 1, start)) - 1
+        lines.update(range(first, last + 1))
+    return sorted(lines)
+
+
+NATIVE_FILTER_TYPES: Dict[str, Type[NativeFilterNode]] = {
+    node_class.TYPE: node_class
+    for node_class in (RegexFilterNode, SubstringFilterNode, CutFilterNode)
+}
+"""Every kind of native filter, by its TYPE"""
@@ -0,0 +1,380 @@
+import os
+import signal
+import subprocess
+import sys
+import uuid
+from collections import deque
+from typing import Deque, List, Optional
+
+from .base import ProcessNode
+from .coalesce import CoalescePolicy
+from .history import HistoryBackend, RetentionPolicy
+from .reactor import reactor
+from .tracing import tracer
+
+_WORKER_SCRIPT = """\
+import subprocess
+import sys
+
+command, marker = sys.argv[1], sys.argv[2].encode()
+stdin, stdout = sys.stdin.buffer, sys.stdout.buffer
+for size in stdin:
+    chunk = stdin.read(int(size))
+    subprocess.Popen(command, shell=True, stdin=subprocess.PIPE).communicate(chunk)
+    stdout.write(marker)
+    stdout.flush()
+"""
+"""The loop that each worker runs. Each chunk is written to it as its size on a line
+of its own, followed by the chunk itself. The worker reads exactly that many bytes,
+runs the command over them, and prints the marker after the command's output.
+
+The worker is the only reader of its stdin, and the command is fed through a pipe of
+its own, so the framing doesn't depend on how much the command or any tool reads
+ahead. Shell tools can't promise that: `head -c` reads ahead through stdio on BSD and
+macOS, which would swallow the next chunk's size. Input that the command leaves
+unread is simply dropped when it exits."""
+
+
+class _Chunk:
+    """A run of complete lines, and the output of filtering them"""
+
+    def __init__(self):
+        self.output: List[bytes] = []
+        """Output that is waiting for the chunks before this one to finish"""
+        self.finished = False
+
+
+class _Worker:
+    """A long-lived worker, which runs the command over one chunk at a time"""
+
+    def __init__(self, command: str, marker: bytes):
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", _WORKER_SCRIPT, command, marker.decode()],
+            preexec_fn=os.setsid,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        self.stdin = self.process.stdin.fileno()
+        self.stdout = self.process.stdout.fileno()
+        os.set_blocking(self.stdin, False)
+        os.set_blocking(self.stdout, False)
+
+        self.chunks: Deque[_Chunk] = deque()
+        """The chunks handed to this worker whose output hasn't ended, oldest first"""
+        self.input: Deque[memoryview] = deque()
+        """Input that hasn't been written to the worker yet"""
+        self.writing = False
+        """Whether the reactor is waiting for stdin to be writable"""
+        self.partial_marker = b""
+        """The end of the output read so far, if it could be the start of a marker"""
+
+
+class ParallelProcessIO(ProcessNode):
+    """Runs a filter command across several worker processes at once, for filters
+    that are too slow to keep up on a single core.
+
+    The input is cut into chunks of complete lines, which are handed round-robin to a
+    pool of long-lived workers. Each worker runs the command over its chunks one
+    at a time, and prints a marker after each chunk's output, so the output can be
+    split back into chunks. The output is published in the order the chunks were cut,
+    so children and viewers see exactly what a single process would have output.
+
+    Each worker holds at most _CHUNKS_PER_WORKER chunks, so that the next one is
+    already waiting in its pipe when it finishes one. While every worker is full,
+    input collects into the next chunk, so chunks grow as the input speeds up, up to
+    _MAX_CHUNK_BYTES.
+
+    This is only correct for commands that treat each line independently, such as grep,
+    `jq -c`, or a script that transforms one line at a time. Commands like sort or uniq
+    would only see one chunk of lines at a time.
+    """
+
+    _MAX_PENDING_BYTES = 16 * 1024 * 1024
+    """The most input to collect while every worker is busy, before pausing the
+    parent. The parent is resumed once the pending input has halved."""
+
+    _CHUNKS_PER_WORKER = 2
+    """The most chunks to hand a worker before its output for the first has ended"""
+
+    _MAX_CHUNK_BYTES = 4 * 1024 * 1024
+    """The most input to cut into one chunk, so that a backlog is spread across the
+    workers. Longer lines are never split."""
+
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        workers: Optional[int] = None,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
+        """
+        :param workers: The number of worker processes to run. If None, one is run
+            for each CPU.
+        """
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+        self.workers = workers or os.cpu_count() or 1
+        if self.workers < 1:
+            raise ValueError("There must be at least one worker")
+
+        self._marker = f"\x1egroklog-chunk-end-{uuid.uuid4().hex}\x1e".encode()
+        """Printed by the workers after each chunk's output. It's random, so the output
+        of a command can't contain it by accident."""
+
+        # These are only accessed from the reactor thread
+        self._pending = bytearray()
+        """Input that hasn't been handed to a worker yet"""
+        self._parent_paused = False
+        self._chunks: Deque[_Chunk] = deque()
+        """Chunks that haven't been published in full, in the order they were cut"""
+        self._workers: List[Optional[_Worker]] = [None] * self.workers
+        """The worker pool. Workers are started when they're first needed, and again
+        if they exit."""
+        self._next_worker = 0
+        """The worker to offer the next chunk to first"""
+        self._exiting: List[subprocess.Popen] = []
+        """Workers that closed their output, but hadn't exited yet"""
+        self._input_ended = False
+        """Set once the parent's output has ended, after which the incomplete line at
+        the end of the input is handed to a worker too"""
+
+        self._reading = True
+        reactor.acquire()
+
+    def write(self, data: bytes):
+        """Input data from an upstream process. This never blocks."""
+        if self._running:
+            if tracer.enabled:
+                tracer.hand_over(self)
+            reactor.call_soon(lambda: self._receive(bytes(data)))
+
+    def _receive(self, data: bytes):
+        if not self._running:
+            return
+
+        self._metrics.bytes_in += len(data)
+        self._pending += data
+        self._dispatch()
+        if not self._parent_paused and len(self._pending) > self._MAX_PENDING_BYTES:
+            self._parent_paused = True
+            self._pause_parent()
+
+    def _input_backlog(self) -> int:
+        # Only the input that hasn't been handed to a worker yet is counted, because
+        # the workers are only safe to look at from the reactor thread
+        return len(self._pending)
+
+    def _dispatch(self):
+        """Hand the complete lines that are pending to a worker, if one has room"""
+        while self._pending:
+            cut = self._pending.rfind(b"\n", 0, self._MAX_CHUNK_BYTES) + 1
+            if cut == 0:
+                cut = self._pending.find(b"\n") + 1
+            if cut == 0 and self._input_ended:
+                cut = len(self._pending)
+            if cut == 0:
+                break
+            worker = self._free_worker()
+            if worker is None:
+                break
+            data = bytes(self._pending[:cut])
+            del self._pending[:cut]
+            self._send_chunk(worker, data)
+
+        if self._parent_paused and len(self._pending) <= self._MAX_PENDING_BYTES // 2:
+            self._parent_paused = False
+            self._resume_parent()
+
+    def _free_worker(self) -> Optional[_Worker]:
+        """Return the next worker in turn that has room for another chunk"""
+        for _ in range(self.workers):
+            index = self._next_worker
+            self._next_worker = (index + 1) % self.workers
+            worker = self._workers[index]
+            if worker is None:
+                worker = self._workers[index] = _Worker(self.command, self._marker)
+                if self._read_pauses == 0:
+                    reactor.add_reader(
+                        worker.stdout, lambda w=worker: self._read_worker(w)
+                    )
+            if len(worker.chunks) < self._CHUNKS_PER_WORKER:
+                return worker
+        return None
+
+    def _send_chunk(self, worker: _Worker, data: bytes):
+        chunk = _Chunk()
+        self._chunks.append(chunk)
+        worker.chunks.append(chunk)
+
+        worker.input += [memoryview(b"%d\n" % len(data)), memoryview(data)]
+        if not worker.writing:
+            self._write_worker(worker)
+
+    def _write_worker(self, worker: _Worker):
+        """Write as much of the worker's input as it will take"""
+        try:
+            while worker.input:
+                data = worker.input[0]
+                written = os.write(worker.stdin, data)
+                if written < len(data):
+                    worker.input[0] = data[written:]
+                    break
+                worker.input.popleft()
+        except BlockingIOError:
+            pass
+        except BrokenPipeError:
+            # The worker has exited. Its chunks are finished once its output ends.
+            worker.input.clear()
+
+        if worker.input and not worker.writing:
+            worker.writing = True
+            reactor.add_writer(worker.stdin, lambda: self._write_worker(worker))
+        elif not worker.input and worker.writing:
+            worker.writing = False
+            reactor.remove_writer(worker.stdin)
+
+    def _read_worker(self, worker: _Worker):
+        try:
+            data = os.read(worker.stdout, self._READ_MAX_BYTES)
+        except BlockingIOError:
+            return
+
+        if len(data) == 0:
+            self._retire_worker(worker)
+            return
+
+        marker = self._marker
+        data = worker.partial_marker + data
+        end = data.find(marker)
+        while end != -1:
+            self._chunk_output(worker, data[:end])
+            worker.chunks.popleft().finished = True
+            self._publish_finished_chunks()
+            data = data[end + len(marker) :]
+            end = data.find(marker)
+
+        # Hold back the end of the output if it could be the start of a marker. The
+        # marker's first byte appears nowhere else in it.
+        start = data.rfind(marker[:1], max(len(data) - len(marker) + 1, 0))
+        if start != -1 and marker.startswith(data[start:]):
+            data, worker.partial_marker = data[:start], data[start:]
+        else:
+            worker.partial_marker = b""
+        self._chunk_output(worker, data)
+
+        self._dispatch()
+        self._end_output_if_finished()
+
+    def _chunk_output(self, worker: _Worker, data: bytes):
+        if not data or not worker.chunks:
+            return
+        chunk = worker.chunks[0]
+        if chunk is self._chunks[0]:
+            # The oldest chunk can be published as soon as its output arrives
+            self._publish_output(data)
+        else:
+            chunk.output.append(data)
+
+    def _publish_finished_chunks(self):
+        """Publish every chunk that's next in line, up to the first unfinished one"""
+        while self._chunks:
+            oldest = self._chunks[0]
+            for data in oldest.output:
+                self._publish_output(data)
+            oldest.output.clear()
+            if not oldest.finished:
+                break
+            self._chunks.popleft()
+
+    def _retire_worker(self, worker: _Worker):
+        """Called once a worker has closed its output. Its place in the pool is freed,
+        and anything it hadn't finished is treated as finished."""
+        self._workers[self._workers.index(worker)] = None
+        self._close_worker(worker)
+        worker.process.stdout.close()
+        if not worker.process.stdin.closed:
+            worker.process.stdin.close()
+        self._exiting.append(worker.process)
+        self._exiting = [p for p in self._exiting if p.poll() is None]
+
+        for chunk in worker.chunks:
+            chunk.finished = True
+        self._publish_finished_chunks()
+        self._dispatch()
+        self._end_output_if_finished()
+
+    def _end_input(self):
+        # Input is received in the reactor thread, so this must wait for any that's
+        # still on its way
+        reactor.call_soon(self._finish_input)
+
+    def _finish_input(self):
+        if not self._running or self._input_ended:
+            return
+        self._input_ended = True
+        self._dispatch()
+        self._end_output_if_finished()
+
+    def _end_output_if_finished(self):
+        """End this node's output once its input has ended and every chunk of it has
+        been published, and let the workers exit"""
+        if self._input_ended and not self._chunks and not self._pending:
+            for worker in self._workers:
+                if worker is not None and not worker.process.stdin.closed:
+                    worker.process.stdin.close()
+            self._coalescer.flush()
+            if not self.output_ended:
+                self._end_output()
+
+    def _watch_output(self, enabled: bool):
+        for worker in self._workers:
+            if worker is None:
+                continue
+            if enabled:
+                reactor.add_reader(worker.stdout, lambda w=worker: self._read_worker(w))
+            else:
+                reactor.remove_reader(worker.stdout)
+
+    def _stop_io(self):
+        reactor.run(self._close_workers)
+        self._reading = False
+        reactor.release()
+
+    def _close_workers(self):
+        for worker in self._workers:
+            if worker is not None:
+                self._close_worker(worker)
+
+    @staticmethod
+    def _close_worker(worker: _Worker):
+        if worker.writing:
+            worker.writing = False
+            reactor.remove_writer(worker.stdin)
+        reactor.remove_reader(worker.stdout)
+
+    def _stop_process(self, timeout):
+        for worker in self._workers:
+            if worker is None:
+                continue
+            try:
+                # The command runs in the worker's process group, so it's killed too
+                os.killpg(worker.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            for pipe in (worker.process.stdin, worker.process.stdout):
+                pipe.close()
+            self._exiting.append(worker.process)
+        for process in self._exiting:
+            process.wait(timeout)
+        self._workers = [None] * self.workers
+        self._chunks.clear()
+        self._exiting.clear()
+        self._pending.clear()
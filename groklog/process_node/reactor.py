@@ -0,0 +1,282 @@
+import heapq
+import logging
+import os
+import selectors
+from collections import deque
+from itertools import count
+from threading import Event, Lock, Thread, current_thread
+from time import monotonic
+from typing import Callable, Deque, Dict, List, Optional
+
+_logger = logging.getLogger(__name__)
+
+
+class _Handlers:
+    def __init__(self):
+        self.on_readable: Optional[Callable[[], None]] = None
+        self.on_writable: Optional[Callable[[], None]] = None
+
+    @property
+    def events(self) -> int:
+        events = 0
+        if self.on_readable is not None:
+            events |= selectors.EVENT_READ
+        if self.on_writable is not None:
+            events |= selectors.EVENT_WRITE
+        return events
+
+
+class TimerHandle:
+    """A callback scheduled with Reactor.call_later"""
+
+    _order = count()
+
+    def __init__(self, deadline: float, callback: Callable[[], None]):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+        self._sequence = next(self._order)
+
+    def __lt__(self, other: "TimerHandle"):
+        return (self.deadline, self._sequence) < (other.deadline, other._sequence)
+
+    def cancel(self):
+        """Stop the callback from being called, if it hasn't been already"""
+        self.cancelled = True
+
+
+class Reactor:
+    """A single background thread that waits on the file descriptors of every
+    ProcessNode using the best selector for the platform (epoll on Linux), and calls
+    the registered callbacks as soon as a file descriptor is ready.
+
+    All callbacks, including those scheduled with call_soon, run in the reactor
+    thread, so they never run concurrently with each other.
+
+    The thread is started when the first ProcessNode acquires the reactor, and stops
+    once the last one releases it.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._users = 0
+        self._thread: Optional[Thread] = None
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._wakeup_read: Optional[int] = None
+        self._wakeup_write: Optional[int] = None
+
+        self._pending: Deque[Callable[[], None]] = deque()
+        """Callbacks waiting to be run in the reactor thread"""
+        self._timers: List[TimerHandle] = []
+        """A heap of callbacks waiting for their deadline"""
+
+        self._handlers: Dict[int, _Handlers] = {}
+        """Only accessed from within the reactor thread"""
+
+        self.call_wrapper: Optional[Callable[[Callable[[], None]], None]] = None
+        """If set, every callback is passed to this to be called, instead of being
+        called directly. It's used to profile each callback."""
+
+    def acquire(self):
+        """Start using the reactor, starting the thread if it isn't running"""
+        with self._lock:
+            self._users += 1
+            self._ensure_running()
+
+    def release(self):
+        """Stop using the reactor. Once every user has released it, the reactor thread
+        exits. If the caller isn't the reactor thread, this waits for it to exit."""
+        with self._lock:
+            self._users -= 1
+            thread = self._thread
+            stopping = self._users == 0
+            self._wakeup()
+
+        if stopping and thread is not None and thread is not current_thread():
+            thread.join()
+
+    def in_reactor_thread(self) -> bool:
+        return self._thread is not None and self._thread is current_thread()
+
+    def call_soon(self, callback: Callable[[], None]):
+        """Run the callback in the reactor thread as soon as possible"""
+        with self._lock:
+            self._pending.append(callback)
+            self._ensure_running()
+            self._wakeup()
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> TimerHandle:
+        """Run the callback in the reactor thread once `delay` seconds have passed.
+        Timers that are still waiting when the last user releases the reactor are
+        dropped."""
+        timer = TimerHandle(monotonic() + delay, callback)
+        with self._lock:
+            heapq.heappush(self._timers, timer)
+            self._ensure_running()
+            self._wakeup()
+        return timer
+
+    def run(self, callback: Callable[[], None]):
+        """Run the callback in the reactor thread, and wait for it to finish"""
+        if self.in_reactor_thread():
+            callback()
+            return
+
+        finished = Event()
+
+        def run_and_notify():
+            try:
+                callback()
+            finally:
+                finished.set()
+
+        self.call_soon(run_and_notify)
+        finished.wait()
+
+    def add_reader(self, fd: int, callback: Callable[[], None]):
+        """Call `callback` in the reactor thread whenever `fd` is readable"""
+        self.run(lambda: self._set_handler(fd, on_readable=callback))
+
+    def remove_reader(self, fd: int):
+        self.run(lambda: self._set_handler(fd, on_readable=None))
+
+    def add_writer(self, fd: int, callback: Callable[[], None]):
+        """Call `callback` in the reactor thread whenever `fd` is writable"""
+        self.call_soon(lambda: self._set_handler(fd, on_writable=callback))
+
+    def remove_writer(self, fd: int):
+        self.run(lambda: self._set_handler(fd, on_writable=None))
+
+    _UNCHANGED = object()
+
+    def _set_handler(self, fd: int, on_readable=_UNCHANGED, on_writable=_UNCHANGED):
+        handlers = self._handlers.get(fd, _Handlers())
+        old_events = handlers.events
+        if on_readable is not self._UNCHANGED:
+            handlers.on_readable = on_readable
+        if on_writable is not self._UNCHANGED:
+            handlers.on_writable = on_writable
+        new_events = handlers.events
+
+        if old_events == new_events:
+            return
+        elif old_events == 0:
+            self._handlers[fd] = handlers
+            self._selector.register(fd, new_events)
+        elif new_events == 0:
+            del self._handlers[fd]
+            self._selector.unregister(fd)
+        else:
+            self._selector.modify(fd, new_events)
+
+    def _ensure_running(self):
+        """Start the reactor thread if it isn't running. Must hold self._lock."""
+        if self._thread is not None:
+            return
+
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        self._selector.register(self._wakeup_read, selectors.EVENT_READ)
+
+        self._thread = Thread(
+            name="Reactor Thread", target=self._background, daemon=True
+        )
+        self._thread.start()
+
+    def _wakeup(self):
+        """Interrupt the reactor thread's select call. Must hold self._lock."""
+        if self._wakeup_write is None:
+            return
+        try:
+            os.write(self._wakeup_write, b"\0")
+        except BlockingIOError:
+            # The pipe is full, so the reactor already has a wakeup waiting
+            pass
+
+    def _background(self):
+        selector = self._selector
+        wakeup_read, wakeup_write = self._wakeup_read, self._wakeup_write
+
+        while self._run_once(selector, wakeup_read):
+            pass
+
+        selector.close()
+        os.close(wakeup_read)
+        os.close(wakeup_write)
+
+    def _run_once(self, selector: selectors.BaseSelector, wakeup_read: int) -> bool:
+        """Wait for any file descriptors to be ready and call their handlers, then run
+        any timers that are due and any pending callbacks.
+        :return: False if the reactor has no more users and the thread should exit
+        """
+        with self._lock:
+            timeout = None
+            if self._timers:
+                timeout = max(self._timers[0].deadline - monotonic(), 0)
+
+        for key, events in selector.select(timeout):
+            if key.fd == wakeup_read:
+                self._drain_wakeups(wakeup_read)
+                continue
+
+            handlers = self._handlers.get(key.fd)
+            if handlers is None:
+                # The fd was unregistered by an earlier callback in this batch
+                continue
+            if events & selectors.EVENT_READ and handlers.on_readable:
+                self._call(handlers.on_readable)
+            if events & selectors.EVENT_WRITE and handlers.on_writable:
+                self._call(handlers.on_writable)
+
+        now = monotonic()
+        while True:
+            with self._lock:
+                if not self._timers or self._timers[0].deadline > now:
+                    break
+                timer = heapq.heappop(self._timers)
+            if not timer.cancelled:
+                self._call(timer.callback)
+
+        while True:
+            with self._lock:
+                if self._pending:
+                    callback = self._pending.popleft()
+                elif self._users == 0:
+                    self._stop()
+                    return False
+                else:
+                    return True
+            self._call(callback)
+
+    def _stop(self):
+        """Forget about the running thread, so the next user starts a new one. Must
+        hold self._lock."""
+        self._thread = None
+        self._selector = None
+        self._wakeup_read = self._wakeup_write = None
+        self._handlers = {}
+        self._timers = []
+
+    @staticmethod
+    def _drain_wakeups(fd: int):
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _call(self, callback: Callable[[], None]):
+        call_wrapper = self.call_wrapper
+        try:
+            if call_wrapper is None:
+                callback()
+            else:
+                call_wrapper(callback)
+        except Exception:
+            _logger.exception(f"Exception in reactor callback {callback}")
+
+
+reactor = Reactor()
+"""The reactor shared by every ProcessNode"""
@@ -0,0 +1,72 @@
+import os
+
+
+class ReadBuffer:
+    """A preallocated bytearray that a process's output is read into, so that reading
+    doesn't allocate a new bytes object for every read.
+
+    Each read is placed after whatever the buffer already holds, which lets small reads
+    be merged in place instead of being joined together later. The contents are only
+    copied when they're taken out of the buffer, which is the one copy of the output
+    that the history keeps.
+
+    This class isn't thread safe, so it must only be used from the thread that the
+    node publishes from.
+    """
+
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._size = 0
+
+    def __len__(self):
+        """The number of bytes held in the buffer"""
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def space(self) -> int:
+        """The number of bytes that can be added before the buffer is full"""
+        return len(self._buffer) - self._size
+
+    def read_from(self, fd: int, max_bytes: int) -> int:
+        """Read at most max_bytes from the fd into the end of the buffer, growing it if
+        there isn't space. Like os.read, this raises BlockingIOError if a non-blocking
+        fd has nothing to read.
+        :return: The number of bytes read, which is 0 at the end of the output
+        """
+        self.reserve(max_bytes)
+        stop = self._size + max_bytes
+        with memoryview(self._buffer) as view:
+            read = os.readv(fd, [view[self._size : stop]])
+        self._size += read
+        return read
+
+    def reserve(self, space: int):
+        """Grow the buffer, if needed, so that there's space for at least this many more
+        bytes"""
+        if space > self.space:
+            self._buffer.extend(bytes(space - self.space))
+
+    def append(self, data: bytes):
+        """Copy the data into the end of the buffer, growing it if there's no space"""
+        self.reserve(len(data))
+        self._buffer[self._size : self._size + len(data)] = data
+        self._size += len(data)
+
+    def view(self) -> memoryview:
+        """A view of the contents of the buffer. It's only valid until the buffer is
+        next changed, and must be released before the buffer can grow."""
+        return memoryview(self._buffer)[: self._size]
+
+    def take(self) -> bytes:
+        """Copy the contents out of the buffer, and empty it"""
+        with memoryview(self._buffer) as view:
+            data = bytes(view[: self._size])
+        self._size = 0
+        return data
+
+    def clear(self):
+        self._size = 0
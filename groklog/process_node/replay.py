@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+from enum import Enum
+
+from .history import History
+
+
+class ReplayMode(Enum):
+    """Where in a node's history a new subscriber starts receiving output from"""
+
+    FULL = "full"
+    """Replay everything that is still retained"""
+
+    FROM_BYTE = "from_byte"
+    """Replay from an absolute byte offset"""
+
+    FROM_LINE = "from_line"
+    """Replay from the start of an absolute line number"""
+
+    LAST_BYTES = "last_bytes"
+    """Replay the last N bytes"""
+
+    LAST_LINES = "last_lines"
+    """Replay the last N complete lines, and the incomplete line after them"""
+
+    LIVE = "live"
+    """Don't replay anything, and only receive new output"""
+
+
+@dataclass(frozen=True)
+class Replay:
+    """How much history to hand to a subscriber before it starts receiving new output.
+    Use the constructors, for example Replay.last_lines(100), rather than building one
+    directly."""
+
+    mode: ReplayMode = ReplayMode.FULL
+    count: int = 0
+    """The offset, line number, or number of bytes or lines, depending on the mode"""
+
+    @classmethod
+    def full(cls) -> "Replay":
+        return cls(ReplayMode.FULL)
+
+    @classmethod
+    def from_byte(cls, offset: int) -> "Replay":
+        return cls(ReplayMode.FROM_BYTE, offset)
+
+    @classmethod
+    def from_line(cls, line_number: int) -> "Replay":
+        return cls(ReplayMode.FROM_LINE, line_number)
+
+    @classmethod
+    def last_bytes(cls, count: int) -> "Replay":
+        return cls(ReplayMode.LAST_BYTES, count)
+
+    @classmethod
+    def last_lines(cls, count: int) -> "Replay":
+        return cls(ReplayMode.LAST_LINES, count)
+
+    @classmethod
+    def live(cls) -> "Replay":
+        return cls(ReplayMode.LIVE)
+
+    def start_offset(self, history: History) -> int:
+        """Return the absolute offset in the history that the replay starts at. It's
+        always within the retained history."""
+        if self.mode is ReplayMode.FULL:
+            offset = history.start
+        elif self.mode is ReplayMode.FROM_BYTE:
+            offset = self.count
+        elif self.mode is ReplayMode.FROM_LINE:
+            offset = history.line_start(self.count)
+        elif self.mode is ReplayMode.LAST_BYTES:
+            offset = history.end - self.count
+        elif self.mode is ReplayMode.LAST_LINES:
+            offset = history.line_start(history.line_count - self.count)
+        elif self.mode is ReplayMode.LIVE:
+            offset = history.end
+        else:
+            raise ValueError(f"Invalid replay mode {self.mode}")
+        return min(max(offset, history.start), history.end)
@@ -1,12 +1,13 @@
 import fcntl
 import os
 import pty
-import select
 import signal
 import subprocess
-from threading import Thread
+from typing import Optional
 
 from .base import ProcessNode
+from .coalesce import CoalescePolicy
+from .history import HistoryBackend, RetentionPolicy
 
 
 class ShellProcessIO(ProcessNode):
@@ -16,8 +17,21 @@ class ShellProcessIO(ProcessNode):
     GenericProcessIO process node. It also exposes a `send_sigint` function.
     """
 
-    def __init__(self, name="Shell", command="bash -i"):
-        super().__init__(name=name, command=command)
+    def __init__(
+        self,
+        name="Shell",
+        command="bash -i",
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
 
         # Open a pseudo TTY to control the interactive session.
         # Make it non-blocking.
@@ -33,32 +47,8 @@ class ShellProcessIO(ProcessNode):
             stderr=self._slave,
         )
 
-        # Start the shell and thread to pull data from it.
-        self._running = True
-        self._extraction_thread = Thread(
-            name=f"{self.name} Extractor Thread", target=self._background, daemon=True
-        )
-        self._extraction_thread.start()
-
-    def _background(self):
-        """
-        Background thread running the IO between the widget and the TTY session.
-        """
-        while self._running:
-            # Wait for any of the file descriptors to have data, with a 1 second timeout
-            ready, _, _ = select.select([self._master], [], [], 0.1)
-            self._onboard_new_subscribers()
-
-            for stream in ready:
-                data_bytes = b""
-                while self._running:
-                    try:
-                        new_bytes = os.read(stream, self._READ_MAX_BYTES)
-                    except BlockingIOError:
-                        break
-                    data_bytes += new_bytes
-
-                self._record_and_publish(data_bytes)
+        # Have the reactor pull data from the shell as soon as it's available
+        self._start_reading(self._master)
 
     def write(self, val: bytes):
         """Write a character to the tty"""
@@ -0,0 +1,119 @@
+import os
+import stat
+import subprocess
+from typing import Optional
+
+from .base import ProcessNode
+from .coalesce import CoalescePolicy
+from .history import HistoryBackend, RetentionPolicy
+from .reactor import reactor
+
+
+class StreamInputIO(ProcessNode):
+    """A root ProcessNode that publishes whatever is read from a file descriptor that's
+    already open, such as groklog's own stdin, instead of running an interactive shell.
+    It's used to feed a process tree from a pipe or a command in headless runs.
+
+    Nothing is read until start() is called, so that the tree and its subscribers can
+    be set up without any output being evicted from the history first. Nothing can be
+    written to it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fd: int,
+        command: str = "-",
+        process: Optional[subprocess.Popen] = None,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        coalesce: Optional[CoalescePolicy] = None,
+    ):
+        """
+        :param fd: The file descriptor to read from. It's made non-blocking.
+        :param command: A description of where the input comes from
+        :param process: The process writing to the fd, if there is one. It's killed
+            when the node is closed.
+        """
+        super().__init__(
+            name=name,
+            command=command,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+        self._fd = fd
+        self._process = process
+        self._was_blocking = os.get_blocking(fd)
+        os.set_blocking(fd, False)
+        self._is_file = stat.S_ISREG(os.fstat(fd).st_mode)
+        """Regular files can't be waited on by the reactor, because they're always
+        readable, so they're read until the end instead"""
+        self._file_read_scheduled = False
+
+    @classmethod
+    def from_command(
+        cls,
+        name: str,
+        command: str,
+        retention: Optional[RetentionPolicy] = None,
+        history_backend: HistoryBackend = HistoryBackend.MEMORY,
+        coalesce: Optional[CoalescePolicy] = None,
+    ) -> "StreamInputIO":
+        """Read the combined stdout and stderr of a command, which gets no input"""
+        process = subprocess.Popen(
+            command,
+            preexec_fn=os.setsid,
+            shell=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        return cls(
+            name=name,
+            fd=process.stdout.fileno(),
+            command=command,
+            process=process,
+            retention=retention,
+            history_backend=history_backend,
+            coalesce=coalesce,
+        )
+
+    def start(self):
+        """Start reading and publishing the input"""
+        if not self._is_file:
+            self._start_reading(self._fd)
+            return
+
+        self._read_fd = self._fd
+        self._reading = True
+        reactor.acquire()
+        self._watch_output(True)
+
+    def _watch_output(self, enabled: bool):
+        if not self._is_file:
+            super()._watch_output(enabled)
+        elif enabled and not self._file_read_scheduled:
+            self._file_read_scheduled = True
+            reactor.call_soon(self._read_file)
+
+    def _read_file(self):
+        """Read a chunk of a regular file, and carry on in another reactor callback,
+        so that the rest of the tree isn't held up while the file is read"""
+        self._file_read_scheduled = False
+        if not self._reading or self._read_pauses > 0:
+            return
+        self._on_readable()
+        self._watch_output(self._reading)
+
+    def write(self, val: bytes):
+        raise TypeError(f"{self} reads its input from a file descriptor")
+
+    def _stop_process(self, timeout):
+        if self._process is None:
+            # The fd is shared with whatever opened it, such as the user's shell
+            os.set_blocking(self._fd, self._was_blocking)
+            return
+        self._process.kill()
+        self._process.wait(timeout)
+        self._process.stdout.close()
@@ -0,0 +1,273 @@
+"""End-to-end latency tracing, for finding out where the time goes between a process
+writing some output, and it being drawn on screen, in deep trees.
+
+Every chunk of output that a node publishes is tagged with a sequence number, and the
+time that the first chunk it came from was read. The tag is carried along each hop:
+
+- Children that are fed inside the publish, such as native filters, tag their own
+  output with the chunk they were fed.
+- Children that are processes are handed the tag along with their input, and the
+  output they publish is tagged with the last input they were handed.
+- Widgets keep the tag with the lines they queue for the UI, and record when the lines
+  left the queue, and when the frame that shows them was drawn.
+
+Tracing is off unless tracer.start() is called, and costs a single attribute lookup
+per hop while it's off. The trace can be exported as Chrome trace event JSON, to be
+opened in chrome://tracing or https://ui.perfetto.dev.
+"""
+
+import json
+import threading
+from collections import deque
+from itertools import count
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import TYPE_CHECKING, Deque, Dict, List, NamedTuple, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+if TYPE_CHECKING:
+    from .base import ProcessNode
+
+TRACE_ENV_VAR = "GROKLOG_TRACE"
+"""The environment variable that enables tracing, set to the file to export to"""
+
+
+class TraceTag(NamedTuple):
+    sequence: int
+    """Unique to each published chunk"""
+
+    origin: int
+    """The sequence of the chunk that was first read from a process, that this one
+    came from"""
+
+    read_time: float
+    """When the origin chunk was read, in perf_counter seconds"""
+
+    parent: Optional[int]
+    """The sequence of the chunk that this one came from directly"""
+
+
+class TraceEvent(NamedTuple):
+    kind: str
+    """What the hop was, such as 'publish', 'write', 'queue' or 'render'"""
+
+    name: str
+    """The node, or the widget showing the node, that the hop happened in"""
+
+    thread: str
+    start: float
+    end: float
+    tags: Tuple[TraceTag, ...]
+    """The chunks that went through the hop. A frame can draw several at once."""
+
+
+class LatencySummary(NamedTuple):
+    count: int
+    median_ms: float
+    p99_ms: float
+    max_ms: float
+
+
+class Tracer:
+    def __init__(self, max_events: int = 200_000):
+        """
+        :param max_events: How many of the latest events to keep
+        """
+        self.enabled = False
+        self._events: Deque[TraceEvent] = deque(maxlen=max_events)
+        self._sequences = count()
+        self._local = threading.local()
+        self._last_input: "WeakKeyDictionary[ProcessNode, TraceTag]" = (
+            WeakKeyDictionary()
+        )
+        """The last chunk handed to each node that's a process, which is assumed to
+        be what its output came from"""
+        self._started = 0.0
+
+    def start(self):
+        """Start tracing, forgetting any earlier trace"""
+        self._events.clear()
+        self._last_input.clear()
+        self._started = perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    @property
+    def events(self) -> List[TraceEvent]:
+        return list(self._events)
+
+    def begin_chunk(self, node: "ProcessNode") -> TraceTag:
+        """Tag a chunk that the node is about to publish, and make it the current
+        chunk in this thread until end_chunk is called"""
+        parent = self.current()
+        if parent is None:
+            parent = self._last_input.get(node)
+
+        now = perf_counter()
+        sequence = next(self._sequences)
+        if parent is None:
+            tag = TraceTag(sequence, sequence, now, None)
+        else:
+            tag = TraceTag(sequence, parent.origin, parent.read_time, parent.sequence)
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append((tag, now))
+        return tag
+
+    def end_chunk(self, node: "ProcessNode"):
+        """Finish publishing the current chunk"""
+        tag, started = self._local.stack.pop()
+        self.record("publish", node.name, started, perf_counter(), tag)
+
+    def hand_over(self, node: "ProcessNode"):
+        """Record that the current chunk is being written to a node that's a
+        process"""
+        tag = self.current()
+        if tag is None:
+            return
+        self._last_input[node] = tag
+        now = perf_counter()
+        self.record("write", node.name, now, now, tag)
+
+    def current(self) -> Optional[TraceTag]:
+        """The chunk being published in this thread, if any"""
+        stack = getattr(self._local, "stack", None)
+        return stack[-1][0] if stack else None
+
+    def record(self, kind: str, name: str, start: float, end: float, *tags: TraceTag):
+        """Record a hop that some chunks went through"""
+        self._events.append(
+            TraceEvent(kind, name, threading.current_thread().name, start, end, tags)
+        )
+
+    def summary(self) -> Dict[Tuple[str, str], LatencySummary]:
+        """How long after being read each chunk made it through each hop, by the
+        kind and name of the hop"""
+        latencies: Dict[Tuple[str, str], List[float]] = {}
+        for event in self.events:
+            for tag in event.tags:
+                latencies.setdefault((event.kind, event.name), []).append(
+                    (event.end - tag.read_time) * 1000
+                )
+        return {
+            key: LatencySummary(
+                count=len(values),
+                median_ms=median(values),
+                p99_ms=sorted(values)[int(len(values) * 0.99)],
+                max_ms=max(values),
+            )
+            for key, values in latencies.items()
+        }
+
+    def format_summary(self) -> str:
+        """Describe the summary as a table, slowest hops last"""
+        rows = sorted(self.summary().items(), key=lambda item: item[1].median_ms)
+        lines = [f"{'Hop':<40} {'Chunks':>8} {'Median':>10} {'p99':>10} {'Max':>10}"]
+        for (kind, name), summary in rows:
+            lines.append(
+                f"{kind + ' ' + name:<40} {summary.count:>8} "
+                f"{summary.median_ms:>8.1f}ms {summary.p99_ms:>8.1f}ms "
+                f"{summary.max_ms:>8.1f}ms"
+            )
+        return "\n".join(lines)
+
+    def export(self, path: Path) -> int:
+        """Write the trace to a file as Chrome trace event JSON. Each chunk is linked
+        to the hops it went through with flow arrows, starting from where its origin
+        was read.
+        :return: The number of events that were written
+        """
+        events = sorted(self.events, key=lambda event: event.start)
+        thread_ids: Dict[str, int] = {}
+        trace_events = []
+        flow_counts: Dict[int, int] = {}
+        """How many of the remaining events each origin's chunks go through"""
+        flows_started = set()
+        for event in events:
+            if event.kind == "queue":
+                continue
+            for tag in event.tags:
+                flow_counts[tag.origin] = flow_counts.get(tag.origin, 0) + 1
+
+        for event in events:
+            tid = thread_ids.setdefault(event.thread, len(thread_ids) + 1)
+            start = self._microseconds(event.start)
+            duration = self._microseconds(event.end) - start
+            args = {
+                "sequences": [tag.sequence for tag in event.tags],
+                "since_read_ms": round(
+                    max((event.end - tag.read_time) * 1000 for tag in event.tags), 3
+                ),
+            }
+            if len(event.tags) == 1 and event.tags[0].parent is not None:
+                args["parent"] = event.tags[0].parent
+
+            if event.kind == "queue":
+                # Waits in a queue overlap each other, so they're async events, which
+                # are stacked instead of nested
+                for tag in event.tags:
+                    common = {"name": f"queue {event.name}", "cat": "queue"}
+                    common.update(id=tag.sequence, pid=1, tid=tid)
+                    trace_events.append({**common, "ph": "b", "ts": start})
+                    trace_events.append({**common, "ph": "e", "ts": start + duration})
+                continue
+
+            trace_events.append(
+                {
+                    "name": f"{event.kind} {event.name}",
+                    "cat": event.kind,
+                    "ph": "X",
+                    "ts": start,
+                    "dur": duration,
+                    "pid": 1,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+            for tag in event.tags:
+                if tag.origin not in flows_started:
+                    flows_started.add(tag.origin)
+                    phase = "s"
+                elif flow_counts[tag.origin] == 1:
+                    phase = "f"
+                else:
+                    phase = "t"
+                flow_counts[tag.origin] -= 1
+                trace_events.append(
+                    {
+                        "name": "chunk",
+                        "cat": "flow",
+                        "ph": phase,
+                        "bp": "e",
+                        "id": tag.origin,
+                        "ts": start,
+                        "pid": 1,
+                        "tid": tid,
+                    }
+                )
+
+        for thread, tid in thread_ids.items():
+            trace_events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": thread},
+                }
+            )
+
+        with path.open("w") as file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+        return len(events)
+
+    def _microseconds(self, seconds: float) -> float:
+        return round((seconds - self._started) * 1_000_000, 3)
+
+
+tracer = Tracer()
@@ -0,0 +1,253 @@
+"""Opt-in profiling of the reactor thread and the UI loop, for finding out why groklog
+stutters under load. It's enabled with --cpu-profile-directory, or the
+GROKLOG_CPU_PROFILE environment variable.
+
+Every reactor callback is run under a cProfile profiler for the node that it belongs
+to, and the UI loop under one of its own, and each is dumped to a pstats file when
+groklog exits. A node's callbacks include feeding its native filters and any
+subscribers, such as a FilterViewer queueing lines, because those run inside them.
+
+Alongside that, a sampler thread looks at the stacks of the reactor and UI threads
+every few milliseconds, and sorts each sample into a category such as publishing,
+decoding, colour parsing or reflowing text. The stats scene shows the result live.
+"""
+
+import cProfile
+import re
+import sys
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from types import FrameType
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from groklog.process_node import ProcessNode
+from groklog.process_node.reactor import reactor
+
+PROFILE_ENV_VAR = "GROKLOG_CPU_PROFILE"
+"""The environment variable that enables profiling, set to the directory to write the
+profiles to"""
+
+_REACTOR_PROFILE = "reactor"
+"""The profile for reactor callbacks that don't belong to any node"""
+
+_UI_PROFILE = "ui"
+
+SAMPLED_THREADS = ("UI", "Reactor")
+"""The names of the threads that StackSampler samples"""
+
+_CATEGORIES: List[Tuple[str, str, Optional[Set[str]]]] = [
+    ("idle", "selectors.py", None),
+    ("idle", "threading.py", {"wait"}),
+    ("idle", "asciimatics/screen.py", {"wait_for_input", "play"}),
+    ("colour parsing", "asciimatics/parsers.py", None),
+    ("colour parsing", "asciimatics/strings.py", None),
+    ("colour parsing", "groklog/ui/colour_cache.py", None),
+    ("reflow", "asciimatics/widgets/utilities.py", None),
+    ("colour parsing", "groklog/ui/streaming_text_box.py", {"_colour_before"}),
+    ("reflow", "groklog/ui/streaming_text_box.py", {"_wrap"}),
+    ("terminal", "groklog/ui/terminal.py", None),
+    ("render", "asciimatics/", None),
+    ("filtering", "groklog/process_node/native.py", None),
+    ("history", "groklog/process_node/history/", None),
+    ("decode", "groklog/process_node/lines.py", None),
+    ("decode", "codecs.py", None),
+    ("publish", "pubsus/", None),
+    ("publish", "groklog/process_node/base.py", {"_record_and_publish"}),
+    ("reading", "groklog/process_node/coalesce.py", None),
+    ("reading", "groklog/process_node/read_buffer.py", None),
+    ("writing", "groklog/process_node/backpressure.py", None),
+]
+"""How to sort a sample into a category: by the file of the innermost frame that one
+of these matches, and optionally its function name. Work done in C, such as decoding
+bytes, counts towards the Python function that called it."""
+
+
+class StackSampler:
+    """Samples the stacks of the reactor and UI threads in a background thread, and
+    keeps the categories of the most recent samples of each"""
+
+    def __init__(self, interval: float = 0.01, max_samples: int = 1000):
+        """
+        :param interval: The seconds between samples
+        :param max_samples: How many of the latest samples of each thread to keep
+        """
+        self._interval = interval
+        self._max_samples = max_samples
+        self._samples: Dict[str, Deque[str]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            name="Stack Sampler", target=self._background, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        """Return the share of the recent samples of each thread in each category"""
+        result = {}
+        for thread_name, samples in list(self._samples.items()):
+            counts = Counter(list(samples))
+            total = sum(counts.values())
+            result[thread_name] = {
+                category: count / total for category, count in counts.most_common()
+            }
+        return result
+
+    def _background(self):
+        main_thread = threading.main_thread()
+        ui_name, reactor_name = SAMPLED_THREADS
+        while not self._stop.wait(self._interval):
+            threads = {ui_name: main_thread.ident}
+            reactor_thread = reactor._thread
+            if reactor_thread is not None:
+                threads[reactor_name] = reactor_thread.ident
+
+            frames = sys._current_frames()
+            for thread_name, ident in threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                if thread_name not in self._samples:
+                    self._samples[thread_name] = deque(maxlen=self._max_samples)
+                self._samples[thread_name].append(_categorize(frame))
+            # Don't keep the other threads' frames alive until the next sample
+            del frames
+
+
+class Profiler:
+    """Profiles reactor callbacks per node, and the UI loop, and samples where the
+    time goes. Start it before the tree starts running, and stop it on exit to write
+    the profiles."""
+
+    def __init__(self, output_directory: Path):
+        """
+        :param output_directory: Where to write a pstats file for each node, the
+            reactor and the UI, and a summary of the samples
+        """
+        self.output_directory = output_directory
+        self.sampler = StackSampler()
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        """Profiles by name. Those of nodes are only used in the reactor thread."""
+
+    def start(self):
+        reactor.call_wrapper = self._profile_call
+        self.sampler.start()
+
+    def stop(self) -> List[Path]:
+        """Stop profiling, and write out the profiles
+        :return: The files that were written
+        """
+        # Wait for any callback that's being profiled to finish
+        reactor.run(partial(setattr, reactor, "call_wrapper", None))
+        self.sampler.stop()
+
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for name, profile in self._profiles.items():
+            path = self.output_directory / f"{_file_name(name)}.pstats"
+            profile.dump_stats(path)
+            paths.append(path)
+
+        summary_path = self.output_directory / "samples.txt"
+        with summary_path.open("w") as file:
+            for thread_name, shares in self.sampler.breakdown().items():
+                file.write(f"{thread_name} thread\n")
+                for category, share in shares.items():
+                    file.write(f"  {category:<16} {share:>6.1%}\n")
+        paths.append(summary_path)
+        return paths
+
+    @contextmanager
+    def profile_thread(self, name: str = _UI_PROFILE):
+        """Profile the current thread for the duration of the context. Profiling the
+        same name again adds to the same profile."""
+        if sys.version_info >= (3, 12):
+            # cProfile is process wide from 3.12, and can't be enabled in two threads
+            # at once, so the UI is left to the sampler
+            yield
+            return
+
+        profile = self._profiles.setdefault(name, cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def _profile_call(self, callback: Callable[[], None]):
+        node = _callback_owner(callback)
+        name = _REACTOR_PROFILE if node is None else f"node-{node.name}"
+        profile = self._profiles.get(name)
+        if profile is None:
+            profile = self._profiles[name] = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active, which only happens from Python 3.12
+            callback()
+            return
+        try:
+            callback()
+        finally:
+            profile.disable()
+
+
+def _callback_owner(callback: Callable, depth: int = 0) -> Optional[ProcessNode]:
+    """Find the node that a reactor callback belongs to. Callbacks are usually a
+    node's bound methods, but can also be partials or lambdas that capture a node, or
+    methods of a helper that holds on to its node, such as a Coalescer or MatchStage.
+    """
+    if depth > 3:
+        return None
+    if isinstance(callback, partial):
+        return _callback_owner(callback.func, depth + 1)
+
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, ProcessNode):
+        return owner
+    if owner is not None:
+        for value in vars(owner).values() if hasattr(owner, "__dict__") else ():
+            if isinstance(value, ProcessNode):
+                return value
+            if isinstance(getattr(value, "__self__", None), ProcessNode):
+                return value.__self__
+
+    for cell in getattr(callback, "__closure__", None) or ():
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            # The cell hasn't been filled in yet
+            continue
+        if isinstance(value, ProcessNode):
+            return value
+        if callable(value):
+            node = _callback_owner(value, depth + 1)
+            if node is not None:
+                return node
+    return None
+
+
+def _categorize(frame: Optional[FrameType]) -> str:
+    """Sort a stack into a category by its innermost frame that has one"""
+    while frame is not None:
+        code = frame.f_code
+        path = code.co_filename.replace("\\", "/")
+        for category, path_fragment, names in _CATEGORIES:
+            if path_fragment in path and (names is None or code.co_name in names):
+                return category
+        frame = frame.f_back
+    return "other"
+
+
+def _file_name(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", name).strip("._") or "node"
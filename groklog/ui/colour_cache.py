@@ -0,0 +1,145 @@
+import re
+import sys
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional, Tuple
+
+from asciimatics.parsers import Parser
+from asciimatics.strings import ColouredText
+
+_UNIQUE_TOKEN = re.compile(r"\d\d:\d\d:\d\d|\d{5,}|\b[0-9a-fA-F]{8,}\b")
+"""Something that makes a line unlikely to ever be repeated: a time of day, a long
+number such as an epoch timestamp or a request ID, or a long hex ID such as a UUID
+or a hash. Escape codes never have digit runs this long."""
+
+_ENTRY_OVERHEAD = 400
+"""Roughly how many bytes a cached ColouredText takes, on top of its text"""
+
+
+@dataclass(frozen=True)
+class ColourCachePolicy:
+    """Limits on how many coloured lines the UI keeps around to reuse"""
+
+    max_lines: int = 10_000
+    """The most lines to keep. If 0, nothing is cached."""
+
+    max_bytes: int = 16 * 1024 * 1024
+    """The most bytes, roughly, that the cached lines can take up"""
+
+    skip_unique: bool = True
+    """Whether to skip caching lines that look unique, such as lines with timestamps
+    or IDs in them, which would only push lines that do repeat out of the cache"""
+
+
+@dataclass(frozen=True)
+class ColourCacheStats:
+    hits: int
+    misses: int
+    skipped: int
+    """Misses that weren't cached, because the line looked unique"""
+
+    evictions: int
+    lines: int
+    bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ColourCache:
+    """An LRU of lines that have been colour parsed, capped by both the number of
+    lines and the bytes they take up, so that a log where every line is different
+    can't grow it without bound.
+
+    Parsed lines are keyed by their content and the colour they start in, which is
+    all that the result depends on, so a line that several filters pass on is only
+    parsed once, however many of their views show it.
+
+    This class isn't thread safe, so it must only be used from the UI thread.
+    """
+
+    def __init__(self, policy: ColourCachePolicy = ColourCachePolicy()):
+        self._policy = policy
+        self._entries: "OrderedDict[Hashable, ColouredText]" = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+
+        self._hits = 0
+        self._misses = 0
+        self._skipped = 0
+        self._evictions = 0
+
+    @property
+    def policy(self) -> ColourCachePolicy:
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy: ColourCachePolicy):
+        """Change the limits, evicting lines straight away if they're now over"""
+        self._policy = policy
+        self._evict()
+
+    def parse(self, line: str, colour: Tuple, parser: Parser) -> ColouredText:
+        """Return the coloured text for a line, starting from the colour that the line
+        before it ended in, parsing it only if it isn't cached
+
+        :raises IndexError: If the parser chokes on an escape code in the line
+        """
+        key = (line, colour)
+        text = self.get(key)
+        if text is None:
+            text = ColouredText(line, parser, colour=colour)
+            self.put(key, line, text)
+        return text
+
+    def get(self, key: Hashable) -> Optional[ColouredText]:
+        """Look up a line, counting a hit or a miss"""
+        text = self._entries.get(key)
+        if text is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return text
+
+    def put(self, key: Hashable, line: str, text: ColouredText):
+        """Cache the coloured text for a line, unless it looks unique
+        :param line: The raw line that the text was parsed from
+        """
+        if self._policy.skip_unique and _UNIQUE_TOKEN.search(line):
+            self._skipped += 1
+            return
+        if key in self._entries:
+            return
+
+        size = sys.getsizeof(line) + len(line) * 16 + _ENTRY_OVERHEAD
+        self._entries[key] = text
+        self._sizes[key] = size
+        self._bytes += size
+        self._evict()
+
+    def stats(self) -> ColourCacheStats:
+        return ColourCacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            skipped=self._skipped,
+            evictions=self._evictions,
+            lines=len(self._entries),
+            bytes=self._bytes,
+        )
+
+    def _evict(self):
+        """Evict the least recently used lines until the cache is within its limits"""
+        while self._entries and (
+            len(self._entries) > self._policy.max_lines
+            or self._bytes > self._policy.max_bytes
+        ):
+            key, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(key)
+            self._evictions += 1
+
+
+colour_cache = ColourCache()
+"""The lines that have been colour parsed by any view. Its limits are set by run_ui."""
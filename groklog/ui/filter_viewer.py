@@ -1,42 +1,15 @@
-import copy
 from queue import Queue
-from typing import Generator, List, Tuple
+from time import perf_counter
+from typing import List, Optional, Tuple
 
 from asciimatics.parsers import AnsiTerminalParser
 from asciimatics.strings import ColouredText
 
-from groklog.process_node import GenericProcessIO, ProcessNode
+from groklog.process_node import GenericProcessIO, LineBatch, ProcessNode, Replay
+from groklog.process_node.tracing import TraceTag, tracer
+from groklog.ui.colour_cache import colour_cache
 from groklog.ui.streaming_text_box import StreamingTextBox
-
-_line_cache = {}
-
-
-def _cached_coloured_text(
-    lines: List[str],
-    last_colour: Tuple,
-    from_filter: ProcessNode,
-    parser: AnsiTerminalParser,
-) -> Generator[ColouredText, None, None]:
-    """This generator yields coloured text for each of the lines. It caches results
-    along the way, so that any duplicate lines in the future are yieled immediately with
-    no duplicate processing."""
-
-    filter_key = from_filter.name + from_filter.command
-
-    for line in lines:
-        cache_key = (line, last_colour, filter_key)
-
-        # Yield cached results if they exist
-        if cache_key in _line_cache:
-            value = _line_cache[cache_key]
-        else:
-            try:
-                value = ColouredText(line, parser, colour=last_colour)
-            except IndexError:
-                continue
-            _line_cache[cache_key] = value
-        yield value
-        last_colour = tuple(value.last_colour)
+from groklog.ui.widget_stats import RenderTimer, WidgetStats
 
 
 class FilterViewer(StreamingTextBox):
@@ -44,55 +17,79 @@ class FilterViewer(StreamingTextBox):
         super().__init__(
             height,
             name=f"FilterViewer-{filter.name}-{filter.command})",
-            readonly=True,
-            as_string=False,
             parser=AnsiTerminalParser(),
         )
         self.filter = filter
         self.custom_colour = "filter_viewer"
 
+        self._end_line = filter.line_count()
+        """The number of lines that the filter had output, as of the last frame"""
+
         # Create subscriptions
-        self._processed_data_queue = Queue()
-        """self._add_stream pushes to here, and self.update pulls the results"""
+        self._processed_data_queue: Queue[Tuple[int, Optional[TraceTag], float]] = (
+            Queue()
+        )
+        """self._add_stream pushes the line number that each batch of new lines ends at
+        to here, and self.update pulls them. While tracing, the chunk that the lines
+        came from, and when they were queued, are pushed with it."""
+        self._render_timer = RenderTimer()
 
+        # The history is read from the filter as it's shown, so only lines that are
+        # new since the line count was taken are delivered
         filter.subscribe_with_history(
-            ProcessNode.Topic.STRING_DATA_STREAM, self._add_stream, blocking=False
+            ProcessNode.Topic.LINE_STREAM,
+            self._add_stream,
+            blocking=False,
+            replay=Replay.from_line(self._end_line),
         )
 
-    def update(self, frame_no):
+    def stats(self) -> WidgetStats:
+        return WidgetStats(
+            queue_backlog=self._processed_data_queue.qsize(),
+            render_seconds=self._render_timer.last,
+            mean_render_seconds=self._render_timer.mean,
+        )
 
-        new_lines = []
+    def update(self, frame_no):
+        started = perf_counter()
+        traces = self._take_new_lines(started)
+
+        result = super().update(frame_no)
+        finished = perf_counter()
+        self._render_timer.record(finished - started)
+        if traces:
+            tracer.record("render", self.filter.name, started, finished, *traces)
+        return result
+
+    def _take_new_lines(self, now: float) -> List[TraceTag]:
+        """Bring the lines that have been queued since the last frame into view
+        :return: The chunks that the lines came from, while tracing
+        """
+        traces = []
         while self._processed_data_queue.qsize():
-            new_lines += self._processed_data_queue.get_nowait()
-        self.add_lines(new_lines)
-
-        return super().update(frame_no)
-
-    def _add_stream(self, append_logs: str):
-        """Append text to the log stream. This function should receive input from
-        the filter and display it."""
-
-        processed_lines = []
-
-        # Remove the extra empty line that occurs if there's a \n at the end of the logs
-        split = append_logs.split("\n")
-        if split[-1] == "":
-            split.pop(-1)
-
-        for colored_line in _cached_coloured_text(
-            lines=split,
-            last_colour=tuple(self._value[-1].last_colour),
-            from_filter=self.filter,
-            parser=self._parser,
-        ):
-            processed_lines.append(colored_line)
-
-            # If the UI has nothing to show, then send what's been processed so far.
-            # Otherwise the UI hasn't gotten around to showing what's already in the
-            # queue, so just hold onto the processed lines for now.
-            if self._processed_data_queue.qsize() == 0:
-                self._processed_data_queue.put(processed_lines)
-                processed_lines = []
-
-        # Release any processed lines that haven't been released yet.
-        self._processed_data_queue.put(processed_lines)
+            end_line, trace, queued = self._processed_data_queue.get_nowait()
+            self._end_line = max(self._end_line, end_line)
+            if trace is not None:
+                tracer.record("queue", self.filter.name, queued, now, trace)
+                traces.append(trace)
+        return traces
+
+    def _line_count(self) -> int:
+        return self._end_line
+
+    def _read_lines(self, start: int, stop: int) -> LineBatch:
+        return self.filter.get_lines(start, stop)
+
+    def _parse_line(self, line: str, colour: Tuple) -> ColouredText:
+        try:
+            return colour_cache.parse(line, colour, self._parser)
+        except IndexError:
+            return super()._parse_line(line, colour)
+
+    def _add_stream(self, line_batch: LineBatch):
+        """Let the UI know about new lines from the filter. The lines themselves are
+        read from the filter's history once they're shown, in the UI thread, so this
+        is cheap."""
+        trace = tracer.current() if tracer.enabled else None
+        queued = perf_counter() if trace is not None else 0.0
+        self._processed_data_queue.put((line_batch.line_numbers.stop, trace, queued))
@@ -0,0 +1,68 @@
+import sys
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Optional
+
+from asciimatics.exceptions import ResizeScreenError
+from asciimatics.scene import Scene
+from asciimatics.screen import Screen
+
+from groklog.filter_manager import FilterManager
+from groklog.profiling import Profiler
+from groklog.ui.colour_cache import ColourCachePolicy, colour_cache
+from groklog.ui.scenes import FilterCreator, GrokLog, StatsView, scene_names
+
+
+def run_ui(
+    filter_manager: FilterManager,
+    profile_path: Path,
+    profiler: Optional[Profiler] = None,
+    colour_cache_policy: ColourCachePolicy = ColourCachePolicy(),
+):
+    """Run the interactive UI until the user quits
+    :param profiler: If given, the UI loop is profiled, and the stats scene shows
+        where the time goes
+    :param colour_cache_policy: Limits on how many colour parsed lines are kept
+    """
+    colour_cache.policy = colour_cache_policy
+
+    def groklog(screen: Screen, scene):
+        app = GrokLog(screen, filter_manager=filter_manager)
+        scenes = [
+            Scene([app], duration=-1, name=scene_names.SHELL_VIEW),
+            Scene(
+                [
+                    FilterCreator(
+                        screen,
+                        filter_manager=filter_manager,
+                        profile_path=profile_path,
+                    )
+                ],
+                duration=-1,
+                name=scene_names.FILTER_CREATOR_SCENE,
+            ),
+            Scene(
+                [
+                    StatsView(
+                        screen,
+                        filter_manager=filter_manager,
+                        widget_stats=app.widget_stats,
+                        sampler=None if profiler is None else profiler.sampler,
+                    )
+                ],
+                duration=-1,
+                name=scene_names.STATS_SCENE,
+            ),
+        ]
+
+        with nullcontext() if profiler is None else profiler.profile_thread():
+            screen.play(scenes, stop_on_resize=True, start_scene=scene, allow_int=True)
+
+    last_scene = None
+    while True:
+        try:
+            Screen.wrapper(func=groklog, catch_interrupt=True, arguments=[last_scene])
+            print("Thank you for using GrokLog!")
+            sys.exit(0)
+        except ResizeScreenError as e:
+            last_scene = e.scene
@@ -1,3 +1,4 @@
 from .app import GrokLog
 from .base_app import BaseApp
 from .filter_creator import FilterCreator
+from .stats_view import StatsView
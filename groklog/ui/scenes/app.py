@@ -1,4 +1,5 @@
 from functools import partial
+from typing import Dict
 
 from asciimatics import widgets
 from asciimatics.event import KeyboardEvent
@@ -6,9 +7,10 @@ from asciimatics.screen import Screen
 from asciimatics.widgets import Layout
 
 from groklog.filter_manager import FilterManager
-from groklog.process_node import ShellProcessIO
+from groklog.process_node import ProcessNode, ShellProcessIO
 from groklog.ui.filter_viewer import FilterViewer
 from groklog.ui.terminal import Terminal
+from groklog.ui.widget_stats import WidgetStats
 
 from . import scene_names
 from .base_app import BaseApp
@@ -26,10 +28,10 @@ class GrokLog(BaseApp):
         )
         self.filter_manager = filter_manager
 
-        # Register all of the filter widgets
+        # Filter widgets are created when their tab is first opened. A widget
+        # subscribes to its filter, so creating them all up front would stop
+        # FilterManager.optimize from fusing chains that nobody is looking at.
         self._filter_widgets = {}
-        for filter in self.filter_manager:
-            self._register_filter(filter)
 
         self.central_layout = Layout([100], fill_frame=True)
         self.add_layout(self.central_layout)
@@ -45,10 +47,6 @@ class GrokLog(BaseApp):
     def reset(self):
         # After coming back from the AddFilter call, recreate the tab buttons to fill
         # in any missing tabs.
-        for filter in self.filter_manager:
-            if filter not in self._filter_widgets:
-                self._register_filter(filter)
-
         self.create_tab_buttons()
         return super().reset()
 
@@ -69,6 +67,13 @@ class GrokLog(BaseApp):
 
         self._filter_widgets[filter] = widget
 
+    def widget_stats(self) -> Dict[ProcessNode, WidgetStats]:
+        """Take a snapshot of how well each filter's widget is keeping up, for the
+        filters whose tab has been opened"""
+        return {
+            filter: widget.stats() for filter, widget in self._filter_widgets.items()
+        }
+
     def view_filter(self, filter):
         """Change the actively shown central widget"""
         if self.scene is not None:
@@ -77,6 +82,7 @@ class GrokLog(BaseApp):
         self.filter_manager.selected_filter = filter
 
         # Replace the central layout widget
+        self._register_filter(filter)
         new_widget = self._filter_widgets[filter]
         self.central_layout.clear_widgets()
         self.central_layout.add_widget(new_widget)
@@ -90,7 +96,7 @@ class GrokLog(BaseApp):
 
         # This seems to put the widget into the update() loop
         self.fix()
-        self.central_layout.focus(force_widget=new_widget)
+        self.central_layout.focus(force_column=0, force_widget=0)
         self.screen.force_update(full_refresh=True)
 
     def create_tab_buttons(self):
@@ -121,11 +127,13 @@ class GrokLog(BaseApp):
             if event.key_code in [Screen.ctrl("c")]:
                 # Catch Ctrl+C and pass it on to the sub shell
                 self.display_toast("Press Escape to close GrokLog!")
-                if (
-                    self.filter_manager.selected_filter
-                    is self.filter_manager.root_filter
+                root_filter = self.filter_manager.root_filter
+                if self.filter_manager.selected_filter is root_filter and isinstance(
+                    root_filter, ShellProcessIO
                 ):
-                    self.filter_manager.root_filter.send_sigint()
+                    root_filter.send_sigint()
                 return
+            if event.key_code == Screen.KEY_F2:
+                self.change_scene(scene_names.STATS_SCENE)
 
         return super().process_event(event)
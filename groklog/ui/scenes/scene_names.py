@@ -1,3 +1,4 @@
 SHELL_VIEW = "Main"
 FILTER_CREATOR_SCENE = "Filter Creator Scene"
 FILTER_VIEWER_SCENE = "Filter Viewer Scene"
+STATS_SCENE = "Stats Scene"
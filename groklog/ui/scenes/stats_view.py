@@ -0,0 +1,208 @@
+from typing import Callable, Dict, List, Optional
+
+from asciimatics import widgets
+from asciimatics.event import KeyboardEvent
+from asciimatics.screen import Screen
+from asciimatics.widgets import Layout
+
+from groklog.filter_manager import FilterManager
+from groklog.process_node import NodeStats, ProcessNode
+from groklog.profiling import SAMPLED_THREADS, StackSampler
+from groklog.ui.colour_cache import ColourCacheStats, colour_cache
+from groklog.ui.widget_stats import WidgetStats
+
+from . import scene_names
+from .base_app import BaseApp
+
+
+class StatsView(BaseApp):
+    """A live table of every filter's runtime metrics, and how well its widget is
+    keeping up, so that whichever filter is holding up the tree stands out. When
+    groklog is being profiled, a second table shows where the UI and reactor threads
+    have spent their time over the last few seconds. How well the colour cache is
+    doing is shown in between.
+
+    Press F2 to switch between this and the main view.
+    """
+
+    _REFRESH_FRAMES = 10
+    """How many frames to wait between refreshing the table"""
+
+    _SAMPLES_HEIGHT = 12
+
+    _COLUMNS = [
+        ("Filter", "<15"),
+        ("Status", "<12"),
+        ("In", ">8"),
+        ("Out", ">8"),
+        ("Out/s", ">8"),
+        ("Lines/s", ">9"),
+        ("History", ">8"),
+        ("Callbacks", ">10"),
+        ("Backlog", ">8"),
+        ("Stalled", ">8"),
+        ("UI queue", ">9"),
+        ("Render", ">8"),
+    ]
+
+    def __init__(
+        self,
+        screen,
+        filter_manager: FilterManager,
+        widget_stats: Callable[[], Dict[ProcessNode, WidgetStats]],
+        sampler: Optional[StackSampler] = None,
+    ):
+        """
+        :param widget_stats: Returns the stats of the widget showing each filter
+        :param sampler: If given, where the time goes is shown too
+        """
+        super().__init__(
+            screen,
+            screen.height,
+            screen.width,
+            can_scroll=False,
+            name="StatsView",
+            title="Filter Stats (F2 to go back)",
+        )
+        self._filter_manager = filter_manager
+        self._widget_stats = widget_stats
+        self._sampler = sampler
+        self._last_refresh: Optional[int] = None
+
+        table_layout = Layout([100], fill_frame=True)
+        self.add_layout(table_layout)
+        self._table = widgets.MultiColumnListBox(
+            widgets.Widget.FILL_FRAME,
+            columns=[width for _, width in self._COLUMNS],
+            options=[],
+            titles=[title for title, _ in self._COLUMNS],
+            name="stats",
+        )
+        table_layout.add_widget(self._table)
+        table_layout.add_widget(widgets.Divider())
+        self._cache_label = widgets.Label("")
+        table_layout.add_widget(self._cache_label)
+        table_layout.add_widget(widgets.Divider())
+
+        self._samples_table = None
+        if sampler is not None:
+            self._samples_table = widgets.MultiColumnListBox(
+                self._SAMPLES_HEIGHT,
+                columns=["<20"] + [">10"] * len(SAMPLED_THREADS),
+                options=[],
+                titles=["Where time goes"] + list(SAMPLED_THREADS),
+                name="samples",
+            )
+            table_layout.add_widget(self._samples_table)
+            table_layout.add_widget(widgets.Divider())
+
+        button_layout = Layout([7, 1])
+        self.add_layout(button_layout)
+        button_layout.add_widget(widgets.Button("Back", self._back), 1)
+
+        self.fix()
+
+    def update(self, frame_no):
+        if self._last_refresh is None or (
+            frame_no - self._last_refresh >= self._REFRESH_FRAMES
+        ):
+            self._last_refresh = frame_no
+            self.refresh()
+        super().update(frame_no)
+
+    def refresh(self):
+        """Fill the table with a fresh snapshot of every filter's stats"""
+        widget_stats = self._widget_stats()
+        rows = []
+        for index, filter in enumerate(self._filter_manager):
+            rows.append((_row(filter.stats(), widget_stats.get(filter)), index))
+        self._table.options = rows
+        self._cache_label.text = _cache_summary(colour_cache.stats())
+
+        if self._sampler is not None:
+            breakdown = self._sampler.breakdown()
+            categories = sorted(
+                {category for shares in breakdown.values() for category in shares},
+                key=lambda category: -sum(
+                    shares.get(category, 0) for shares in breakdown.values()
+                ),
+            )
+            self._samples_table.options = [
+                (
+                    [category]
+                    + [
+                        f"{breakdown.get(thread, {}).get(category, 0):.0%}"
+                        for thread in SAMPLED_THREADS
+                    ],
+                    index,
+                )
+                for index, category in enumerate(categories)
+            ]
+
+    def process_event(self, event):
+        if isinstance(event, KeyboardEvent) and event.key_code == Screen.KEY_F2:
+            self._back()
+        return super().process_event(event)
+
+    def _back(self):
+        self.change_scene(scene_names.SHELL_VIEW)
+
+
+def _row(stats: NodeStats, widget_stats: Optional[WidgetStats]) -> List[str]:
+    # Native filters are fed lines, so their input is counted in lines
+    input_count = (
+        f"{stats.lines_in}L" if stats.lines_in else _format_bytes(stats.bytes_in)
+    )
+    row = [
+        stats.name,
+        _status(stats, widget_stats),
+        input_count,
+        _format_bytes(stats.bytes_out),
+        _format_bytes(stats.bytes_out_per_second),
+        f"{stats.lines_out_per_second:.0f}",
+        _format_bytes(stats.history_bytes),
+        f"{stats.callback_seconds:.2f}s",
+        _format_bytes(stats.input_backlog_bytes),
+        f"{stats.stall_time:.1f}s",
+    ]
+    if widget_stats is None:
+        row += ["-", "-"]
+    else:
+        row += [
+            str(widget_stats.queue_backlog),
+            f"{widget_stats.render_seconds * 1000:.1f}ms",
+        ]
+    return row
+
+
+def _status(stats: NodeStats, widget_stats: Optional[WidgetStats]) -> str:
+    """Sum up whether the filter, or its widget, is falling behind"""
+    if stats.dropped_bytes:
+        return "dropping"
+    if stats.input_backlog_bytes:
+        return "behind"
+    if stats.paused:
+        return "paused"
+    if stats.pending_subscribers:
+        return "onboarding"
+    if widget_stats is not None and widget_stats.queue_backlog > 1:
+        return "UI behind"
+    if stats.output_ended:
+        return "ended"
+    return "ok"
+
+
+def _cache_summary(stats: ColourCacheStats) -> str:
+    return (
+        f"Colour cache: {stats.hit_rate:.0%} hit rate, {stats.hits} parses saved, "
+        f"{stats.misses} lines parsed, {stats.skipped} not kept as unique, "
+        f"{stats.lines} lines, {_format_bytes(stats.bytes)}"
+    )
+
+
+def _format_bytes(count: float) -> str:
+    for unit in ("B", "K", "M", "G"):
+        if count < 1024:
+            break
+        count /= 1024
+    return f"{count:.0f}{unit}" if unit == "B" else f"{count:.1f}{unit}"
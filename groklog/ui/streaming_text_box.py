@@ -1,152 +1,384 @@
-from math import copysign
-from typing import List
+import re
+from abc import abstractmethod
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 
-from asciimatics.event import KeyboardEvent
+from asciimatics.event import KeyboardEvent, MouseEvent
 from asciimatics.screen import Screen
 from asciimatics.strings import ColouredText
-from asciimatics.widgets import TextBox
+from asciimatics.widgets import Widget
 from asciimatics.widgets.utilities import _enforce_width
 
+from groklog.process_node import LineBatch
 
-class StreamingTextBox(TextBox):
+_INITIAL_COLOUR = (None, None, None)
+"""The colour that a stream starts in"""
+
+_SGR = re.compile(r"\x1b\[([0-9;]*)m")
+"""A 'select graphic rendition' escape sequence, which changes the colour"""
+
+_RenderedLine = Tuple[List[ColouredText], Tuple]
+"""The rows that a line wraps into, and the colour that the line ends in"""
+
+
+class StreamingTextBox(Widget):
     """
-    To increase readability of the FilterViewer code, this intermediary class implements
-    some of the necessary functionality for FilterViewer to work. In particular this
-    class makes it possible to append lines to the TextBox without having
-    O(len(self._value)) operations occur each time a new line is added.
+    A read only, scrolling view of a stream of lines, that costs the same to open and
+    to draw no matter how long the stream is.
 
-    It also adds some key commands to make it faster and more intuitive when
-    scrolling up and down.
+    The stream isn't held in the widget. Subclasses say how many lines there are, and
+    read them by line number on demand, and only the lines on screen, plus a small
+    margin, are ever read, colour parsed and wrapped. Rendered lines are kept in an
+    LRU, so scrolling back and forth doesn't parse them again.
+
+    Parsing a line needs the colour that the line before it ended in. Lines without
+    any escape codes can't change the colour, so a line's colour is found by looking
+    back for the last line with one, as far as a line that reset the colour. For
+    typical logs, that's the line before. A colour that's left on for more than
+    _COLOUR_LOOKBACK lines without any escape codes is forgotten.
+
+    Up/Down scroll by one row, PgUp/PgDn by a page, and Home/End jump to the start and
+    end. The view follows new lines while it's scrolled to the end.
     """
 
-    def __init__(self, *args, **kwargs):
-        if kwargs.get("line_wrap", None) is not None:
-            raise ValueError("'line_wrap' is not modifiable in StreamingTextBox!")
-        super().__init__(*args, line_wrap=True, **kwargs)
+    _MARGIN_LINES = 20
+    """How many lines either side of the screen are rendered ahead of time"""
 
-        # Set up initial _value and _reflowed_text_cache values
-        self._value = [ColouredText("", self._parser, colour=None)]
-        self._reflowed_text_cache = [(self._value[-1], 0, 0)]
+    _MIN_RENDERED_LINES = 1000
+    """The least number of rendered lines to keep. At least three screens are kept."""
 
-    def process_event(self, event):
-        """Override the default up/down behavior in such that pressing up and down
-        automatically move the cursor to the top of the page, so that it immediately
-        scrolls the view. This is opposed to the TextBox behavior where the user would
-        have to press Up until the cursor reaches the top of the page before being able
-        to scroll the view.
+    _PAGE_LINES = 256
+    """How many lines are read from the stream at a time"""
+
+    _MAX_PAGES = 64
+
+    _COLOUR_LOOKBACK = 1000
+    """How many lines to look back for the escape code that a line's colour comes
+    from"""
+
+    def __init__(self, height: int, name: Optional[str] = None, parser=None):
         """
+        :param height: The required number of rows for this widget
+        :param parser: The parser that colours the text
+        """
+        super().__init__(name)
+        self._required_height = height
+        self._parser = parser
 
-        if isinstance(event, KeyboardEvent):
-            start_line, cursor_line = self.display_line()
-            lines_from_top = cursor_line - start_line
-            lines_from_bottom = self._h - lines_from_top - 1
+        self._pages: "OrderedDict[int, List[Optional[str]]]" = OrderedDict()
+        """Lines that have been read, by the line number that each page starts at,
+        least recently used first. Lines that were no longer available are None."""
+        self._first_line = 0
+        """The first line that's known to still be available"""
 
-            if event.key_code == Screen.KEY_PAGE_UP:
-                self._change_display_line(-self._h - lines_from_top, cursor_line)
-            elif event.key_code == Screen.KEY_PAGE_DOWN:
-                self._change_display_line(self._h + lines_from_bottom, cursor_line)
-            elif event.key_code == Screen.KEY_UP:
-                self._change_display_line(-lines_from_top - 1, cursor_line)
-            elif event.key_code == Screen.KEY_DOWN:
-                self._change_display_line(lines_from_bottom + 1, cursor_line)
-            else:
-                return super().process_event(event)
-        else:
-            return super().process_event(event)
-
-    def _change_display_line(self, display_delta: int, cursor_line: int):
-        """Similar to self._change_line, except the delta will change based on the
-        number of display lines."""
-        self._column = 0
-
-        new_index = cursor_line + display_delta
-        new_index = max(0, min(new_index, len(self._reflowed_text_cache) - 1))
-        if new_index == cursor_line:
-            # There won't be any change, so just exit early
-            return
-
-        _, current_line, _ = self._reflowed_text_cache[cursor_line]
-        _, new_line, _ = self._reflowed_text_cache[new_index]
-
-        # This delta wasn't enough to actually change the line, so keep recursively
-        # increasing the delta until the line changes
-        if current_line == new_line:
-            return self._change_display_line(
-                int(copysign(1, display_delta)) + display_delta,
-                cursor_line=cursor_line,
+        self._rendered: "OrderedDict[int, _RenderedLine]" = OrderedDict()
+        """Recently shown lines by line number, least recently used first"""
+        self._rendered_width = 0
+
+        self._top_line = 0
+        self._top_row = 0
+        """The first row on screen: a line, and a row within the wrapped line"""
+        self._follow = True
+        """Whether to keep the end of the stream on screen as lines are added"""
+
+        self._reset_colour: Optional[Tuple] = None
+
+    @abstractmethod
+    def _line_count(self) -> int:
+        """The number of lines in the stream, including any that are no longer
+        available"""
+
+    @abstractmethod
+    def _read_lines(self, start: int, stop: int) -> LineBatch:
+        """Read the lines from start to stop. Lines that are no longer available are
+        skipped."""
+
+    def update(self, frame_no):
+        self._draw_label()
+
+        (colour, attr, background) = self._pick_colours("readonly")
+        self._frame.canvas.clear_buffer(
+            colour,
+            attr,
+            background,
+            self._x + self._offset,
+            self._y,
+            self.width,
+            self._h,
+        )
+
+        for y, text in enumerate(self._visible_rows()):
+            paint_text = _enforce_width(
+                text, self.width, self._frame.canvas.unicode_aware
             )
+            self._frame.canvas.paint(
+                str(paint_text),
+                self._x + self._offset,
+                self._y + y,
+                colour,
+                attr,
+                background,
+                colour_map=paint_text.colour_map,
+            )
+
+    def _visible_rows(self) -> List[ColouredText]:
+        """Render the rows on screen, and the margin around them"""
+        if self.width != self._rendered_width:
+            # The lines wrap differently now
+            self._rendered.clear()
+            self._rendered_width = self.width
+
+        end = self._line_count()
+        if self._follow:
+            self._top_line, self._top_row = self._end_position(end)
+        elif self._top_line < self._first_line:
+            self._top_line, self._top_row = self._first_line, 0
+
+        # The margin above is rendered first, so the lines on screen carry on from it
+        margin = self._MARGIN_LINES
+        self._render_range(self._top_line - margin, self._top_line)
+
+        rows = []
+        line = self._top_line
+        while line < end and len(rows) < self._top_row + self._h:
+            rendered = self._render(line)
+            if rendered is not None:
+                rows += rendered[0]
+            line += 1
 
-        self._change_line(new_line - current_line)
+        self._render_range(line, min(line + margin, end))
+        return rows[self._top_row : self._top_row + self._h]
 
-    def display_line(self):
-        """This logic was modified from the process_event of TextBox. It finds the index
-        of _reflowed_text_cache that is currently at the top of the screen, and at the
-        cursor.
+    def _render_range(self, start: int, stop: int):
+        """Render lines in order, so each carries on from the colour of the one before
+        it without looking back"""
+        for line in range(max(start, self._first_line), stop):
+            self._render(line)
+
+    def _render(
+        self, line: int, colour: Optional[Tuple] = None
+    ) -> Optional[_RenderedLine]:
+        """Return a line's rows, rendering it if it isn't in the LRU
+
+        :param colour: The colour that the line starts in, if it's known
+        :return: None if the line is no longer available
         """
-        cursor_line = 0
-        for i, (_, line, col) in enumerate(self._reflowed_text_cache):
-            if line < self._line or (line == self._line and col <= self._column):
-                cursor_line = i
-
-        # Restrict to visible/valid content.
-        start_line = max(
-            0, max(cursor_line - self._h + 1, min(self._start_line, cursor_line))
-        )
-        return start_line, cursor_line
+        rendered = self._rendered.get(line)
+        if rendered is not None:
+            self._rendered.move_to_end(line)
+            return rendered
+
+        raw_line = self._raw_line(line)
+        if raw_line is None:
+            return None
+        if colour is None:
+            colour = self._colour_before(line)
+        if raw_line.isprintable():
+            text = self._plain_text(raw_line, colour)
+        else:
+            text = self._parse_line(raw_line, colour)
+        rendered = self._wrap(text), tuple(text.last_colour)
+
+        self._rendered[line] = rendered
+        while len(self._rendered) > max(self._MIN_RENDERED_LINES, self._h * 3):
+            self._rendered.popitem(last=False)
+        return rendered
 
-    def add_lines(self, new_lines: List[ColouredText]):
-        """Add new lines to the text box.
+    def _raw_line(self, line: int) -> Optional[str]:
+        """Read a line, a page at a time
 
-        This method offers advantages over modifying self._value and calling
-        self.reset(), because it adds to the _reflowed_text_cache without clearing it.
-        This makes it an O(n) operation, where n is the length of the new lines,
-        instead of an O(len(self._value) + n) operation.
+        :return: None if the line is no longer available, or doesn't exist yet
         """
+        if line < self._first_line:
+            return None
+
+        page_start = line - line % self._PAGE_LINES
+        page = self._pages.pop(page_start, [])
+        if line - page_start >= len(page):
+            # Read the rest of the page, which may have grown since it was last read
+            read_from = page_start + len(page)
+            batch = self._read_lines(read_from, page_start + self._PAGE_LINES)
+            if batch.first_line_number > read_from:
+                self._first_line = max(self._first_line, batch.first_line_number)
+                page += [None] * (batch.first_line_number - read_from)
+            page += batch.lines
+
+        self._pages[page_start] = page
+        while len(self._pages) > self._MAX_PAGES:
+            self._pages.popitem(last=False)
+        return page[line - page_start] if line - page_start < len(page) else None
+
+    def _wrap(self, text: ColouredText) -> List[ColouredText]:
+        """Split a line into rows that fit the width of the widget"""
+        width = max(self.width, 1)
+        rows = []
+        while self.string_len(str(text)) > width:
+            row = _enforce_width(text, width, self._frame.canvas.unicode_aware)
+            if len(row) == 0:
+                # A double width character doesn't fit at all
+                row = text[:1]
+            rows.append(row)
+            text = text[len(row) :]
+        rows.append(text)
+        return rows
+
+    def _plain_text(self, line: str, colour: Tuple) -> ColouredText:
+        """Colour a line that has no escape codes, or any other control characters,
+        without running the parser over it one character at a time"""
+        if not line:
+            return ColouredText(line, self._parser, colour=colour)
+        return ColouredText(
+            line,
+            self._parser,
+            colour=colour,
+            colour_map=[colour] * len(line),
+            offsets=list(range(len(line))),
+            text=line,
+        )
+
+    def _parse_line(self, line: str, colour: Tuple) -> ColouredText:
+        """Colour a line, starting from the colour that the line before it ended in"""
+        try:
+            return ColouredText(line, self._parser, colour=colour)
+        except IndexError:
+            # An escape code that the parser chokes on is shown as plain text instead
+            return ColouredText(line.replace("\x1b", ""), self._parser, colour=colour)
+
+    def _colour_before(self, line: int) -> Tuple:
+        """The colour that a line starts in: the colour that the last line before it
+        with an escape code ended in"""
+        lower = max(line - self._COLOUR_LOOKBACK, self._first_line)
+
+        # Look back for a line whose colour is known without parsing the ones before it
+        colour = _INITIAL_COLOUR
+        unknown = []
+        for previous in range(line - 1, lower - 1, -1):
+            rendered = self._rendered.get(previous)
+            if rendered is not None:
+                colour = rendered[1]
+                break
+            raw_line = self._raw_line(previous)
+            if raw_line is None:
+                break
+            if "\x1b" not in raw_line:
+                continue
+            if self._resets_colour(raw_line):
+                colour = self._colour_after_reset()
+                break
+            unknown.append(previous)
+
+        for previous in reversed(unknown):
+            colour = self._render(previous, colour)[1]
+        return colour
 
-        if len(new_lines) == 0:
-            return
+    @staticmethod
+    def _resets_colour(line: str) -> bool:
+        """Whether the last colour change in the line is a reset, so that it ends in
+        the same colour whatever colour it started in"""
+        last_sgr = None
+        for last_sgr in _SGR.finditer(line):
+            pass
+        return last_sgr is not None and all(
+            param.strip("0") == "" for param in last_sgr.group(1).split(";")
+        )
+
+    def _colour_after_reset(self) -> Tuple:
+        if self._reset_colour is None:
+            self._reset_colour = tuple(
+                ColouredText(
+                    "\x1b[0m", self._parser, colour=_INITIAL_COLOUR
+                ).last_colour
+            )
+        return self._reset_colour
+
+    def _end_position(self, end: int) -> Tuple[int, int]:
+        """The top row that shows the end of the stream at the bottom of the screen"""
+        # Every line is at least a row, so this renders every line that can be on screen
+        self._render_range(end - self._h, end)
 
-        self._value += new_lines
+        remaining = self._h
+        line = end
+        while line > self._first_line and remaining > 0:
+            rendered = self._render(line - 1)
+            if rendered is None:
+                break
+            line -= 1
+            remaining -= len(rendered[0])
+        return line, max(-remaining, 0)
 
-        # Exact copy of self.reset(), except _reflowed_text_cache isn't set to None
-        self.reset()
+    def _scroll(self, delta: int):
+        """Move the view by a number of rows, negative being up"""
+        end = self._line_count()
+        line, row = self._top_line, self._top_row
+        if self._follow:
+            line, row = self._end_position(end)
 
-        # Append to the _reflowed_text_cache
-        limit = self._w - self._offset
-        for i, line in enumerate(new_lines, start=self._reflowed_text_cache[-1][1] + 1):
-            column = 0
-            while self.string_len(str(line)) >= limit:
-                sub_string = _enforce_width(
-                    line, limit, self._frame.canvas.unicode_aware
-                )
-                self._reflowed_text_cache.append((sub_string, i, column))
-                line = line[len(sub_string) :]
-                column += len(sub_string)
-            self._reflowed_text_cache.append((line, i, column))
+        row += delta
+        if row < 0:
+            self._render_range(line + row, line)
+        while row < 0 and line > self._first_line:
+            rendered = self._render(line - 1)
+            if rendered is None:
+                break
+            line -= 1
+            row += len(rendered[0])
+        while line < end:
+            rendered = self._render(line)
+            if rendered is None or row < len(rendered[0]):
+                break
+            row -= len(rendered[0])
+            line += 1
+
+        end_position = self._end_position(end)
+        self._follow = (line, row) >= end_position
+        if self._follow:
+            line, row = end_position
+        self._top_line, self._top_row = line, max(row, 0)
+
+    def process_event(self, event):
+        if isinstance(event, KeyboardEvent):
+            if event.key_code == Screen.KEY_PAGE_UP:
+                self._scroll(-self._h)
+            elif event.key_code == Screen.KEY_PAGE_DOWN:
+                self._scroll(self._h)
+            elif event.key_code == Screen.KEY_UP:
+                self._scroll(-1)
+            elif event.key_code == Screen.KEY_DOWN:
+                self._scroll(1)
+            elif event.key_code == Screen.KEY_HOME:
+                # Reading no lines finds out where the available lines start
+                first_line = self._read_lines(0, 0).first_line_number
+                self._first_line = max(self._first_line, first_line)
+                self._follow = False
+                self._top_line, self._top_row = self._first_line, 0
+            elif event.key_code == Screen.KEY_END:
+                self._follow = True
+            else:
+                return event
+            return None
+        elif isinstance(event, MouseEvent):
+            # The layout gives this widget focus when it's clicked, before passing the
+            # click on. Like TextBox, clicks on the widget are used up, and clicks
+            # elsewhere are passed back so that focus can move to another widget.
+            if event.buttons != 0 and self.is_mouse_over(event, include_label=False):
+                return None
+        return event
 
     def reset(self):
-        """This mirrors the TextBox.reset() except it doesn't clear the
-        _reflowed_text_cache
-        """
-        self._start_line = 0
-        self._start_column = 0
-        self._line = len(self._value) - 1
-        self._column = 0 if self._is_disabled else len(self._value[self._line])
+        """Go back to following the end of the stream"""
+        self._follow = True
 
-    @property
-    def _reflowed_text(self):
-        """Because this class sets the _reflowed_text_cache in the add_stream method, we
-        override the TextBox for this property."""
-        return self._reflowed_text_cache
+    def required_height(self, offset, width):
+        return self._required_height
 
     @property
     def value(self):
-        self._value = [ColouredText("", self._parser, colour=None)]
-        return self._value
+        """The stream isn't held in the widget, so it has no value"""
+        return None
 
     @value.setter
     def value(self, value):
-        """This value should never be used. It's been replaced by _add_stream"""
+        """This value should never be used"""
         pass
 
     @property
@@ -4,13 +4,15 @@ import fcntl
 import struct
 import termios
 from queue import Queue
+from time import perf_counter
 
 from asciimatics.event import KeyboardEvent
 from asciimatics.parsers import AnsiTerminalParser, Parser
 from asciimatics.screen import Canvas, Screen
 from asciimatics.widgets import Widget
 
-from groklog.process_node import ShellProcessIO
+from groklog.process_node import Replay, ShellProcessIO
+from groklog.ui.widget_stats import RenderTimer, WidgetStats
 
 
 class Terminal(Widget):
@@ -53,12 +55,28 @@ class Terminal(Widget):
         # Subscribe to shell data
         self._data_queue = Queue()
         self._shell = shell
+        self._replay_pending = False
+        """Whether to resubscribe to the shell's history on the next update, once the
+        widget has been laid out and its height is known"""
+        self._render_timer = RenderTimer()
+
+    def stats(self) -> WidgetStats:
+        return WidgetStats(
+            queue_backlog=self._data_queue.qsize(),
+            render_seconds=self._render_timer.last,
+            mean_render_seconds=self._render_timer.mean,
+        )
 
     def update(self, frame_no):
         """Draw the current terminal content to screen."""
+        started = perf_counter()
+
         # Push current terminal output to screen.
         self._canvas.refresh()
 
+        if self._replay_pending:
+            self._replay_history()
+
         # Drain the shell queue of any data that built up between frames
         full_stream = ""
         while self._data_queue.qsize():
@@ -77,6 +95,8 @@ class Terminal(Widget):
                 attr |= Screen.A_REVERSE
                 self._frame.canvas.print_at(chr(char), x, y, colour, attr, bg)
 
+        self._render_timer.record(perf_counter() - started)
+
     def set_layout(self, x, y, offset, w, h):
         """
         Resize the widget (and underlying TTY) to the required size.
@@ -221,19 +241,35 @@ class Terminal(Widget):
             Screen.COLOUR_BLACK,
         )
 
-        # Unsubscribe and resubscribe to the stream to get back the full history
+        # Unsubscribe and resubscribe to the stream to get back the history. That's
+        # left to the next update, because a widget that's reset before it's laid out
+        # doesn't know how many rows of history it can show yet.
         if self._shell.is_subscribed(
             ShellProcessIO.Topic.STRING_DATA_STREAM, self._data_queue.put
         ):
             self._shell.unsubscribe(
                 ShellProcessIO.Topic.STRING_DATA_STREAM, self._data_queue.put
             )
+        self._replay_pending = True
+
+    def _replay_history(self):
+        """Subscribe to the shell's output, replaying as much of its history as fits on
+        the canvas. The canvas only holds self._h rows, so any lines before the last
+        self._h would scroll straight off of it anyway."""
+        self._replay_pending = False
+
+        # Output that was queued before the reset is part of the replay
+        while self._data_queue.qsize():
+            self._data_queue.get_nowait()
 
         # TODO: unsubscribing and subscribing with block=False is NOT thread safe.
         #       for that reason, we set blocking=True for this call. Investigate
         #       making a robust shell.is_subscribed call.
         self._shell.subscribe_with_history(
-            ShellProcessIO.Topic.STRING_DATA_STREAM, self._data_queue.put, blocking=True
+            ShellProcessIO.Topic.STRING_DATA_STREAM,
+            self._data_queue.put,
+            blocking=True,
+            replay=Replay.last_lines(self._h),
         )
 
     def required_height(self, offset, width):
@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class WidgetStats:
+    """A snapshot of how well a widget is keeping up with the filter it shows"""
+
+    queue_backlog: int
+    """Batches of output waiting in the widget's queue for the next frame. This only
+    shrinks while the widget is on screen."""
+
+    render_seconds: float
+    """How long the widget's last frame took to update"""
+
+    mean_render_seconds: float
+    """How long the widget's frames have taken to update, on average"""
+
+
+class RenderTimer:
+    """Keeps track of how long a widget's frames take to update"""
+
+    def __init__(self):
+        self.last = 0.0
+        self._total = 0.0
+        self._frames = 0
+
+    def record(self, seconds: float):
+        self.last = seconds
+        self._total += seconds
+        self._frames += 1
+
+    @property
+    def mean(self) -> float:
+        return self._total / self._frames if self._frames else 0.0
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import re
+
+import pytest
+
+from groklog.filter_manager import FilterManager
+from groklog.process_node import (
+    AsyncGenericProcessIO,
+    AsyncShellProcessIO,
+    BackpressurePolicy,
+    HistoryBackend,
+)
+
+
+async def drain_until_equals(queue: asyncio.Queue, value, timeout=5):
+    """Await items from the queue until their concatenation equals the value"""
+    retrieved = type(value)()
+    while retrieved != value:
+        retrieved += await asyncio.wait_for(queue.get(), timeout)
+        assert value.startswith(retrieved)
+
+
+async def drain_until_matches(queue: asyncio.Queue, regex: bytes, timeout=5):
+    """Await items from the queue until their concatenation matches the regex"""
+    retrieved = b""
+    while not re.search(regex, retrieved):
+        retrieved += await asyncio.wait_for(queue.get(), timeout)
+
+
+@pytest.mark.parametrize(
+    ("command", "input_bytes", "expected_output_bytes"),
+    [
+        ["cat", b"hello world\n" * 1000, b"hello world\n" * 1000],
+        ["grep --line-buffered world", b"hello\nworld\n", b"world\n"],
+    ],
+)
+def test_async_generic_process(command, input_bytes, expected_output_bytes):
+    async def run():
+        process = AsyncGenericProcessIO(name="", command=command)
+        output = process.subscribe_queue(process.Topic.BYTES_DATA_STREAM)
+
+        # Input written before the process has started is held until it starts
+        process.write(input_bytes)
+        await drain_until_equals(output, expected_output_bytes)
+        assert process._bytes_history.read() == expected_output_bytes
+
+        await process.aclose(timeout=5)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("history_backend", HistoryBackend)
+def test_async_history_is_passed(history_backend):
+    async def run():
+        process = AsyncGenericProcessIO(
+            name="", command="cat", history_backend=history_backend
+        )
+        first = process.subscribe_queue(process.Topic.STRING_DATA_STREAM)
+        process.write(b"first\n")
+        await drain_until_equals(first, "first\n")
+
+        second = process.subscribe_queue(process.Topic.STRING_DATA_STREAM)
+        await drain_until_equals(second, "first\n")
+
+        process.write(b"second\n")
+        await drain_until_equals(first, "second\n")
+        await drain_until_equals(second, "second\n")
+
+        await process.aclose(timeout=5)
+
+    asyncio.run(run())
+
+
+def test_async_filter_tree():
+    """Build a tree of filters on an asyncio shell through the FilterManager"""
+
+    async def run():
+        manager = FilterManager(
+            shell=AsyncShellProcessIO(), filter_class=AsyncGenericProcessIO
+        )
+        last_filter = manager.root_filter
+        for i in range(10):
+            last_filter = manager.create_filter(
+                name=f"Cat {i}", command="cat", parent=last_filter
+            )
+        assert isinstance(last_filter, AsyncGenericProcessIO)
+
+        # Wait for the shell to show its prompt before typing into it
+        output = last_filter.subscribe_queue(last_filter.Topic.BYTES_DATA_STREAM)
+        await drain_until_matches(output, rb"[$#] $", timeout=15)
+
+        manager.root_filter.write(b"echo through-'the'-tree\n")
+        await drain_until_matches(output, b"through-the-tree\r\n", timeout=10)
+
+        await manager.aclose(timeout=10)
+
+    asyncio.run(run())
+
+
+def test_async_slow_child_blocks_parent():
+    async def run():
+        parent = AsyncGenericProcessIO(name="parent", command="cat")
+        child = AsyncGenericProcessIO(
+            name="child",
+            command="sleep 1 && cat",
+            backpressure=BackpressurePolicy(high_water_mark=1024),
+        )
+        parent.add_child(child)
+        output = child.subscribe_queue(child.Topic.BYTES_DATA_STREAM)
+
+        big_input = b"lots of input\n" * 100000
+        parent.write(big_input)
+        await drain_until_equals(output, big_input, timeout=15)
+        assert child.stall_time > 0
+
+        await parent.aclose(timeout=5)
+
+    asyncio.run(run())
+
+
+def test_async_input_ends_with_parent_output():
+    """A child's stdin is closed once its parent's output ends, so that commands which
+    wait for the end of their input can finish"""
+
+    async def run():
+        parent = AsyncGenericProcessIO(name="parent", command="printf 'a\\nb\\n'")
+        child = AsyncGenericProcessIO(name="child", command="wc -l")
+        parent.add_child(child)
+        output = child.subscribe_queue(child.Topic.BYTES_DATA_STREAM)
+
+        await drain_until_matches(output, rb"2\n")
+        await asyncio.wait_for(child.wait_closed(), 5)
+
+        await parent.aclose(timeout=5)
+
+    asyncio.run(run())
+
+
+def test_async_close_before_spawn():
+    """Closing a node before its process is spawned closes both ends of its stdin"""
+
+    async def run():
+        process = AsyncGenericProcessIO(name="", command="cat")
+        stdin_read, stdin = process._stdin_read, process._stdin
+        await process.aclose(timeout=5)
+        for fd in (stdin_read, stdin):
+            with pytest.raises(OSError):
+                os.fstat(fd)
+
+    asyncio.run(run())
@@ -0,0 +1,172 @@
+import os
+from queue import Queue
+
+import pytest
+
+from groklog.process_node import (
+    BackpressurePolicy,
+    GenericProcessIO,
+    OverflowPolicy,
+)
+from groklog.process_node.backpressure import OutboundBuffer
+from tests.utils import drain_until_output_matches_regex, drain_until_queue_equals
+
+
+@pytest.fixture()
+def pipe():
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    os.set_blocking(write_fd, False)
+    yield read_fd, write_fd
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def read_all(fd: int) -> bytes:
+    data = b""
+    try:
+        while True:
+            data += os.read(fd, 65536)
+    except BlockingIOError:
+        return data
+
+
+def fill(fd: int) -> int:
+    """Fill a non-blocking pipe until it can't take any more"""
+    written = 0
+    try:
+        while True:
+            written += os.write(fd, b"\0" * 65536)
+    except BlockingIOError:
+        return written
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, name):
+        return lambda: self.calls.append(name)
+
+
+def create_buffer(policy: BackpressurePolicy, recorder: Recorder) -> OutboundBuffer:
+    return OutboundBuffer(
+        policy,
+        pause_parent=recorder("pause"),
+        resume_parent=recorder("resume"),
+        disconnect=recorder("disconnect"),
+    )
+
+
+def test_buffer_writes_in_order(pipe):
+    read_fd, write_fd = pipe
+    buffer = create_buffer(BackpressurePolicy(), Recorder())
+
+    # Data is written straight through when the pipe has space
+    assert not buffer.send(write_fd, b"first")
+    assert read_all(read_fd) == b"first"
+
+    filled = fill(write_fd)
+    assert buffer.send(write_fd, b"second")
+    assert buffer.send(write_fd, b"third")
+    assert len(buffer) == len(b"secondthird")
+    assert buffer.stall_time > 0
+
+    assert len(read_all(read_fd)) == filled
+    assert not buffer.flush(write_fd)
+    assert read_all(read_fd) == b"secondthird"
+    assert len(buffer) == 0
+
+
+def test_buffer_block_pauses_parent(pipe):
+    read_fd, write_fd = pipe
+    recorder = Recorder()
+    buffer = create_buffer(BackpressurePolicy(high_water_mark=10), recorder)
+    fill(write_fd)
+
+    buffer.send(write_fd, b"0123456789")
+    assert recorder.calls == []
+    buffer.send(write_fd, b"a")
+    buffer.send(write_fd, b"b")
+    assert recorder.calls == ["pause"]
+    assert len(buffer) == 12
+
+    read_all(read_fd)
+    buffer.flush(write_fd)
+    assert recorder.calls == ["pause", "resume"]
+
+
+def test_buffer_drop_oldest(pipe):
+    read_fd, write_fd = pipe
+    recorder = Recorder()
+    buffer = create_buffer(
+        BackpressurePolicy(high_water_mark=10, overflow=OverflowPolicy.DROP_OLDEST),
+        recorder,
+    )
+    fill(write_fd)
+
+    buffer.send(write_fd, b"aaaaaa")
+    buffer.send(write_fd, b"bbbbbb")
+    assert len(buffer) == 10
+    assert buffer.dropped_bytes == 2
+
+    read_all(read_fd)
+    buffer.flush(write_fd)
+    assert read_all(read_fd) == b"aaaabbbbbb"
+    assert recorder.calls == []
+
+
+def test_buffer_disconnect(pipe):
+    _, write_fd = pipe
+    recorder = Recorder()
+    buffer = create_buffer(
+        BackpressurePolicy(high_water_mark=10, overflow=OverflowPolicy.DISCONNECT),
+        recorder,
+    )
+    fill(write_fd)
+
+    buffer.send(write_fd, b"a" * 11)
+    assert recorder.calls == ["disconnect"]
+    assert len(buffer) == 0
+
+
+def test_slow_child_blocks_parent():
+    """With the block policy, a slow child pauses its parent, but nothing is lost"""
+    parent = GenericProcessIO(name="parent", command="cat")
+    child = GenericProcessIO(
+        name="child",
+        command="sleep 1 && cat",
+        backpressure=BackpressurePolicy(high_water_mark=1024),
+    )
+    parent.add_child(child)
+
+    child_output = Queue()
+    child.subscribe(child.Topic.BYTES_DATA_STREAM, child_output.put)
+    big_input = b"lots of input\n" * 100000
+    parent.write(big_input)
+
+    drain_until_queue_equals(child_output, big_input, timeout=15)
+    assert child.stall_time > 0
+    parent.close()
+
+
+def test_slow_child_is_disconnected():
+    parent = GenericProcessIO(name="parent", command="cat")
+    child = GenericProcessIO(
+        name="child",
+        command="sleep 10",
+        backpressure=BackpressurePolicy(
+            high_water_mark=1024, overflow=OverflowPolicy.DISCONNECT
+        ),
+    )
+    parent.add_child(child)
+    child_output = Queue()
+    child.subscribe(child.Topic.STRING_DATA_STREAM, child_output.put)
+
+    parent.write(b"lots of input\n" * 100000)
+    drain_until_output_matches_regex(
+        child_output, "\n.*'child' fell more than 1024 bytes behind 'parent'"
+    )
+    assert child.disconnected
+    assert not parent.is_subscribed(parent.Topic.BYTES_DATA_STREAM, child.write)
+    parent.close()
@@ -0,0 +1,157 @@
+import os
+from queue import Queue
+
+from groklog.process_node import CoalescePolicy, GenericProcessIO
+from groklog.process_node.coalesce import Coalescer
+from groklog.process_node.read_buffer import ReadBuffer
+from tests.utils import drain_until_queue_equals
+
+
+class FakeTimer:
+    def __init__(self, callback):
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def create_coalescer(policy: CoalescePolicy):
+    published, timers = [], []
+
+    def call_later(delay, callback):
+        assert delay == policy.max_latency
+        timers.append(FakeTimer(callback))
+        return timers[-1]
+
+    return Coalescer(policy, published.append, call_later), published, timers
+
+
+def test_sparse_output_is_published_immediately(monkeypatch):
+    from groklog.process_node import coalesce
+
+    now = 100.0
+    monkeypatch.setattr(coalesce, "monotonic", lambda: now)
+    coalescer, published, timers = create_coalescer(CoalescePolicy(max_latency=0.005))
+
+    coalescer.feed(b"a")
+    now += 0.01
+    coalescer.feed(b"b")
+    assert published == [b"a", b"b"]
+    assert timers == []
+
+
+def test_fast_output_is_merged(monkeypatch):
+    from groklog.process_node import coalesce
+
+    now = 100.0
+    monkeypatch.setattr(coalesce, "monotonic", lambda: now)
+    coalescer, published, timers = create_coalescer(
+        CoalescePolicy(max_latency=0.005, max_bytes=10)
+    )
+
+    coalescer.feed(b"first")
+    for chunk in [b"a", b"b", b"c"]:
+        now += 0.001
+        coalescer.feed(chunk)
+    assert published == [b"first"]
+    assert len(coalescer) == 3
+
+    # Only one flush is scheduled, and it publishes everything held back
+    (timer,) = timers
+    timer.callback()
+    assert published == [b"first", b"abc"]
+
+    # Reaching the size limit publishes straight away, and cancels the timer
+    now += 0.001
+    coalescer.feed(b"1234")
+    coalescer.feed(b"567890")
+    assert published == [b"first", b"abc", b"1234567890"]
+    assert timers[-1].cancelled
+
+
+def test_disabled(monkeypatch):
+    coalescer, published, timers = create_coalescer(CoalescePolicy(max_latency=0))
+    for chunk in [b"a", b"b", b"c"]:
+        coalescer.feed(chunk)
+    assert published == [b"a", b"b", b"c"]
+
+
+def test_flood_is_published_in_few_batches():
+    policy = CoalescePolicy(max_latency=0.05, max_bytes=1024 * 1024)
+    process = GenericProcessIO(name="", command="cat", coalesce=policy)
+    assert process.coalesce is policy
+    output = Queue()
+    process.subscribe(process.Topic.BYTES_DATA_STREAM, output.put)
+
+    expected = b""
+    for i in range(200):
+        line = f"line {i}\n".encode()
+        process.write(line)
+        expected += line
+
+    drain_until_queue_equals(output, expected)
+    assert process._bytes_history.read() == expected
+    process.close()
+
+
+def test_read_from_merges_reads_in_place(monkeypatch):
+    from groklog.process_node import coalesce
+
+    now = 100.0
+    monkeypatch.setattr(coalesce, "monotonic", lambda: now)
+    coalescer, published, timers = create_coalescer(
+        CoalescePolicy(max_latency=0.005, max_bytes=10)
+    )
+    read_fd, write_fd = os.pipe()
+
+    # Sparse output is published as a view of the buffer, which is only valid during
+    # the callback, so copy what's published
+    coalescer._publish = lambda data: published.append(bytes(data))
+    os.write(write_fd, b"first")
+    assert coalescer.read_from(read_fd, 1024) == 5
+    assert published == [b"first"]
+
+    for chunk in [b"a", b"b", b"c"]:
+        now += 0.001
+        os.write(write_fd, chunk)
+        assert coalescer.read_from(read_fd, 1024) == 1
+    assert published == [b"first"]
+    assert len(coalescer) == 3
+
+    (timer,) = timers
+    timer.callback()
+    assert published == [b"first", b"abc"]
+    assert isinstance(published[-1], bytes)
+
+    os.close(write_fd)
+    assert coalescer.read_from(read_fd, 1024) == 0
+    os.close(read_fd)
+
+
+def test_read_buffer():
+    read_fd, write_fd = os.pipe()
+    buffer = ReadBuffer(4)
+
+    os.write(write_fd, b"123456")
+    assert buffer.read_from(read_fd, 4) == 4
+    assert buffer.space == 0
+    with buffer.view() as view:
+        assert view == b"1234"
+
+    # The buffer grows when there's no space for the data
+    buffer.append(b"ab")
+    assert buffer.capacity == 6
+    assert buffer.read_from(read_fd, 1024) == 2
+    assert buffer.capacity == 1030
+    assert buffer.take() == b"1234ab56"
+    assert len(buffer) == 0
+
+    # Once the buffer is empty its space is reused
+    os.write(write_fd, b"again")
+    assert buffer.read_from(read_fd, 1024) == 5
+    assert buffer.capacity == 1030
+    assert buffer.take() == b"again"
+
+    os.close(read_fd)
+    os.close(write_fd)
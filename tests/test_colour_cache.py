@@ -0,0 +1,83 @@
+import pytest
+from asciimatics.parsers import AnsiTerminalParser
+from asciimatics.strings import ColouredText
+
+from groklog.ui.colour_cache import ColourCache, ColourCachePolicy
+
+
+def test_parse():
+    """Lines are keyed by their content and the colour they start in"""
+    cache = ColourCache()
+    parser = AnsiTerminalParser()
+    red = cache.parse("\x1b[31mred", (7, 2, 0), parser)
+    assert cache.parse("\x1b[31mred", (7, 2, 0), AnsiTerminalParser()) is red
+    assert cache.parse("plain", (7, 2, 0), parser).first_colour == (7, 2, 0)
+    assert cache.parse("plain", (1, 2, 0), parser).first_colour == (1, 2, 0)
+    assert (cache.stats().hits, cache.stats().misses) == (1, 3)
+
+
+def cache_line(cache: ColourCache, line: str) -> ColouredText:
+    """Look up a line, parsing and caching it on a miss"""
+    text = cache.get(line)
+    if text is None:
+        text = ColouredText(line, AnsiTerminalParser())
+        cache.put(line, line, text)
+    return text
+
+
+def test_evicts_least_recently_used():
+    cache = ColourCache(ColourCachePolicy(max_lines=2))
+    first = cache_line(cache, "\x1b[31mred")
+    cache_line(cache, "\x1b[32mgreen")
+    assert cache_line(cache, "\x1b[31mred") is first
+
+    # Green was used least recently, so it's evicted to make room
+    cache_line(cache, "\x1b[34mblue")
+    assert cache.get("\x1b[32mgreen") is None
+    assert cache.get("\x1b[31mred") is first
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.evictions) == (2, 4, 1)
+    assert stats.lines == 2
+    assert stats.hit_rate == pytest.approx(2 / 6)
+
+
+def test_byte_limit():
+    cache = ColourCache(ColourCachePolicy(max_bytes=10_000))
+    for index in range(100):
+        cache_line(cache, f"\x1b[31mline {index % 1000:03}" + " " * 100)
+
+    stats = cache.stats()
+    assert 0 < stats.bytes <= 10_000
+    assert stats.lines + stats.evictions == 100
+
+
+def test_skips_lines_that_look_unique():
+    cache = ColourCache()
+    for line in [
+        "\x1b[32m12:04:33 INFO request done",
+        "\x1b[32mINFO request 1714032000 done",
+        "\x1b[32mINFO request 0b9f2c1e-55aa-4c1c-9d7e-3f1a2b3c4d5e done",
+    ]:
+        cache_line(cache, line)
+        cache_line(cache, line)
+    assert cache.stats().skipped == 6
+    assert cache.stats().lines == 0
+
+    # Unless the heuristic is turned off
+    cache.policy = ColourCachePolicy(skip_unique=False)
+    cache_line(cache, "\x1b[32m12:04:33 INFO request done")
+    assert cache.stats().lines == 1
+
+
+def test_changing_the_policy_evicts():
+    cache = ColourCache()
+    for index in range(10):
+        cache_line(cache, f"\x1b[31mline {index}")
+
+    cache.policy = ColourCachePolicy(max_lines=3)
+    assert cache.stats().lines == 3
+    cache.policy = ColourCachePolicy(max_lines=0)
+    assert cache.stats().lines == 0
+    cache_line(cache, "\x1b[31mline")
+    assert cache.stats().lines == 0
@@ -0,0 +1,128 @@
+import gzip
+import mmap
+from queue import Queue
+
+import pytest
+
+from groklog.process_node import (
+    FileReplayIO,
+    GenericProcessIO,
+    PlaybackSpeed,
+    file_replay,
+)
+from groklog.process_node.file_replay import (
+    _decompress,
+    _Pacer,
+    _playback_order,
+    _read_logs,
+)
+from tests.utils import drain_until_queue_equals
+
+
+def write_rotated_logs(directory):
+    """Write logs rotated the way logrotate does, and return their combined contents
+    in the order they were written"""
+    oldest = b"".join(b"old %d\n" % i for i in range(50000))
+    (directory / "app.log.2.gz").write_bytes(gzip.compress(oldest))
+    # Concatenated gzip files have several members
+    older = gzip.compress(b"older 1\n") + gzip.compress(b"older 2\n")
+    (directory / "app.log.1.gz").write_bytes(older)
+    (directory / "app.log.10").write_bytes(b"")
+    (directory / "app.log").write_bytes(b"newest\npartial")
+    return oldest + b"older 1\nolder 2\n" + b"newest\npartial"
+
+
+def test_playback_order(tmp_path):
+    write_rotated_logs(tmp_path)
+    assert [path.name for path in _playback_order(tmp_path)] == [
+        "app.log.10",
+        "app.log.2.gz",
+        "app.log.1.gz",
+        "app.log",
+    ]
+    assert _playback_order(tmp_path / "app.log") == [tmp_path / "app.log"]
+
+
+def test_chunks_end_on_line_breaks(tmp_path):
+    expected = write_rotated_logs(tmp_path)
+    chunks = list(_read_logs(_playback_order(tmp_path), chunk_size=1000))
+    assert b"".join(chunks) == expected
+    assert all(chunk.endswith(b"\n") for chunk in chunks[:-1])
+    assert max(len(chunk) for chunk in chunks) <= 1000
+
+
+def test_decompresses_a_chunk_at_a_time(tmp_path):
+    """A file that compresses well is decompressed in blocks of at most chunk_size,
+    rather than all of a chunk's output at once"""
+    contents = b"the same line over and over\n" * 100_000
+    path = tmp_path / "app.log.1.gz"
+    path.write_bytes(gzip.compress(contents) + gzip.compress(b"second member\n"))
+    with path.open("rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        blocks = list(_decompress(mapped, chunk_size=1000))
+    assert b"".join(blocks) == contents + b"second member\n"
+    assert max(len(block) for block in blocks) <= 1000
+
+
+def test_replay_into_tree(tmp_path):
+    expected = write_rotated_logs(tmp_path)
+    replay = FileReplayIO(tmp_path)
+    child = GenericProcessIO(name="", command="grep older")
+    replay.add_child(child)
+    output = Queue()
+    child.subscribe(child.Topic.BYTES_DATA_STREAM, output.put)
+
+    replay.start()
+    assert replay.wait_for_output_end(timeout=10)
+    assert replay._bytes_history.read() == expected
+
+    # The child's input ends with the replay, so it finishes too
+    assert child.wait_for_output_end(timeout=10)
+    drain_until_queue_equals(output, b"older 1\nolder 2\n")
+    replay.close()
+
+    with pytest.raises(TypeError):
+        replay.write(b"input")
+
+
+def test_missing_logs(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        FileReplayIO(tmp_path)
+
+
+def test_pacer(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(file_replay, "monotonic", lambda: now)
+    pacer = _Pacer(multiplier=2)
+
+    data = (
+        b"2021-07-01 12:00:00 first\n"
+        b"no timestamp\n"
+        b"[web] 2021-07-01T12:00:01.5 second\n"
+        b"Jul  1 12:00:05 syslog is only comparable with itself\n"
+    )
+    second = data.index(b"[web]")
+    assert pacer.due(data, 0) == (second, 0.75)
+
+    now += 0.75
+    assert pacer.due(data, second) == (len(data), 0.0)
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("fastest", PlaybackSpeed.fastest()),
+        ("realtime", PlaybackSpeed.realtime()),
+        ("10x", PlaybackSpeed.times(10)),
+        ("0.5", PlaybackSpeed.times(0.5)),
+    ],
+)
+def test_parse_speed(text, expected):
+    assert PlaybackSpeed.parse(text) == expected
+
+
+@pytest.mark.parametrize("text", ["slow", "0x", "-1"])
+def test_parse_invalid_speed(text):
+    with pytest.raises(ValueError):
+        PlaybackSpeed.parse(text)
@@ -1,11 +1,27 @@
+import json
+from queue import Queue
+
 import pytest
 
 from groklog.filter_manager import (
     ROOT_FILTER_NAME,
     DuplicateFilterError,
+    FilterManager,
     FilterNotFoundError,
+    UnknownFilterTypeError,
+)
+from groklog.process_node import (
+    BackpressurePolicy,
+    CoalescePolicy,
+    GenericProcessIO,
+    HistoryBackend,
+    OverflowPolicy,
+    ParallelProcessIO,
+    ProcessNode,
+    RegexFilterNode,
+    RetentionPolicy,
+    ShellProcessIO,
 )
-from groklog.process_node import GenericProcessIO, ProcessNode
 
 
 def test_instantiation_registers_root_filter(filter_manager):
@@ -88,3 +104,199 @@ def test_iteration(filter_manager):
     ]
 
     assert list(filter_manager) == filters
+
+
+def test_profile_retention_round_trip(shell, tmp_path):
+    """Test that retention policies and history backends set on specific filters are
+    saved and loaded, and that filters without one fall back to the default."""
+    default = RetentionPolicy(max_lines=100)
+    manager = FilterManager(shell=shell, default_retention=default)
+    custom = RetentionPolicy(max_bytes=1024, max_age=60)
+    manager.create_filter(
+        "Custom",
+        command="cat",
+        parent=shell,
+        retention=custom,
+        history_backend=HistoryBackend.DISK,
+    )
+    manager.create_filter("Default", command="cat", parent=shell)
+    shell.retention = RetentionPolicy(max_lines=5)
+
+    profile_path = tmp_path / "profile.json"
+    manager.save_profile(profile_path)
+    profile_json = json.loads(profile_path.read_text())
+    assert profile_json[FilterManager.FILTER_RETENTION] == {"max_lines": 5}
+    custom_json, default_json = profile_json[FilterManager.FILTER_CHILDREN]
+    assert custom_json[FilterManager.FILTER_RETENTION] == {
+        "max_bytes": 1024,
+        "max_age": 60,
+    }
+    assert custom_json[FilterManager.FILTER_HISTORY_BACKEND] == "disk"
+    assert FilterManager.FILTER_RETENTION not in default_json
+    assert FilterManager.FILTER_HISTORY_BACKEND not in default_json
+
+    # Close the first tree before loading the profile into a new one
+    manager.close()
+
+    loaded_shell = ShellProcessIO()
+    loaded = FilterManager(shell=loaded_shell, default_retention=default)
+    loaded.load_profile(profile_path)
+    assert loaded.root_filter.retention == RetentionPolicy(max_lines=5)
+    assert loaded.get_filter("Custom").retention == custom
+    assert loaded.get_filter("Custom").history_backend is HistoryBackend.DISK
+    assert loaded.get_filter("Default").history_backend is HistoryBackend.MEMORY
+    assert loaded.get_filter("Default").retention == default
+    loaded.close()
+
+
+def test_profile_backpressure_round_trip(shell, tmp_path):
+    manager = FilterManager(shell=shell)
+    custom = BackpressurePolicy(
+        high_water_mark=4096, overflow=OverflowPolicy.DROP_OLDEST
+    )
+    manager.create_filter("Custom", command="cat", parent=shell, backpressure=custom)
+    manager.create_filter("Default", command="cat", parent=shell)
+
+    profile_path = tmp_path / "profile.json"
+    manager.save_profile(profile_path)
+    profile_json = json.loads(profile_path.read_text())
+    assert FilterManager.FILTER_BACKPRESSURE not in profile_json
+    custom_json, default_json = profile_json[FilterManager.FILTER_CHILDREN]
+    assert custom_json[FilterManager.FILTER_BACKPRESSURE] == {
+        "high_water_mark": 4096,
+        "overflow": "drop_oldest",
+    }
+    assert FilterManager.FILTER_BACKPRESSURE not in default_json
+    manager.close()
+
+    default = BackpressurePolicy(high_water_mark=1024)
+    loaded = FilterManager(shell=ShellProcessIO(), default_backpressure=default)
+    loaded.load_profile(profile_path)
+    assert loaded.root_filter.backpressure is None
+    assert loaded.get_filter("Custom").backpressure == custom
+    assert loaded.get_filter("Default").backpressure == default
+    loaded.close()
+
+
+def test_profile_native_filter_round_trip(shell, tmp_path):
+    manager = FilterManager(shell=shell)
+    errors = manager.create_native_filter(
+        "Errors",
+        filter_type="regex",
+        options={"pattern": "ERROR|FATAL", "ignore_case": True},
+        parent=shell,
+    )
+    manager.create_filter("Process", command="cat", parent=errors)
+
+    profile_path = tmp_path / "profile.json"
+    manager.save_profile(profile_path)
+    (errors_json,) = json.loads(profile_path.read_text())[FilterManager.FILTER_CHILDREN]
+    assert errors_json[FilterManager.FILTER_TYPE] == "regex"
+    assert errors_json[FilterManager.FILTER_OPTIONS] == {
+        "pattern": "ERROR|FATAL",
+        "invert": False,
+        "ignore_case": True,
+    }
+    (process_json,) = errors_json[FilterManager.FILTER_CHILDREN]
+    assert FilterManager.FILTER_TYPE not in process_json
+    manager.close()
+
+    loaded = FilterManager(shell=ShellProcessIO())
+    loaded.load_profile(profile_path)
+    loaded_errors = loaded.get_filter("Errors")
+    assert isinstance(loaded_errors, RegexFilterNode)
+    assert loaded_errors.options == errors.options
+    assert loaded_errors.command == errors.command
+    assert isinstance(loaded.get_filter("Process"), GenericProcessIO)
+
+    with pytest.raises(UnknownFilterTypeError):
+        loaded.create_native_filter(
+            "Unknown", filter_type="sed", options={}, parent=loaded.root_filter
+        )
+    loaded.close()
+
+
+def test_profile_parallel_filter_round_trip(shell, tmp_path):
+    manager = FilterManager(shell=shell)
+    manager.create_filter("Parallel", command="cat", parent=shell, workers=3)
+    manager.create_filter("Single", command="cat", parent=shell)
+
+    profile_path = tmp_path / "profile.json"
+    manager.save_profile(profile_path)
+    parallel_json, single_json = json.loads(profile_path.read_text())[
+        FilterManager.FILTER_CHILDREN
+    ]
+    assert parallel_json[FilterManager.FILTER_WORKERS] == 3
+    assert FilterManager.FILTER_WORKERS not in single_json
+    manager.close()
+
+    loaded = FilterManager(shell=ShellProcessIO())
+    loaded.load_profile(profile_path)
+    parallel = loaded.get_filter("Parallel")
+    assert isinstance(parallel, ParallelProcessIO)
+    assert parallel.workers == 3
+    assert isinstance(loaded.get_filter("Single"), GenericProcessIO)
+    loaded.close()
+
+
+def test_filters_are_created_with_the_coalesce_policy(shell, monkeypatch):
+    """Filters start reading as soon as they're created, so the policy is passed to
+    their constructors rather than set afterwards"""
+    policy = CoalescePolicy(max_latency=0)
+    manager = FilterManager(shell=shell, default_coalesce=policy)
+    # Without its setter, setting the policy on a filter after creating it raises
+    monkeypatch.setattr(
+        ProcessNode,
+        "coalesce",
+        property(ProcessNode.coalesce.fget),
+    )
+    process = manager.create_filter("Process", command="cat", parent=shell)
+    parallel = manager.create_filter("Parallel", command="cat", parent=shell, workers=1)
+    assert process.coalesce is policy
+    assert parallel.coalesce is policy
+    manager.close()
+
+
+def test_parallel_filter_options_are_not_ignored(shell):
+    manager = FilterManager(shell=shell)
+    with pytest.raises(ValueError):
+        manager.create_filter(
+            "Parallel",
+            command="cat",
+            parent=shell,
+            workers=2,
+            backpressure=BackpressurePolicy(high_water_mark=1024),
+        )
+
+    manager.filter_class = ShellProcessIO
+    with pytest.raises(ValueError):
+        manager.create_filter("Parallel", command="cat", parent=shell, workers=2)
+    assert len(list(manager)) == 1
+    manager.close()
+
+
+def test_optimize_fuses_unwatched_chains(filter_manager):
+    """Shell → errors → not disk → words is fused into one stage, but a chain through a
+    watched filter is not"""
+    shell = filter_manager.root_filter
+    errors = filter_manager.create_native_filter(
+        "errors", "substring", {"substring": "ERROR"}, parent=shell
+    )
+    not_disk = filter_manager.create_native_filter(
+        "not disk", "regex", {"pattern": "disk", "invert": True}, parent=errors
+    )
+    words = filter_manager.create_native_filter(
+        "words", "cut", {"fields": [2]}, parent=not_disk
+    )
+    watched = filter_manager.create_native_filter(
+        "watched", "substring", {"substring": "a"}, parent=shell
+    )
+    filter_manager.create_native_filter(
+        "after watched", "substring", {"substring": "b"}, parent=watched
+    )
+    viewer = Queue()
+    watched.subscribe(ProcessNode.Topic.LINE_STREAM, viewer.put)
+
+    (chain,) = filter_manager.optimize()
+    assert chain.nodes == [errors, not_disk, words]
+    assert filter_manager.optimize() == []
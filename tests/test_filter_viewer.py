@@ -1,62 +1,256 @@
+from collections import defaultdict
+from typing import List
 from unittest.mock import MagicMock
 
 import pytest
-from asciimatics.strings import ColouredText
+from asciimatics.event import KeyboardEvent, MouseEvent
+from asciimatics.screen import Screen
 from asciimatics.widgets import Widget
 
+from groklog.process_node import (
+    FusedChain,
+    GenericProcessIO,
+    RetentionPolicy,
+    SubstringFilterNode,
+)
+from groklog.process_node.reactor import reactor
+from groklog.ui import filter_viewer as filter_viewer_module
+from groklog.ui.colour_cache import ColourCache
 from groklog.ui.filter_viewer import FilterViewer
 
 
-@pytest.fixture
-def filter_viewer():
-    class MockFilter(MagicMock):
-        pass
+class MockCanvas:
+    unicode_aware = False
+    start_line = 0
+    height = 5
+
+    def __init__(self):
+        self.rows = {}
+
+    def clear_buffer(self, *args):
+        self.rows = {}
+
+    def paint(self, text, x, y, colour, attr, bg, colour_map=None):
+        self.rows[y] = (text, colour_map)
+
+
+class MockFrame:
+    palette = defaultdict(lambda: (7, 0, 0))
 
-    class MockCanvas:
-        unicode_aware = False
+    def __init__(self):
+        self.canvas = MockCanvas()
 
-    class MockFrame:
-        canvas = MockCanvas()
 
-    widget = FilterViewer(filter=MockFilter(), height=Widget.FILL_FRAME)
+def create_viewer(filter: SubstringFilterNode) -> FilterViewer:
+    """Show a filter that's fed by a process, as in a real tree. The test feeds the
+    filter directly, and closes the process to close the filter."""
+    if filter.parent is None:
+        GenericProcessIO(name="root", command="cat").add_child(filter)
+    widget = FilterViewer(filter=filter, height=Widget.FILL_FRAME)
     widget.register_frame(MockFrame())
-    widget.set_layout(x=0, y=0, offset=10, w=100, h=200)
+    widget.set_layout(x=0, y=0, offset=10, w=100, h=5)
+    # Wait for the subscription to be set up
+    reactor.run(lambda: None)
+    return widget
 
-    yield widget
+
+@pytest.fixture
+def filter_viewer():
+    filter = SubstringFilterNode(name="filter", substring="")
+    yield create_viewer(filter)
+    filter.parent.close()
+
+
+def screen_text(filter_viewer: FilterViewer) -> List[str]:
+    filter_viewer.update(0)
+    rows = filter_viewer._frame.canvas.rows
+    return [rows[y][0] for y in sorted(rows)]
 
 
 def test_add_lines(filter_viewer):
-    # Test initial values match what's expected
-    assert filter_viewer._value == [
-        ColouredText("", filter_viewer._parser, colour=None)
-    ]
-    assert filter_viewer._reflowed_text_cache == [(filter_viewer._value[0], 0, 0)]
-
-    # Feed 3 lines into the system
-    new_lines_1 = "line1\nline2\nline3\n"
-    add_and_consume_stream(new_lines_1, filter_viewer)
-
-    # Verify they were added to the _reflowed_text_cache
-    assert len(filter_viewer._value) == 4
-    assert len(filter_viewer._reflowed_text_cache) == 4
-    for i, reflowed in enumerate(filter_viewer._reflowed_text_cache):
-        assert filter_viewer._value[i] == reflowed[0]
-        assert i == reflowed[1]
-
-    # Add another few lines and confirm they were added just the same
-    new_lines_2 = "line4\nline5\n"
-    add_and_consume_stream(new_lines_2, filter_viewer)
-    assert len(filter_viewer._value) == 6
-    assert len(filter_viewer._reflowed_text_cache) == 6
-    assert filter_viewer._reflowed_text_cache[5][0]._raw_text == "line5"
-    for i, reflowed in enumerate(filter_viewer._reflowed_text_cache):
-        assert filter_viewer._value[i] == reflowed[0]
-        assert i == reflowed[1]
-
-    # Validate reseting doesn't clear the value or text cache
-    filter_viewer.reset()
-    assert len(filter_viewer._value) == 6
-    assert len(filter_viewer._reflowed_text_cache) == 6
+    assert screen_text(filter_viewer) == []
+
+    # Feed 3 lines into the system, which are shown from the top
+    add_and_consume_stream("line1\nline2\nline3\n", filter_viewer)
+    assert screen_text(filter_viewer) == ["line1", "line2", "line3"]
+
+    # Once the screen is full, the view follows the end of the stream
+    add_and_consume_stream("line4\nline5\nline6\n", filter_viewer)
+    assert screen_text(filter_viewer) == [f"line{i}" for i in range(2, 7)]
+
+    # Long lines are wrapped to the width of the widget
+    add_and_consume_stream("x" * 200 + "\n", filter_viewer)
+    assert screen_text(filter_viewer)[-3:] == ["x" * 90, "x" * 90, "x" * 20]
+
+    # A line isn't shown until it's complete
+    add_and_consume_stream("partial", filter_viewer)
+    assert screen_text(filter_viewer)[-1] == "x" * 20
+
+
+def test_opens_on_existing_history():
+    """A viewer that's opened on a filter with a long history reads just the lines
+    that it shows from the filter, and carries on with new lines from there"""
+    filter = SubstringFilterNode(name="filter", substring="")
+    filter._record_and_publish(
+        "".join(f"line{i}\n" for i in range(100_000)).encode() + b"partial"
+    )
+    filter_viewer = create_viewer(filter)
+    read = []
+    read_lines = filter_viewer._read_lines
+
+    def counting_read_lines(start, stop):
+        read.append((start, stop))
+        return read_lines(start, stop)
+
+    filter_viewer._read_lines = counting_read_lines
+    assert screen_text(filter_viewer) == [f"line{i}" for i in range(99_995, 100_000)]
+    # Looking back for the colour that the lines start in is the most that's read
+    lookback = filter_viewer._COLOUR_LOOKBACK + 2 * filter_viewer._PAGE_LINES
+    assert sum(stop - start for start, stop in read) <= lookback
+
+    add_and_consume_stream(" line\n", filter_viewer)
+    assert screen_text(filter_viewer)[-2:] == ["line99999", "partial line"]
+    filter.parent.close()
+
+
+def test_evicted_lines():
+    """Lines that the filter no longer keeps are skipped"""
+    filter = SubstringFilterNode(
+        name="filter", substring="", retention=RetentionPolicy(max_lines=3)
+    )
+    filter_viewer = create_viewer(filter)
+    add_and_consume_stream("".join(f"line{i}\n" for i in range(10)), filter_viewer)
+    assert screen_text(filter_viewer) == ["line7", "line8", "line9"]
+
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_HOME))
+    assert screen_text(filter_viewer)[0] == "line7"
+    filter.parent.close()
+
+
+def test_opens_on_a_fused_filter():
+    """Opening a viewer on a filter in the middle of a fused chain shows the output
+    that the filter skipped while it was fused"""
+    root = GenericProcessIO(name="root", command="cat")
+    errors = SubstringFilterNode(name="errors", substring="ERROR")
+    not_disk = SubstringFilterNode(name="not disk", substring="disk", invert=True)
+    root.add_child(errors)
+    errors.add_child(not_disk)
+    reactor.run(lambda: None)
+    FusedChain([errors, not_disk])
+    root._record_and_publish(b"ERROR disk full\nINFO fine\nERROR timeout\n")
+
+    filter_viewer = create_viewer(errors)
+    assert errors._fusion is None
+    assert screen_text(filter_viewer) == ["ERROR disk full", "ERROR timeout"]
+    root.close()
+
+
+def test_only_parses_visible_lines(filter_viewer, monkeypatch):
+    """Only the lines on screen, and the margin around them, are ever parsed"""
+    parsed = []
+
+    def counting(parse):
+        def counting_parse(line, colour):
+            parsed.append(line)
+            return parse(line, colour)
+
+        return counting_parse
+
+    # Lines without escape codes are coloured without running the parser
+    for name in ("_parse_line", "_plain_text"):
+        monkeypatch.setattr(filter_viewer, name, counting(getattr(filter_viewer, name)))
+    add_and_consume_stream("".join(f"line{i}\n" for i in range(100_000)), filter_viewer)
+    assert parsed == []
+
+    assert screen_text(filter_viewer) == [f"line{i}" for i in range(99_995, 100_000)]
+    assert len(parsed) == 5 + filter_viewer._MARGIN_LINES
+
+    # Scrolling shows lines that were rendered already, and only the margin moves on
+    parsed.clear()
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_UP))
+    assert screen_text(filter_viewer)[0] == "line99994"
+    assert parsed == [f"line{99_995 - filter_viewer._MARGIN_LINES - 1}"]
+
+
+def test_colour_carries_between_lines(filter_viewer):
+    """A line starts in the colour that the last line before it with an escape code
+    ended in, even if that line was never shown"""
+    add_and_consume_stream(
+        "\x1b[31mred\n" + "still red\n" * 100 + "\x1b[0mreset\nplain\n", filter_viewer
+    )
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_HOME))
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_PAGE_DOWN))
+    filter_viewer.update(0)
+    text, colour_map = filter_viewer._frame.canvas.rows[0]
+    assert text == "still red"
+    assert colour_map[0][0] == Screen.COLOUR_RED
+
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_END))
+    filter_viewer.update(0)
+    text, colour_map = filter_viewer._frame.canvas.rows[4]
+    assert text == "plain"
+    assert colour_map[0][0] != Screen.COLOUR_RED
+
+
+def test_views_share_parsed_lines(filter_viewer, monkeypatch):
+    """A line that a filter passes on is only parsed once, for every view showing it"""
+    cache = ColourCache()
+    monkeypatch.setattr(filter_viewer_module, "colour_cache", cache)
+    child = SubstringFilterNode(name="child", substring="")
+    filter_viewer.filter.add_child(child)
+    child_viewer = create_viewer(child)
+
+    add_and_consume_stream("\x1b[31mred\x1b[0m\n", filter_viewer)
+    child_viewer._take_new_lines(0.0)
+    assert screen_text(filter_viewer) == screen_text(child_viewer) == ["red"]
+    assert (cache.stats().misses, cache.stats().hits) == (1, 1)
+
+
+def test_scrolling(filter_viewer):
+    add_and_consume_stream("".join(f"line{i}\n" for i in range(20)), filter_viewer)
+    assert screen_text(filter_viewer)[0] == "line15"
+
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_PAGE_UP))
+    assert screen_text(filter_viewer)[0] == "line10"
+
+    # New lines don't move the view while it's scrolled up
+    add_and_consume_stream("line20\n", filter_viewer)
+    assert screen_text(filter_viewer)[0] == "line10"
+
+    # Scrolling back down to the end follows new lines again
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_PAGE_DOWN))
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_DOWN))
+    add_and_consume_stream("line21\n", filter_viewer)
+    assert screen_text(filter_viewer) == [f"line{i}" for i in range(17, 22)]
+
+    filter_viewer.process_event(KeyboardEvent(Screen.KEY_HOME))
+    assert screen_text(filter_viewer)[0] == "line0"
+
+
+def test_mouse_clicks(filter_viewer):
+    """Clicks on the text are used up, without moving the view, and clicks anywhere
+    else are passed back so focus can move"""
+    add_and_consume_stream("".join(f"line{i}\n" for i in range(20)), filter_viewer)
+    click = MouseEvent(x=20, y=2, buttons=MouseEvent.LEFT_CLICK)
+    assert filter_viewer.process_event(click) is None
+    assert screen_text(filter_viewer)[0] == "line15"
+
+    outside = MouseEvent(x=20, y=7, buttons=MouseEvent.LEFT_CLICK)
+    assert filter_viewer.process_event(outside) is outside
+    move = MouseEvent(x=20, y=2, buttons=0)
+    assert filter_viewer.process_event(move) is move
+
+
+def test_stats(filter_viewer):
+    assert filter_viewer.stats().queue_backlog == 0
+    filter_viewer.filter._record_and_publish(b"line1\nline2\n")
+    assert filter_viewer.stats().queue_backlog > 0
+
+    filter_viewer._render_timer.record(0.002)
+    filter_viewer._render_timer.record(0.004)
+    stats = filter_viewer.stats()
+    assert stats.render_seconds == 0.004
+    assert stats.mean_render_seconds == 0.003
 
 
 def test_subscribes_nonblocking():
@@ -74,11 +268,7 @@ def test_subscribes_nonblocking():
 
 
 def add_and_consume_stream(stream: str, filter_viewer: FilterViewer):
-    """Adds lines to the filter viewer as though a filter had called _add_stream and
-    the UI had called update."""
-    # This would be called as a callback by a ProcessNOde
-    filter_viewer._add_stream(stream)
-
-    # This would be called in the `update` function
-    while filter_viewer._processed_data_queue.qsize():
-        filter_viewer.add_lines(filter_viewer._processed_data_queue.get_nowait())
+    """Has the filter output some text, which it publishes to the filter viewer's
+    _add_stream, and takes the new lines as the UI would in `update`."""
+    filter_viewer.filter._record_and_publish(stream.encode())
+    filter_viewer._take_new_lines(0.0)
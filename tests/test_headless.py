@@ -0,0 +1,112 @@
+import subprocess
+import sys
+
+from groklog.filter_manager import FilterManager
+from groklog.headless import _output_paths, open_input, run_headless
+from groklog.process_node import GenericProcessIO, StreamInputIO
+
+INPUT = "".join(
+    f"{i} {'ERROR' if i % 5 == 0 else 'INFO'} message\n" for i in range(1000)
+)
+
+
+def build_tree(filter_manager: FilterManager):
+    errors = filter_manager.create_filter(
+        name="Errors", command="grep ERROR", parent=filter_manager.root_filter
+    )
+    filter_manager.create_filter(name="Error Count", command="wc -l", parent=errors)
+    info = filter_manager.create_native_filter(
+        name="Info",
+        filter_type="substring",
+        options={"substring": "INFO", "invert": False},
+        parent=filter_manager.root_filter,
+    )
+    filter_manager.create_native_filter(
+        name="Info Numbers",
+        filter_type="cut",
+        options={"fields": [1], "delimiter": None},
+        parent=info,
+    )
+    filter_manager.create_filter(name="Parallel", command="cat", parent=info, workers=2)
+
+
+def test_run_headless(tmp_path):
+    input_path = tmp_path / "input.log"
+    input_path.write_text(INPUT)
+
+    # Save a profile to run
+    profile_path = tmp_path / "profile.json"
+    filter_manager = FilterManager(
+        shell=StreamInputIO.from_command(name="Shell", command="true")
+    )
+    build_tree(filter_manager)
+    filter_manager.save_profile(profile_path)
+    filter_manager.close()
+
+    filter_manager = FilterManager(shell=open_input(f"cat {input_path}"))
+    output_directory = tmp_path / "output"
+    assert run_headless(filter_manager, profile_path, output_directory) == 0
+
+    lines = INPUT.splitlines(keepends=True)
+    info = "".join(line for line in lines if "INFO" in line)
+    errors = "".join(line for line in lines if "ERROR" in line)
+    expected = {
+        "Shell.log": INPUT,
+        "Errors.log": errors,
+        "Error_Count.log": f"{errors.count(chr(10))}\n",
+        "Info.log": info,
+        "Info_Numbers.log": "".join(
+            line.split()[0] + "\n" for line in info.splitlines()
+        ),
+        "Parallel.log": info,
+    }
+    for name, expected_output in expected.items():
+        assert (output_directory / name).read_text().lstrip() == expected_output
+
+
+def test_missing_profile(tmp_path):
+    filter_manager = FilterManager(shell=open_input("true"))
+    assert run_headless(filter_manager, tmp_path / "nope.json", tmp_path) == 1
+    assert not filter_manager.root_filter._running
+
+
+def test_input_ends_from_the_root_down():
+    """Once a node's output ends, each child's stdin is closed after all of the output
+    was written to it, so that the whole tree finishes"""
+    root = StreamInputIO.from_command(name="", command="seq 100000")
+    child = GenericProcessIO(name="", command="wc -l")
+    root.add_child(child)
+    root.start()
+
+    assert root.wait_for_output_end(timeout=10)
+    assert child.wait_for_output_end(timeout=10)
+    assert child._bytes_history.read().strip() == b"100000"
+
+    # Children added after the output ended are ended once they're onboarded
+    late_child = GenericProcessIO(name="", command="wc -l")
+    root.add_child(late_child)
+    assert late_child.wait_for_output_end(timeout=10)
+    assert late_child._bytes_history.read().strip() == b"100000"
+    root.close()
+
+
+def test_output_paths(tmp_path):
+    filters = [
+        GenericProcessIO(name=name, command="true")
+        for name in ["Shell", "a/b", "a b", "..", "shell"]
+    ]
+    paths = _output_paths(filters, tmp_path)
+    for filter in filters:
+        filter.close()
+    assert [path.name for path in paths] == [
+        "Shell.log",
+        "a_b.log",
+        "a_b_2.log",
+        "filter.log",
+        "shell_2.log",
+    ]
+
+
+def test_headless_does_not_import_the_ui():
+    code = "import sys, groklog.headless; assert 'asciimatics' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
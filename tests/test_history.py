@@ -0,0 +1,245 @@
+from array import array
+
+import pytest
+
+from groklog.process_node.history import (
+    ChunkedHistory,
+    DiskHistory,
+    History,
+    RetentionPolicy,
+)
+
+
+@pytest.fixture(params=["memory", "disk"])
+def create_history(request, tmp_path):
+    """Returns a function for creating a history, for each history type"""
+    histories = []
+
+    def create_history(empty, retention=RetentionPolicy()):
+        if request.param == "memory":
+            history = ChunkedHistory(empty, retention)
+        else:
+            history = DiskHistory(empty, tmp_path / str(len(histories)), retention)
+        histories.append(history)
+        return history
+
+    yield create_history
+
+    for history in histories:
+        history.close()
+
+
+@pytest.fixture()
+def history(create_history):
+    history = create_history(b"")
+    for chunk in [b"hello", b" ", b"world", b"", b"!\n"]:
+        history.append(chunk)
+    return history
+
+
+def test_append_and_read(history):
+    assert len(history) == len(b"hello world!\n")
+    assert history.read() == b"hello world!\n"
+    assert b"".join(history.replay()) == b"hello world!\n"
+
+    # Empty chunks should not be recorded
+    assert list(history.chunks()) == [b"hello", b" ", b"world", b"!\n"]
+
+
+@pytest.mark.parametrize(
+    ("start", "stop", "expected_chunks"),
+    [
+        (0, None, [b"hello", b" ", b"world", b"!\n"]),
+        (0, 5, [b"hello"]),
+        (2, 8, [b"llo", b" ", b"wo"]),
+        (6, 11, [b"world"]),
+        (11, 100, [b"!\n"]),
+        (5, 5, []),
+        (13, None, []),
+        (8, 3, []),
+    ],
+)
+def test_partial_chunks(history, start, stop, expected_chunks):
+    assert list(history.chunks(start, stop)) == expected_chunks
+    assert history.read(start, stop) == b"".join(expected_chunks)
+
+
+def test_string_history(create_history):
+    history = create_history("")
+    assert history.read() == ""
+    assert list(history.replay()) == []
+
+    history.append("héllo ")
+    history.append("wörld")
+    assert len(history) == 11
+    assert history.read(1, 8) == "éllo wö"
+    assert list(history.replay(2)) == ["llo wörld"]
+
+    history.retention = RetentionPolicy(max_bytes=7)
+    assert history.read() == "o wörld"
+
+
+@pytest.mark.parametrize(
+    ("retention", "expected"),
+    [
+        (RetentionPolicy(), b"line1\nline2\nline3\npartial"),
+        (RetentionPolicy(max_bytes=10), b"e3\npartial"),
+        (RetentionPolicy(max_bytes=7), b"partial"),
+        (RetentionPolicy(max_lines=1), b"line3\npartial"),
+        (RetentionPolicy(max_lines=2), b"line2\nline3\npartial"),
+        (RetentionPolicy(max_lines=0), b"partial"),
+        (RetentionPolicy(max_bytes=16, max_lines=1), b"line3\npartial"),
+    ],
+)
+def test_retention(create_history, retention, expected):
+    history = create_history(b"", retention)
+    for chunk in [b"line1\nli", b"ne2\n", b"line3\npartial"]:
+        history.append(chunk)
+
+    assert history.read() == expected
+    assert len(history) == len(expected)
+    assert history.end == 25
+    assert history.start == 25 - len(expected)
+
+    # Reading from before the start of the retained history skips evicted data
+    assert history.read(0, history.start + 2) == expected[:2]
+
+
+def test_retention_max_age(create_history, monkeypatch):
+    from groklog.process_node.history import base as history_module
+
+    now = 100.0
+    monkeypatch.setattr(history_module, "monotonic", lambda: now)
+
+    history = create_history(b"", RetentionPolicy(max_age=10))
+    history.append(b"old\n")
+    now = 105.0
+    history.append(b"new\n")
+    assert history.read() == b"old\nnew\n"
+
+    now = 112.0
+    history.enforce_retention()
+    assert history.read() == b"new\n"
+    assert history.start == 4
+
+
+def test_retention_memory_stays_flat():
+    """Under constant input, evicted chunks should be released and compacted"""
+    history = ChunkedHistory(b"", RetentionPolicy(max_bytes=1000))
+    for _ in range(10000):
+        history.append(b"x" * 100)
+
+    assert len(history) == 1000
+    assert len(history._chunks) <= 2 * ChunkedHistory._COMPACT_THRESHOLD
+    assert history.read() == b"x" * 1000
+
+
+def test_changing_retention_evicts(create_history):
+    history = create_history("")
+    history.append("a\nb\nc\n")
+    history.retention = RetentionPolicy(max_lines=1)
+    assert history.read() == "c\n"
+
+
+def test_disk_history_segments(tmp_path, monkeypatch):
+    """Test that the disk history rolls over to new segment files, replays them as
+    memoryviews, and deletes segments once they've been evicted."""
+    monkeypatch.setattr(DiskHistory, "_SEGMENT_MAX_BYTES", 10)
+    history = DiskHistory(b"", tmp_path / "history")
+    for chunk in [b"aaaa", b"bbbb", b"cccc", b"dddd", b"eeeeeeeeeeeeeeee"]:
+        history.append(chunk)
+
+    segments = sorted(p.name for p in (tmp_path / "history").iterdir())
+    assert len(segments) == 3
+
+    replayed = list(history.replay(2))
+    assert all(isinstance(piece, memoryview) for piece in replayed)
+    assert [bytes(piece) for piece in replayed] == [
+        b"aabbbb",
+        b"ccccdddd",
+        b"eeeeeeeeeeeeeeee",
+    ]
+    del replayed
+
+    history.retention = RetentionPolicy(max_bytes=18)
+    assert history.read() == b"dd" + b"e" * 16
+    assert sorted(p.name for p in (tmp_path / "history").iterdir()) == segments[1:]
+
+    history.close()
+    assert not (tmp_path / "history").exists()
+
+
+def test_line_tracking(create_history):
+    history = create_history(b"", RetentionPolicy(max_bytes=6))
+    assert (history.line_count, history.start_line, history.last_line_start) == (
+        0,
+        0,
+        0,
+    )
+
+    history.append(b"one\ntwo\nthr")
+    assert history.line_count == 2
+    assert history.last_line_start == len(b"one\ntwo\n")
+    # "one\n" and the "t" of "two" were evicted, so the history starts in line 1
+    assert history.read() == b"wo\nthr"
+    assert history.start_line == 1
+
+    history.append(b"ee")
+    assert history.line_count == 2
+    assert history.last_line_start == len(b"one\ntwo\n")
+
+
+def test_line_offsets(create_history):
+    history = create_history(b"")
+    for chunk in [b"zero\non", b"e\n", b"two\nthree\nfo"]:
+        history.append(chunk)
+
+    assert history.line_count == 4
+    first_line, offsets = history.line_offsets()
+    assert first_line == 0
+    assert list(offsets) == [0, 5, 9, 13, 19]
+    first_line, offsets = history.line_offsets(1, 3)
+    assert (first_line, list(offsets)) == (1, [5, 9, 13])
+    assert history.line_offsets(4) == (4, array("Q"))
+
+    # Lines that are even partly evicted are skipped
+    history.retention = RetentionPolicy(max_bytes=len(b"o\ntwo\nthree\nfo"))
+    first_line, offsets = history.line_offsets()
+    assert (first_line, list(offsets)) == (2, [9, 13, 19])
+
+    # The index is compacted along with the chunks
+    history.retention = RetentionPolicy(max_lines=3)
+    for i in range(5000):
+        history.append(b"line %d\n" % i)
+    assert len(history._line_starts) < 2 * History._COMPACT_THRESHOLD
+    first_line, offsets = history.line_offsets()
+    assert first_line == history.line_count - 3
+    assert history.read(offsets[0]) == b"line 4997\nline 4998\nline 4999\n"
+
+
+def test_lines_are_indexed_when_looked_up(create_history):
+    """Appending only counts lines. They're indexed on the first lookup, even if the
+    history has been evicted past the lines that were indexed before."""
+    history = create_history(b"", RetentionPolicy(max_bytes=20))
+    stream = b""
+    for i in range(200):
+        chunk = b"x" * (i % 7) + b"\n" * (i % 3) + b"y" * (i % 5)
+        indexed_end = history._indexed_end
+        history.append(chunk)
+        stream += chunk
+        assert history.last_line_start == stream.rfind(b"\n") + 1
+        # Appending never extends the index, and eviction only restarts it
+        assert history._indexed_end in (indexed_end, history.start)
+        if i % 11:
+            continue
+
+        # Every line that starts within the retained history, and the line after
+        line_starts = [0] + [i + 1 for i, byte in enumerate(stream) if byte == 10]
+        retained = [start for start in line_starts if start >= history.start]
+        first_line, offsets = history.line_offsets()
+        assert list(offsets) == (retained if len(retained) > 1 else [])
+        if len(retained) > 1:
+            assert first_line == line_starts.index(retained[0])
+        assert history._indexed_end == history.end
+        assert history.line_at(history.end) == stream.count(b"\n")
+        assert history.line_start(history.line_count) == history.last_line_start
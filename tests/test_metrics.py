@@ -0,0 +1,77 @@
+from queue import Queue
+
+from groklog.filter_manager import FilterManager
+from groklog.process_node import GenericProcessIO, SubstringFilterNode, metrics
+from groklog.process_node.metrics import RateMeter
+from groklog.process_node.reactor import reactor
+from tests.utils import drain_until_queue_equals
+
+
+def test_node_stats():
+    root = GenericProcessIO(name="root", command="cat")
+    child = SubstringFilterNode(name="child", substring="b")
+    root.add_child(child)
+    output = Queue()
+    child.subscribe(child.Topic.BYTES_DATA_STREAM, output.put)
+
+    root.write(b"a\nb\nc\n")
+    drain_until_queue_equals(output, b"b\n")
+    reactor.run(lambda: None)
+
+    stats = root.stats()
+    assert stats.name == "root"
+    assert (stats.bytes_in, stats.lines_in) == (6, 0)
+    assert (stats.bytes_out, stats.lines_out, stats.history_bytes) == (6, 3, 6)
+    # The child is fed from the root's callbacks
+    assert stats.callback_seconds > 0
+    assert stats.input_backlog_bytes == 0
+    assert not stats.paused and not stats.output_ended
+
+    # Native filters are fed lines instead of bytes
+    stats = child.stats()
+    assert (stats.bytes_in, stats.lines_in) == (0, 3)
+    assert (stats.bytes_out, stats.lines_out) == (2, 1)
+    root.close()
+
+
+def test_input_backlog():
+    """Input that the process hasn't read yet shows up as a backlog"""
+    node = GenericProcessIO(name="", command="sleep 10")
+    node.write(b"x" * 1024 * 1024)
+    stats = node.stats()
+    assert stats.bytes_in == 1024 * 1024
+    assert 0 < stats.input_backlog_bytes < 1024 * 1024
+    assert stats.stall_time > 0
+    node.close()
+
+
+def test_filter_manager_stats():
+    filter_manager = FilterManager(shell=GenericProcessIO(name="Shell", command="cat"))
+    filter_manager.create_filter(
+        name="child", command="cat", parent=filter_manager.root_filter
+    )
+    assert [stats.name for stats in filter_manager.stats()] == ["Shell", "child"]
+    filter_manager.close()
+
+
+def test_rate_meter(monkeypatch):
+    now = 100.0
+    monkeypatch.setattr(metrics, "monotonic", lambda: now)
+    meter = RateMeter(window=2, resolution=0.5)
+    assert meter.rates(0, 0) == (0.0, 0.0)
+
+    for second in range(10):
+        now = 100.0 + second
+        meter.sample(second * 1000, second * 10)
+    # Only enough samples to cover the window are kept
+    assert len(meter._samples) == 3
+    assert meter.rates(9000, 90) == (1000, 10)
+
+    # Samples closer together than the resolution are skipped
+    now += 0.1
+    meter.sample(9100, 91)
+    assert len(meter._samples) == 3
+
+    # The rates fall once the counters stop changing
+    now += 10
+    assert meter.rates(9000, 90)[0] < 200
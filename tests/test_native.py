@@ -0,0 +1,251 @@
+from queue import Queue
+
+import pytest
+
+from groklog.process_node import (
+    CutFilterNode,
+    FusedChain,
+    GenericProcessIO,
+    LineBatch,
+    RegexFilterNode,
+    SubstringFilterNode,
+)
+from groklog.process_node.reactor import reactor
+from tests.utils import drain_until_queue_equals
+
+LINES = ["INFO started", "ERROR disk full", "warn: error rate high", "INFO done"]
+
+
+@pytest.mark.parametrize(
+    ("node", "expected_command", "expected_lines"),
+    [
+        (
+            RegexFilterNode("", pattern="^(ERROR|INFO) "),
+            "grep -E '^(ERROR|INFO) '",
+            ["INFO started", "ERROR disk full", "INFO done"],
+        ),
+        (
+            RegexFilterNode("", pattern="error", invert=True, ignore_case=True),
+            "grep -Evi error",
+            ["INFO started", "INFO done"],
+        ),
+        (
+            SubstringFilterNode("", substring="ERROR"),
+            "grep -F ERROR",
+            ["ERROR disk full"],
+        ),
+        (
+            SubstringFilterNode("", substring="INFO", invert=True),
+            "grep -Fv INFO",
+            ["ERROR disk full", "warn: error rate high"],
+        ),
+        (
+            CutFilterNode("", fields=[2, 1]),
+            "awk '{print $2, $1}'",
+            ["started INFO", "disk ERROR", "error warn:", "done INFO"],
+        ),
+        (
+            CutFilterNode("", fields=[1, 4], delimiter=" "),
+            "cut -d ' ' -f 1,4",
+            ["INFO", "ERROR", "warn: high", "INFO"],
+        ),
+        (
+            # Like cut, lines without the delimiter are kept whole
+            CutFilterNode("", fields=[2], delimiter=":"),
+            "cut -d : -f 2",
+            ["INFO started", "ERROR disk full", " error rate high", "INFO done"],
+        ),
+    ],
+)
+def test_filter_lines(node, expected_command, expected_lines):
+    assert node.command == expected_command
+
+    output = Queue()
+    node.subscribe(node.Topic.LINE_STREAM, output.put)
+    node.write(LineBatch(lines=LINES[:2], first_line_number=0))
+    node.write(LineBatch(lines=LINES[2:], first_line_number=2))
+
+    lines = []
+    while output.qsize():
+        lines += output.get_nowait().lines
+    assert lines == expected_lines
+    assert (
+        node._bytes_history.read()
+        == "".join(f"{line}\n" for line in expected_lines).encode()
+    )
+    node.close()
+
+
+def test_native_filters_in_a_tree():
+    """Native filters are fed their parent's lines, history included, and can feed
+    process filters in turn"""
+    root = GenericProcessIO(name="root", command="cat")
+    root.write(b"before\nERROR one\nERR")
+
+    errors = SubstringFilterNode(name="errors", substring="ERROR")
+    root.add_child(errors)
+    words = CutFilterNode(name="words", fields=[2])
+    errors.add_child(words)
+    process = GenericProcessIO(name="process", command="cat")
+    words.add_child(process)
+
+    output = Queue()
+    process.subscribe(process.Topic.BYTES_DATA_STREAM, output.put)
+    root.write(b"OR two\nfine\n")
+    drain_until_queue_equals(output, b"one\ntwo\n")
+
+    # Closing the root closes the native filters and their children
+    root.close()
+    assert not words._running
+    assert not process._running
+
+
+def test_pausing_a_native_filter_pauses_its_parent():
+    root = GenericProcessIO(name="root", command="cat")
+    native = RegexFilterNode(name="native", pattern=".")
+    root.add_child(native)
+
+    native._pause_reading()
+    reactor.run(lambda: None)
+    assert root._read_pauses == 1
+    native._resume_reading()
+    reactor.run(lambda: None)
+    assert root._read_pauses == 0
+    root.close()
+
+
+def test_match_stage_shares_one_scan():
+    """Sibling match filters are matched by a single subscription to their parent,
+    and get the same output as if they'd each filtered every line themselves"""
+    root = GenericProcessIO(name="root", command="cat")
+    root._record_and_publish(b"ERROR in history\n")
+
+    filters = [
+        SubstringFilterNode(name="errors", substring="ERROR"),
+        SubstringFilterNode(name="not info", substring="INFO", invert=True),
+        RegexFilterNode(name="warn", pattern="^warn", ignore_case=True),
+        RegexFilterNode(name="spanning", pattern=r"full\s+warn"),
+        RegexFilterNode(name="not errors", pattern="error", invert=True),
+        # Backreferences and \A can't be combined with the other patterns
+        RegexFilterNode(name="backreference", pattern=r"(\w)\1"),
+        RegexFilterNode(name="anchored", pattern=r"\AINFO"),
+        RegexFilterNode(name="everything", pattern=""),
+    ]
+    outputs = {}
+    for filter in filters:
+        outputs[filter.name] = Queue()
+        filter.subscribe(filter.Topic.LINE_STREAM, outputs[filter.name].put)
+        root.add_child(filter)
+    reactor.run(lambda: None)
+
+    assert len(root._subscribers[root.Topic.LINE_STREAM]) == 1
+    stage = root._match_stage
+    assert len(stage._filters) == len(filters)
+    # Substrings and the regular expressions that can be combined are all scanned for
+    # with one alternation
+    assert stage._combined.pattern == (
+        "ERROR|INFO|(?i:^warn)|(?:full\\s+warn)|(?:error)|(?:)"
+    )
+
+    root._record_and_publish("\n".join(LINES + ["aab", ""]).encode())
+
+    for filter in filters:
+        lines = []
+        while outputs[filter.name].qsize():
+            lines += outputs[filter.name].get_nowait().lines
+        history = ["ERROR in history"] + LINES + ["aab"]
+        assert lines == filter._filter_lines(history), filter.name
+    root.close()
+
+
+@pytest.mark.parametrize(
+    ("pattern", "expected_output"),
+    [
+        (r"(?<!\s)ERROR", b"first\nend ERROR\nfine\n"),
+        (r"ERROR(?!\s)", b"first\nERROR at start\nfine\n"),
+    ],
+)
+def test_match_stage_lookarounds(pattern, expected_output):
+    """Lookarounds would see the newlines between the lines of a batch, so they're
+    matched a line at a time, rather than in the shared scan"""
+    root = GenericProcessIO(name="root", command="cat")
+    filter = RegexFilterNode(name="lookaround", pattern=pattern, invert=True)
+    root.add_child(filter)
+    reactor.run(lambda: None)
+    assert root._match_stage._combined is None
+
+    root._record_and_publish(b"first\nERROR at start\nend ERROR\nfine\n")
+    assert filter._bytes_history.read() == expected_output
+    root.close()
+
+
+def test_match_stage_clashing_group_names():
+    """Patterns that can't be combined, such as two with the same group name, are
+    matched on their own"""
+    root = GenericProcessIO(name="root", command="cat")
+    first = RegexFilterNode(name="first", pattern=r"user (?P<id>\d+)")
+    second = RegexFilterNode(name="second", pattern=r"job (?P<id>\d+)")
+    root.add_child(first)
+    root.add_child(second)
+    reactor.run(lambda: None)
+    assert root._match_stage._unshared == {second}
+
+    root._record_and_publish(b"user 1\njob 2\nuser x\n")
+    assert first._bytes_history.read() == b"user 1\n"
+    assert second._bytes_history.read() == b"job 2\n"
+    root.close()
+
+
+def test_match_stage_onboards_late_filters():
+    root = GenericProcessIO(name="root", command="cat")
+    early = SubstringFilterNode(name="early", substring="a")
+    root.add_child(early)
+    reactor.run(lambda: None)
+    root._record_and_publish(b"apple\nbanana\ncherry\n")
+
+    late = SubstringFilterNode(name="late", substring="e")
+    root.add_child(late)
+    reactor.run(lambda: None)
+    root._record_and_publish(b"date\nfig\n")
+
+    assert early._bytes_history.read() == b"apple\nbanana\ndate\n"
+    assert late._bytes_history.read() == b"apple\ncherry\ndate\n"
+    root.close()
+
+
+def test_fused_chain():
+    root = GenericProcessIO(name="root", command="cat")
+    errors = SubstringFilterNode(name="errors", substring="ERROR")
+    not_disk = RegexFilterNode(name="not disk", pattern="disk", invert=True)
+    words = CutFilterNode(name="words", fields=[2])
+    root.add_child(errors)
+    errors.add_child(not_disk)
+    not_disk.add_child(words)
+    reactor.run(lambda: None)
+    root._record_and_publish(b"ERROR before fusing\n")
+
+    chain = FusedChain([errors, not_disk, words])
+    root._record_and_publish(b"ERROR disk full\nERROR while fused\nINFO skipped\n")
+
+    # Only the tail records and publishes output while the chain is fused
+    assert words._bytes_history.read() == b"before\nwhile\n"
+    assert errors._bytes_history.read() == b"ERROR before fusing\n"
+    assert not_disk._bytes_history.read() == b"ERROR before fusing\n"
+
+    # Subscribing to a filter in the middle of the chain dissolves it, and fills in
+    # the output that was skipped
+    output = Queue()
+    not_disk.subscribe_with_history(
+        not_disk.Topic.BYTES_DATA_STREAM, output.put, blocking=True
+    )
+    assert errors._fusion is not_disk._fusion is words._fusion is None
+    assert errors._bytes_history.read() == (
+        b"ERROR before fusing\nERROR disk full\nERROR while fused\n"
+    )
+    assert output.get_nowait() == b"ERROR before fusing\nERROR while fused\n"
+
+    root._record_and_publish(b"ERROR after dissolving\n")
+    assert output.get_nowait() == b"ERROR after dissolving\n"
+    assert words._bytes_history.read() == b"before\nwhile\nafter\n"
+    chain.dissolve()
+    root.close()
@@ -0,0 +1,95 @@
+from queue import Queue
+
+from groklog.process_node import GenericProcessIO, ParallelProcessIO
+from groklog.process_node.reactor import reactor
+from tests.utils import drain_until_queue_equals
+
+
+def test_output_is_in_order():
+    """Chunks that finish early are held back until every chunk before them has
+    been published"""
+    # Lines starting with "slow" take their worker longer to filter
+    command = (
+        "while read line; do case $line in slow*) sleep 0.2;; esac; echo $line; done"
+    )
+    process = ParallelProcessIO(name="", command=command, workers=4)
+    output = Queue()
+    process.subscribe(process.Topic.BYTES_DATA_STREAM, output.put)
+
+    expected = b""
+    for i in range(8):
+        line = f"{'slow' if i % 3 == 0 else 'fast'} {i}\n".encode()
+        process.write(line)
+        expected += line
+        reactor.run(lambda: None)
+
+    drain_until_queue_equals(output, expected, timeout=10)
+    assert process._bytes_history.read() == expected
+    process.close()
+
+
+def test_incomplete_lines_wait_for_the_rest():
+    process = ParallelProcessIO(name="", command="cat", workers=2)
+    output = Queue()
+    process.subscribe(process.Topic.BYTES_DATA_STREAM, output.put)
+
+    process.write(b"first li")
+    reactor.run(lambda: None)
+    assert process._pending == b"first li"
+    assert not process._chunks
+
+    process.write(b"ne\nsecond")
+    drain_until_queue_equals(output, b"first line\n")
+    process.close()
+
+
+def test_in_a_tree():
+    root = GenericProcessIO(name="root", command="cat")
+    parallel = ParallelProcessIO(name="parallel", command="grep --line-buffered b")
+    root.add_child(parallel)
+    child = GenericProcessIO(name="child", command="cat")
+    parallel.add_child(child)
+
+    output = Queue()
+    child.subscribe(child.Topic.BYTES_DATA_STREAM, output.put)
+    root.write(b"abc\ndef\nbcd\n" * 100)
+    drain_until_queue_equals(output, b"abc\nbcd\n" * 100, timeout=10)
+    root.close()
+    assert not parallel._running
+    assert len(parallel._chunks) == 0
+
+
+def test_workers_are_reused():
+    """Every chunk is filtered by one of a fixed pool of long-lived workers"""
+    command = "while read line; do echo $PPID $line; done"
+    process = ParallelProcessIO(name="", command=command, workers=2)
+    output = Queue()
+    process.subscribe(process.Topic.STRING_DATA_STREAM, output.put)
+
+    for i in range(10):
+        process.write(f"{i}\n".encode())
+        reactor.run(lambda: None)
+
+    lines = []
+    while len(lines) < 10:
+        lines += output.get(timeout=5).splitlines()
+    assert [line.split()[1] for line in lines] == [str(i) for i in range(10)]
+    assert len({line.split()[0] for line in lines}) == 2
+    process.close()
+
+
+def test_commands_that_stop_reading():
+    """A command that exits before reading all of its chunk doesn't put the worker out
+    of step with the chunks after it"""
+    process = ParallelProcessIO(name="", command="head -n 1", workers=1)
+    output = Queue()
+    process.subscribe(process.Topic.BYTES_DATA_STREAM, output.put)
+
+    for i in range(0, 6, 2):
+        # The worker is handed both chunks before it has finished the first
+        for chunk in (i, i + 1):
+            # More than a pipe holds, so it's still being written when head exits
+            process.write(f"{chunk} first\n".encode() + b"more\n" * 100_000)
+            reactor.run(lambda: None)
+        drain_until_queue_equals(output, f"{i} first\n{i + 1} first\n".encode())
+    process.close()
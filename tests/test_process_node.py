@@ -2,7 +2,12 @@ from queue import Queue
 
 import pytest
 
-from groklog.process_node import GenericProcessIO, ShellProcessIO
+from groklog.process_node import (
+    GenericProcessIO,
+    HistoryBackend,
+    RetentionPolicy,
+    ShellProcessIO,
+)
 from tests.utils import drain_until_queue_equals
 
 
@@ -30,16 +35,19 @@ def test_generic_process(
     output = b""
     drain_until_queue_equals(output_queue, expected_output_bytes)
 
-    assert process._bytes_history == expected_output_bytes
-    assert process._string_history == expected_output_bytes.decode("utf-8", "replace")
+    assert process._bytes_history.read() == expected_output_bytes
+    assert "".join(process._decode_history()[0]) == expected_output_bytes.decode(
+        "utf-8", "replace"
+    )
     process.close()
 
 
-def test_history_is_passed():
-    process = GenericProcessIO(name="", command="cat")
+@pytest.mark.parametrize("history_backend", HistoryBackend)
+def test_history_is_passed(history_backend: HistoryBackend):
+    process = GenericProcessIO(name="", command="cat", history_backend=history_backend)
 
-    assert process._bytes_history == b""
-    assert process._string_history == ""
+    assert process._bytes_history.read() == b""
+    assert "".join(process._decode_history()[0]) == ""
 
     # Subscribe and assert that on subscription, if the history is empty, that
     # the subscriber isn't called
@@ -72,3 +80,101 @@ def test_history_is_passed():
 
     # Close resources
     process.close()
+    if history_backend is HistoryBackend.DISK:
+        assert not process._bytes_history.directory.exists()
+
+
+def test_string_stream_decodes_split_characters():
+    """Characters split across reads should be decoded once the rest arrives, and
+    nothing should be decoded while there are no string subscribers"""
+    process = GenericProcessIO(name="", command="cat")
+    text = "héllo wörld ☃\n"
+    data = text.encode()
+
+    # Without string subscribers, nothing is decoded
+    process._record_and_publish(data[:2])
+    assert process._decoder is None
+
+    string_subscriber = Queue()
+    process.subscribe_with_history(
+        process.Topic.STRING_DATA_STREAM, string_subscriber.put, blocking=True
+    )
+    assert string_subscriber.get_nowait() == "h"
+
+    # The history ended in the middle of "é", so decoding carries on from there
+    for i in range(2, len(data)):
+        process._record_and_publish(data[i : i + 1])
+    drain_until_queue_equals(string_subscriber, text[1:])
+    assert "".join(process._decode_history()[0]) == text
+
+    # Once the subscriber is gone, decoding stops
+    del string_subscriber
+    process._record_and_publish(b"more")
+    process._record_and_publish(b"more")
+    assert process._decoder is None
+    process.close()
+
+
+def test_string_history_skips_evicted_partial_characters():
+    process = GenericProcessIO(
+        name="", command="cat", retention=RetentionPolicy(max_bytes=4)
+    )
+    process._record_and_publish("aaé☃".encode())
+    assert "".join(process._decode_history()[0]) == "☃"
+    process.close()
+
+
+def test_line_stream():
+    """Lines split across reads are published whole, with their line numbers and
+    byte offsets, and new subscribers get the history as lines"""
+    process = GenericProcessIO(name="", command="cat")
+    process._record_and_publish(b"before\nsubscribing")
+
+    batches = Queue()
+    process.subscribe_with_history(
+        process.Topic.LINE_STREAM, batches.put, blocking=True
+    )
+    history_batch = batches.get_nowait()
+    assert history_batch.lines == ["before"]
+    assert list(history_batch.offsets) == [0]
+
+    for chunk in [b" first\nsecond", b" line", b"\nthird\nfourth"]:
+        process._record_and_publish(chunk)
+
+    first, second = batches.get_nowait(), batches.get_nowait()
+    assert batches.qsize() == 0
+    assert first.lines == ["subscribing first"]
+    assert first.first_line_number == 1
+    assert list(first.offsets) == [len(b"before\n")]
+    assert second.lines == ["second line", "third"]
+    assert list(second.line_numbers) == [2, 3]
+    assert list(second.offsets) == [len(b"before\nsubscribing first\n"), 37]
+
+    # Subscribing without history carries on from the incomplete line
+    late_batches = Queue()
+    process.subscribe(process.Topic.LINE_STREAM, late_batches.put)
+    process._record_and_publish(b"\n")
+    assert late_batches.get_nowait().lines == ["fourth"]
+    process.close()
+
+
+def test_get_lines_and_tail():
+    process = GenericProcessIO(
+        name="", command="cat", retention=RetentionPolicy(max_lines=3)
+    )
+    for i in range(10):
+        process._record_and_publish(f"line {i}\n".encode())
+    process._record_and_publish("ünfinished".encode())
+
+    assert process.line_count() == 10
+    batch = process.get_lines(8)
+    assert batch.lines == ["line 8", "line 9"]
+    assert list(batch.line_numbers) == [8, 9]
+    assert list(batch.offsets) == [len(b"line 0\n") * 8, len(b"line 0\n") * 9]
+
+    # Evicted lines are skipped, and the incomplete line is never returned
+    assert process.get_lines(0, 8).lines == ["line 7"]
+    assert process.get_lines(10).lines == []
+    assert process.tail(2).lines == ["line 8", "line 9"]
+    assert process.tail(100).first_line_number == 7
+    process.close()
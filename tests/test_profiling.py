@@ -0,0 +1,56 @@
+import pstats
+from functools import partial
+from queue import Queue
+from threading import Event
+
+from groklog.process_node import GenericProcessIO, SubstringFilterNode
+from groklog.process_node.reactor import reactor
+from groklog.profiling import Profiler, StackSampler, _callback_owner
+from tests.utils import drain_until_queue_equals
+
+
+def test_profiles_each_node(tmp_path):
+    profiler = Profiler(tmp_path)
+    profiler.start()
+    node = GenericProcessIO(name="cat/1", command="cat")
+    output = Queue()
+    node.subscribe(node.Topic.BYTES_DATA_STREAM, output.put)
+    node.write(b"hello\n")
+    drain_until_queue_equals(output, b"hello\n")
+
+    with profiler.profile_thread():
+        sum(range(1000))
+    node.close()
+
+    paths = profiler.stop()
+    assert reactor.call_wrapper is None
+    names = {path.name for path in paths}
+    assert {"node-cat_1.pstats", "ui.pstats", "samples.txt"} <= names
+
+    stats = pstats.Stats(str(tmp_path / "node-cat_1.pstats"))
+    functions = {function for _, _, function in stats.stats}
+    assert "_on_readable" in functions
+
+
+def test_callback_owner():
+    node = GenericProcessIO(name="", command="cat")
+    child = SubstringFilterNode(name="child", substring="a")
+    node.add_child(child)
+    reactor.run(lambda: None)
+
+    assert _callback_owner(node._on_readable) is node
+    assert _callback_owner(partial(node._change_read_pauses, 1)) is node
+    assert _callback_owner(lambda: node._on_readable()) is node
+    # Helpers that hold on to their node
+    assert _callback_owner(node._coalescer.flush) is node
+    assert _callback_owner(node._match_stage.write) is node
+    assert _callback_owner(lambda: None) is None
+    node.close()
+
+
+def test_sampler_categorizes_stacks():
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    Event().wait(0.2)
+    sampler.stop()
+    assert sampler.breakdown()["UI"]["idle"] > 0.5
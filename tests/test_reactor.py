@@ -0,0 +1,80 @@
+import os
+from queue import Queue
+from threading import current_thread
+from time import monotonic
+
+from groklog.process_node import GenericProcessIO
+from groklog.process_node.reactor import Reactor
+from tests.utils import drain_until_queue_equals
+
+
+def test_reader_callbacks():
+    reactor = Reactor()
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    received = Queue()
+
+    reactor.acquire()
+    reactor.add_reader(read_fd, lambda: received.put(os.read(read_fd, 1024)))
+    os.write(write_fd, b"hello")
+    assert received.get(timeout=5) == b"hello"
+
+    # Callbacks run in the reactor thread
+    reactor.run(lambda: received.put(current_thread().name))
+    assert received.get_nowait() == "Reactor Thread"
+
+    reactor.remove_reader(read_fd)
+    reactor.release()
+    assert reactor._thread is None
+
+    os.close(read_fd)
+    os.close(write_fd)
+
+
+def test_many_nodes_share_one_thread():
+    """A chain of process nodes should be read by the single reactor thread"""
+    processes = [GenericProcessIO(name=str(i), command="cat") for i in range(10)]
+    for parent, child in zip(processes, processes[1:]):
+        parent.add_child(child)
+
+    output = Queue()
+    processes[-1].subscribe(processes[-1].Topic.BYTES_DATA_STREAM, output.put)
+    processes[0].write(b"through the chain\n")
+    drain_until_queue_equals(output, b"through the chain\n")
+
+    # Closing the root closes its children
+    processes[0].close()
+
+
+def test_slow_child_does_not_block_parent():
+    """Writing more to a child than its stdin pipe can hold shouldn't block"""
+    process = GenericProcessIO(name="", command="sleep 1 && cat")
+    big_input = b"x" * 1024 * 1024
+    process.write(big_input)
+    assert len(process._input_buffer) > 0
+
+    output = Queue()
+    process.subscribe_with_history(
+        process.Topic.BYTES_DATA_STREAM, output.put, blocking=False
+    )
+    drain_until_queue_equals(output, big_input, timeout=10)
+    process.close()
+
+
+def test_call_later():
+    reactor = Reactor()
+    reactor.acquire()
+    calls = Queue()
+
+    start = monotonic()
+    reactor.call_later(0.1, lambda: calls.put(("late", monotonic() - start)))
+    reactor.call_later(0.05, lambda: calls.put(("early", monotonic() - start)))
+    cancelled = reactor.call_later(0.01, lambda: calls.put(("cancelled", 0)))
+    cancelled.cancel()
+
+    name, elapsed = calls.get(timeout=5)
+    assert name == "early" and elapsed >= 0.05
+    name, elapsed = calls.get(timeout=5)
+    assert name == "late" and elapsed >= 0.1
+    assert calls.qsize() == 0
+    reactor.release()
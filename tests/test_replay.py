@@ -0,0 +1,119 @@
+from queue import Queue
+
+import pytest
+
+from groklog.process_node import (
+    GenericProcessIO,
+    HistoryBackend,
+    Replay,
+    RetentionPolicy,
+)
+from groklog.process_node.history import ChunkedHistory
+
+OUTPUT = b"zero\none\ntwo\nthree\npartial"
+
+
+@pytest.mark.parametrize(
+    ("replay", "expected_start"),
+    [
+        (Replay.full(), 3),
+        (Replay.from_byte(10), 10),
+        (Replay.from_byte(0), 3),
+        (Replay.from_byte(1000), len(OUTPUT)),
+        (Replay.from_line(2), len(b"zero\none\n")),
+        # The start of line 0 was evicted
+        (Replay.from_line(0), 3),
+        (Replay.from_line(100), len(b"zero\none\ntwo\nthree\n")),
+        (Replay.last_bytes(4), len(OUTPUT) - 4),
+        (Replay.last_bytes(1000), 3),
+        (Replay.last_lines(0), len(b"zero\none\ntwo\nthree\n")),
+        (Replay.last_lines(2), len(b"zero\none\n")),
+        (Replay.last_lines(1000), 3),
+        (Replay.live(), len(OUTPUT)),
+    ],
+)
+def test_start_offset(replay, expected_start):
+    history = ChunkedHistory(b"", RetentionPolicy(max_bytes=len(OUTPUT) - 3))
+    history.append(OUTPUT)
+    assert replay.start_offset(history) == expected_start
+
+
+@pytest.mark.parametrize(
+    ("replay", "expected_bytes", "expected_lines", "expected_string"),
+    [
+        (Replay.full(), OUTPUT, ["zero", "one", "two", "three"], OUTPUT.decode()),
+        (Replay.last_lines(1), b"three\npartial", ["three"], "three\npartial"),
+        (Replay.from_byte(6), OUTPUT[6:], ["ne", "two", "three"], OUTPUT[6:].decode()),
+        (Replay.live(), b"", [], ""),
+    ],
+)
+@pytest.mark.parametrize("history_backend", list(HistoryBackend))
+def test_subscribe_with_replay(
+    replay, expected_bytes, expected_lines, expected_string, history_backend
+):
+    process = GenericProcessIO(name="", command="cat", history_backend=history_backend)
+    process._record_and_publish(OUTPUT)
+
+    topics = {
+        process.Topic.BYTES_DATA_STREAM: Queue(),
+        process.Topic.LINE_STREAM: Queue(),
+        process.Topic.STRING_DATA_STREAM: Queue(),
+    }
+    for topic, queue in topics.items():
+        process.subscribe_with_history(topic, queue.put, blocking=True, replay=replay)
+
+    # New output carries on from the end of the history, whatever was replayed
+    process._record_and_publish(b"\n")
+
+    def drain(queue):
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    assert b"".join(drain(topics[process.Topic.BYTES_DATA_STREAM])) == (
+        expected_bytes + b"\n"
+    )
+    assert [
+        line
+        for batch in drain(topics[process.Topic.LINE_STREAM])
+        for line in batch.lines
+    ] == expected_lines + ["partial"]
+    assert "".join(drain(topics[process.Topic.STRING_DATA_STREAM])) == (
+        expected_string + "\n"
+    )
+    process.close()
+
+
+def test_replay_is_batched(monkeypatch):
+    monkeypatch.setattr(GenericProcessIO, "_REPLAY_BATCH_BYTES", 4)
+    process = GenericProcessIO(name="", command="cat")
+    process._record_and_publish("ab☃cd\nefgh\n".encode())
+
+    received = Queue()
+    process.subscribe_with_history(
+        process.Topic.BYTES_DATA_STREAM, received.put, blocking=True
+    )
+    assert [received.get_nowait() for _ in range(received.qsize())] == [
+        b"ab\xe2\x98",
+        b"\x83cd\n",
+        b"efgh",
+        b"\n",
+    ]
+    process.unsubscribe(process.Topic.BYTES_DATA_STREAM, received.put)
+
+    # Characters and lines split across batches are put back together
+    process.subscribe_with_history(
+        process.Topic.STRING_DATA_STREAM, received.put, blocking=True
+    )
+    assert [received.get_nowait() for _ in range(received.qsize())] == [
+        "ab",
+        "☃cd\n",
+        "efgh",
+        "\n",
+    ]
+    process.subscribe_with_history(
+        process.Topic.LINE_STREAM, received.put, blocking=True
+    )
+    assert [received.get_nowait().lines for _ in range(received.qsize())] == [
+        ["ab☃cd"],
+        ["efgh"],
+    ]
+    process.close()
@@ -0,0 +1,72 @@
+import json
+from queue import Queue
+
+import pytest
+
+from groklog.process_node import GenericProcessIO, SubstringFilterNode
+from groklog.process_node.reactor import reactor
+from groklog.process_node.tracing import Tracer, tracer
+from tests.utils import drain_until_queue_equals
+
+
+@pytest.fixture()
+def tracing():
+    tracer.start()
+    yield tracer
+    tracer.stop()
+
+
+def test_traces_chunks_through_tree(tracing):
+    """Chunks are tagged with the chunk they came from, through process children and
+    native filters alike"""
+    root = GenericProcessIO(name="root", command="cat")
+    child = GenericProcessIO(name="child", command="cat")
+    grandchild = SubstringFilterNode(name="grandchild", substring="b")
+    root.add_child(child)
+    child.add_child(grandchild)
+    output = Queue()
+    grandchild.subscribe(grandchild.Topic.BYTES_DATA_STREAM, output.put)
+
+    root.write(b"a\nb\n")
+    drain_until_queue_equals(output, b"b\n")
+    reactor.run(lambda: None)
+
+    publishes = {
+        event.name: event.tags[0] for event in tracing.events if event.kind == "publish"
+    }
+    assert publishes.keys() == {"root", "child", "grandchild"}
+    origin = publishes["root"]
+    assert origin.parent is None and origin.origin == origin.sequence
+    assert publishes["child"].parent == origin.sequence
+    assert publishes["grandchild"].parent == publishes["child"].sequence
+    assert publishes["grandchild"].origin == origin.sequence
+    assert publishes["grandchild"].read_time == origin.read_time
+
+    writes = [event for event in tracing.events if event.kind == "write"]
+    assert [(event.name, event.tags) for event in writes] == [("child", (origin,))]
+
+    root.close()
+
+
+def test_export(tmp_path):
+    local_tracer = Tracer()
+    local_tracer.start()
+    node = SubstringFilterNode(name="node", substring="b")
+    tag = local_tracer.begin_chunk(node)
+    local_tracer.end_chunk(node)
+    for kind in ("colour", "queue", "render"):
+        local_tracer.record(kind, "node", tag.read_time, tag.read_time + 0.001, tag)
+
+    assert local_tracer.export(tmp_path / "trace.json") == 4
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    phases = [event["ph"] for event in trace["traceEvents"]]
+    assert phases.count("X") == 3
+    # Waits in the queue are async events, and aren't part of the flow
+    assert phases.count("b") == phases.count("e") == 1
+    assert [phase for phase in phases if phase in "stf"] == ["s", "t", "f"]
+    assert phases.count("M") == 1
+
+    summary = local_tracer.summary()
+    assert summary["render", "node"].count == 1
+    assert summary["render", "node"].max_ms == pytest.approx(1)
+    node.close()